@@ -54,6 +54,7 @@ setuptools.setup(
         'vavilov3': ['templates/*.html']
     },
     install_requires=requeriments,
+    extras_require={'arrow': ['pyarrow']},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU Affero General Public License v3 or later (AGPLv3+)",
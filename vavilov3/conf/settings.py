@@ -15,6 +15,7 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 from os.path import abspath, join, dirname
+from tempfile import gettempdir
 from django.conf import settings
 
 TEMPLATE_DIR = abspath(join(dirname(__file__), '..', 'templates'))
@@ -64,6 +65,8 @@ OBSERVATION_CSV_FIELDS = getattr(settings, 'VAVILOV3_OBSERVATION_CSV_FIELDS',
 
 PHENO_IMAGE_DIR = getattr(settings, 'VAVILOV3_PHENO_IMAGE_DIR',
                           'phenotype_images')
+# the images are stored once by content in this dir of the pheno image dir
+IMAGE_BLOB_DIR = getattr(settings, 'VAVILOV3_IMAGE_BLOB_DIR', 'blobs')
 
 LONG_PROCESS_TIMEOUT = getattr(settings, 'VAVILOV3_LONG_PROCESS_TIMEOUT',
                                14400)
@@ -92,3 +95,73 @@ SEED_REQUEST_MAIL_DEBUG_TO = getattr(settings, 'VAVILOV3_SEED_REQUEST_MAIL_DEBUG
 EMAIL_DEBUG = getattr(settings, 'VAVILOV3_EMAIL_DEBUG', False)
 RECAPTCHA_SECRET = getattr(settings, 'VAVILOV3_RECAPTCHA_SECRET', None)
 RECAPTCHA_VERIFY_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+# number of rows sent to the database in each bulk insert
+BULK_CREATE_BATCH_SIZE = getattr(settings, 'VAVILOV3_BULK_CREATE_BATCH_SIZE',
+                                 1000)
+
+# number of items validated and processed at once in the bulk uploads
+BULK_CHUNK_SIZE = getattr(settings, 'VAVILOV3_BULK_CHUNK_SIZE', 10000)
+# a bulk upload that reaches its time limit is retried this number of times,
+# every retry continues after the last committed chunk
+BULK_TASK_MAX_RETRIES = getattr(settings, 'VAVILOV3_BULK_TASK_MAX_RETRIES', 3)
+
+# big bulk uploads are split by institute or study and loaded in parallel
+BULK_PARTITIONS = getattr(settings, 'VAVILOV3_BULK_PARTITIONS', 4)
+BULK_PARTITION_MIN_ITEMS = getattr(settings, 'VAVILOV3_BULK_PARTITION_MIN_ITEMS',
+                                   50000)
+
+# the stats are cached until they are refreshed, this timeout only limits
+# the memory used by the stats of the less used variants
+STATS_CACHE_TIMEOUT = getattr(settings, 'VAVILOV3_STATS_CACHE_TIMEOUT',
+                              24 * 60 * 60)
+
+# the list endpoints return the planner estimate as total count when it is
+# bigger than this, the exact count is computed if it is asked (count=exact)
+# and cached for a while
+APPROXIMATE_COUNT_THRESHOLD = getattr(
+    settings, 'VAVILOV3_APPROXIMATE_COUNT_THRESHOLD', 100000)
+EXACT_COUNT_CACHE_TIMEOUT = getattr(settings,
+                                    'VAVILOV3_EXACT_COUNT_CACHE_TIMEOUT', 300)
+
+# seconds during which the observation variable registry of a process
+# trusts its variables without checking their version in the database
+REGISTRY_CHECK_INTERVAL = getattr(settings, 'VAVILOV3_REGISTRY_CHECK_INTERVAL',
+                                  5)
+
+# seconds that the task registry keeps the tasks of the users, and the
+# internal tasks without owner, that are never listed
+TASK_RECORD_RETENTION = getattr(settings, 'VAVILOV3_TASK_RECORD_RETENTION',
+                                30 * 24 * 60 * 60)
+UNOWNED_TASK_RECORD_RETENTION = getattr(
+    settings, 'VAVILOV3_UNOWNED_TASK_RECORD_RETENTION', 24 * 60 * 60)
+
+# number of rows read from the database at once in the csv exports
+CSV_EXPORT_CHUNK_SIZE = getattr(settings, 'VAVILOV3_CSV_EXPORT_CHUNK_SIZE',
+                                2000)
+
+# the exports are written out of the public media, in this directory that
+# must be shared by the web server and celery. They are only served to the
+# owner of the export task, and removed after the retention time (in seconds)
+EXPORT_ROOT = getattr(settings, 'VAVILOV3_EXPORT_ROOT',
+                      join(TMP_DIR or gettempdir(), 'vavilov3_exports'))
+EXPORT_RETENTION = getattr(settings, 'VAVILOV3_EXPORT_RETENTION',
+                           7 * 24 * 60 * 60)
+
+# number of observation units by record batch in the observation matrices
+OBSERVATION_MATRIX_BATCH_SIZE = getattr(
+    settings, 'VAVILOV3_OBSERVATION_MATRIX_BATCH_SIZE', 10000)
+
+# the image thumbnails are made by a task sent to this celery queue, so a
+# pool of workers can be dedicated to them. None uses the default queue
+THUMBNAIL_QUEUE = getattr(settings, 'VAVILOV3_THUMBNAIL_QUEUE', None)
+THUMBNAIL_MAX_RETRIES = getattr(settings, 'VAVILOV3_THUMBNAIL_MAX_RETRIES', 3)
+
+# the orphan media sweeper reads the storage and the database by chunks of
+# this size, and does not touch the files newer than the grace period (in
+# seconds), they could belong to an upload not committed yet
+MEDIA_SWEEP_CHUNK_SIZE = getattr(settings, 'VAVILOV3_MEDIA_SWEEP_CHUNK_SIZE',
+                                 10000)
+MEDIA_SWEEP_GRACE_PERIOD = getattr(settings,
+                                   'VAVILOV3_MEDIA_SWEEP_GRACE_PERIOD',
+                                   24 * 60 * 60)
@@ -19,13 +19,30 @@ from os import remove
 from os.path import isfile
 import logging
 
-from django.db.models.signals import post_delete, pre_save, m2m_changed
+from django.db.models.signals import (post_delete, post_save, pre_save,
+                                      m2m_changed)
+from django.db import transaction
 from django.dispatch.dispatcher import receiver
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 
-from vavilov3.models import ObservationImage, Observation
+from celery.signals import (before_task_publish, task_prerun, task_postrun,
+                            task_revoked)
+
+from vavilov3.models import (ObservationImage, Observation,
+                             ObservationVariable, Scale, Institute,
+                             Group as GroupProxy,
+                             release_image_blob, bump_data_versions,
+                             ACCESSION_DATA, ACCESSIONSET_DATA,
+                             OBSERVATION_DATA)
 from vavilov3.conf.settings import ADMIN_GROUP
+from vavilov3.permissions import clear_permission_context
+from vavilov3.entities.observation_variable import observation_variable_registry
+from vavilov3.tasks import enqueue_observation_image_thumbnails
+from vavilov3.entities.task_record import (register_task_published,
+                                           register_task_started,
+                                           register_task_finished,
+                                           register_task_revoked)
 
 User = get_user_model()
 logger = logging.getLogger('vavilov.prod')
@@ -45,24 +62,55 @@ def manage_staff_by_admin_group(action, instance, **kwargs):
             instance.is_staff = False
 
 
+@receiver(m2m_changed, sender=User.groups.through)
+def clear_user_permission_context(action, instance, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        clear_permission_context(instance)
+
+
+@receiver(post_save, sender=ObservationVariable)
+@receiver(post_delete, sender=ObservationVariable)
+@receiver(post_save, sender=Scale)
+@receiver(post_delete, sender=Scale)
+def invalidate_observation_variable_registry(**kwargs):
+    observation_variable_registry.invalidate()
+
+
+# the exports show the institute codes and the group names, they are made
+# again when any of them changes
+@receiver(post_save, sender=Institute)
+@receiver(post_delete, sender=Institute)
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=GroupProxy)
+@receiver(post_delete, sender=GroupProxy)
+def invalidate_exports(**kwargs):
+    bump_data_versions(ACCESSION_DATA, ACCESSIONSET_DATA, OBSERVATION_DATA)
+
+
 @receiver(post_delete, sender=ObservationImage)
 def auto_delete_file_on_delete(sender, instance, **kwargs):
     """
     Deletes file from filesystem
     when corresponding `ObservationImage` object is deleted.
+    The files stored by content are removed with their last image.
     """
+    if instance.blob_id is not None:
+        release_image_blob(instance.blob_id)
+        return
+
     if instance.image:
         path = instance.image.path
         if isfile(path):
             remove(path)
 
     if instance.image_medium:
-        path = instance.image_small.path
+        path = instance.image_medium.path
         if isfile(path):
             remove(path)
 
     if instance.image_small:
-        path = instance.image_medium.path
+        path = instance.image_small.path
         if isfile(path):
             remove(path)
 
@@ -84,15 +132,27 @@ def auto_delete_file_on_change(sender, instance, **kwargs):
         return False
 
     new_image = instance.image
-    if not old_image == new_image:
-        paths = [old_image.path]
-        paths.append(new_instance.image_medium.path)
-        paths.append(new_instance.image_small.path)
+    if not old_image == new_image and new_instance.blob_id is None:
+        # the thumbnails could not be created yet
+        paths = [image.path for image in (old_image, new_instance.image_medium,
+                                          new_instance.image_small) if image]
         for path in paths:
             if isfile(path):
                 remove(path)
 
 
+@receiver(post_save, sender=ObservationImage)
+def create_thumbnails_on_create(sender, instance, created, **kwargs):
+    """
+    Sends the thumbnails of the new images to their queue once the image
+    is committed, so the ingestion does not wait for them.
+    """
+    if created and not (instance.image_medium and instance.image_small):
+        observation_image_id = instance.observation_image_id
+        transaction.on_commit(
+            lambda: enqueue_observation_image_thumbnails([observation_image_id]))
+
+
 @receiver(post_delete, sender=ObservationImage)
 def delete_observation_unit_if_orphan_on_delete_image(sender, instance,
                                                       **kwargs):
@@ -121,3 +181,27 @@ def _remove_orphan_observation_unit(observation_unit):
 
     if not obs and not obs_images:
         observation_unit.delete()
+
+
+# the task registry is written by the tasks, the task views do not ask the
+# workers
+@before_task_publish.connect
+def register_published_task(sender=None, headers=None, **kwargs):
+    headers = headers or {}
+    register_task_published(headers.get('id'), headers.get('task', sender))
+
+
+@task_prerun.connect
+def register_started_task(task_id=None, task=None, **kwargs):
+    register_task_started(task_id, task.name)
+
+
+@task_postrun.connect
+def register_finished_task(task_id=None, task=None, retval=None, state=None,
+                           **kwargs):
+    register_task_finished(task_id, task.name, state, retval)
+
+
+@task_revoked.connect
+def register_revoked_task(request=None, **kwargs):
+    register_task_revoked(getattr(request, 'id', None))
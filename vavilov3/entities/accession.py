@@ -15,12 +15,15 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import io
 import csv
+import json
 from datetime import datetime
 from copy import deepcopy
 from collections import OrderedDict
 
-from django.db import transaction
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction, connection
 from django.db.utils import IntegrityError
 
 from rest_framework.exceptions import ValidationError
@@ -33,16 +36,36 @@ from vavilov3.entities.metadata import Metadata
 from vavilov3.entities.passport import (PassportStruct,
                                         validate_passport_data,
                                         PASSPORT_CSV_FIELD_CONFS,
-                                        merge_passports)
+                                        merge_passports,
+                                        get_passports_taxa_names,
+                                        get_passports_country_codes)
 from vavilov3.models import (Group, Accession, Institute, DataSource,
-                             Country, Passport, Rank, Taxon)
+                             Country, Passport, Rank, Taxon, AccessionSummary,
+                             invalidate_institute_pdcis, bump_data_versions,
+                             ACCESSION_DATA)
 from vavilov3.entities.passport import PassportValidationError
-from vavilov3.permissions import is_user_admin
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.views import format_error_message
-from vavilov3.excel import excel_dict_reader
+from vavilov3.excel import excel_dict_reader, csv_dict_reader
 from decimal import InvalidOperation
 from vavilov3.id_validator import validate_id
-from vavilov3.conf.settings import VALID_TRUE_VALUES
+from vavilov3 import raw_copy_sql_commands
+from vavilov3.raw_summary_sql_commands import (
+    get_refresh_accession_summaries_sql, ACCESSION_IDS_FILTER,
+    STAGED_ACCESSIONS_FILTER, SYNC_ACCESSION_SUMMARY_PERMISSIONS)
+from vavilov3.entities.stats import refresh_entity_stats
+from vavilov3.conf.settings import VALID_TRUE_VALUES, BULK_CREATE_BATCH_SIZE
+
+
+INGESTION_MODE = 'ingestion_mode'
+COPY_INGESTION_MODE = 'copy'
+ORM_INGESTION_MODE = 'orm'
+INGESTION_MODES = (ORM_INGESTION_MODE, COPY_INGESTION_MODE)
+
+# requested fields that are built from the accession passports
+ACCESSION_PASSPORT_FIELDS = (PASSPORTS, 'latitude', 'longitude')
+# requested fields that are read from the accession summary
+ACCESSION_SUMMARY_FIELDS = {'genera', 'species', 'countries'}
 
 
 class AccessionValidationError(Exception):
@@ -230,14 +253,35 @@ class AccessionStruct():
                 (fields is None or IN_NUCLEAR_COLLECTION in fields)):
             self.in_nuclear_collection = instance.in_nuclear_collection
 
-        if instance.genera and fields and 'genera' in fields:
-            self.genera = instance.genera
+        summary = None
+        if fields and ACCESSION_SUMMARY_FIELDS.intersection(fields):
+            summary = _get_accession_summary(instance)
 
-        if instance.species and fields and 'species' in fields:
-            self.species = instance.species
+        if fields and 'genera' in fields:
+            if summary is None:
+                genera = get_passports_taxa_names(instance.passports.all(),
+                                                  'genus')
+            else:
+                genera = summary.genera
+            if genera:
+                self.genera = genera
+
+        if fields and 'species' in fields:
+            if summary is None:
+                species = get_passports_taxa_names(instance.passports.all(),
+                                                   'species')
+            else:
+                species = summary.species
+            if species:
+                self.species = species
 
-        if instance.countries and fields and 'countries' in fields:
-            self.countries = instance.countries
+        if fields and 'countries' in fields:
+            if summary is None:
+                countries = get_passports_country_codes(instance.passports.all())
+            else:
+                countries = summary.countries
+            if countries:
+                self.countries = countries
 
         if fields is None or (PASSPORTS in fields or 'latitude' in fields or 'longitude' in fields):
             passports = []
@@ -302,6 +346,41 @@ class AccessionStruct():
         self.passports = [_passport]
 
 
+def _get_accession_summary(instance):
+    try:
+        return instance.summary
+    except AccessionSummary.DoesNotExist:
+        return None
+
+
+def plan_accession_queryset(queryset, fields):
+    queryset = queryset.select_related('group')
+    if fields is None or INSTITUTE_CODE in fields:
+        queryset = queryset.select_related('institute')
+
+    fields = set(fields) if fields is not None else None
+    if fields and fields.intersection(ACCESSION_SUMMARY_FIELDS):
+        queryset = queryset.select_related('summary')
+    if fields is None or fields.intersection(ACCESSION_PASSPORT_FIELDS):
+        queryset = queryset.prefetch_related('passports')
+    return queryset
+
+
+def refresh_accession_summaries(accession_ids=None):
+    'It rebuilds the summary of the given accessions, or all of them'
+    with connection.cursor() as cursor:
+        if accession_ids is None:
+            cursor.execute(get_refresh_accession_summaries_sql())
+        else:
+            sql = get_refresh_accession_summaries_sql(ACCESSION_IDS_FILTER)
+            cursor.execute(sql, {'accession_ids': list(accession_ids)})
+
+
+def sync_accession_summary_permissions():
+    with connection.cursor() as cursor:
+        cursor.execute(SYNC_ACCESSION_SUMMARY_PERMISSIONS)
+
+
 _ACCESSION_CSV_FIELD_CONFS = [
     {'csv_field_name': 'PUID', 'getter': lambda x: x.puid,
      'setter': lambda obj, val: setattr(obj, 'puid', val)},
@@ -341,7 +420,7 @@ def create_accession_in_db(api_data, user, is_public=None):
     # in the doc we must enter whole document
     if is_public is None:
         is_public = False
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
     accession_struct.metadata.is_public = is_public
     accession_struct.metadata.group = group.name
 
@@ -362,9 +441,10 @@ def create_accession_in_db(api_data, user, is_public=None):
                              accession_struct.germplasm_number)
             raise ValueError(msg)
 
+        passport_institute_ids = set()
         for passport_struct in accession_struct.passports:
             try:
-                _create_passport_in_db(passport_struct, accession)
+                passport = _create_passport_in_db(passport_struct, accession)
             except InvalidOperation:
                 msg = '{}:{} longitude or latitude data is wrong- {} {}'
                 msg = msg.format(institute.code,
@@ -372,6 +452,11 @@ def create_accession_in_db(api_data, user, is_public=None):
                                  passport_struct.longitude,
                                  passport_struct.latitude)
                 raise ValueError(msg)
+            passport_institute_ids.add(passport.institute_id)
+        refresh_accession_summaries([accession.accession_id])
+        refresh_entity_stats([accession.institute_id])
+        invalidate_institute_pdcis(passport_institute_ids)
+        bump_data_versions(ACCESSION_DATA)
 
     return accession
 
@@ -454,6 +539,421 @@ def add_passport_taxas(passport, taxonomy):
         taxon.passport_set.add(passport)
 
 
+def _get_passport_location_values(passport_struct):
+    latitude = passport_struct.location.latitude
+    longitude = passport_struct.location.longitude
+    for field_name, value in (('latitude', latitude),
+                              ('longitude', longitude)):
+        if value is None:
+            continue
+        # this is the conversion that the database insert does
+        field = Passport._meta.get_field(field_name)
+        field.get_db_prep_save(value, connection)
+    return latitude, longitude
+
+
+def _collect_accession_lookup_keys(accession_structs):
+    institute_codes = set()
+    country_codes = set()
+    data_source_codes = set()
+    for accession_struct in accession_structs:
+        institute_codes.add(accession_struct.institute_code)
+        for passport_struct in accession_struct.passports:
+            institute_codes.add(passport_struct.institute_code)
+            if passport_struct.collection.institute:
+                institute_codes.add(passport_struct.collection.institute)
+            if passport_struct.location.country:
+                country_codes.add(passport_struct.location.country)
+            if passport_struct.data_source is not None:
+                data_source_codes.add(passport_struct.data_source)
+    return institute_codes, country_codes, data_source_codes
+
+
+def _check_accession_struct(accession_struct, lookups, accession_keys,
+                            passport_keys, data_sources):
+    institutes = lookups['institutes']
+    institute_code = accession_struct.institute_code
+    germplasm_number = accession_struct.germplasm_number
+    if institute_code not in institutes:
+        raise ValueError('{} does not exist in database'.format(institute_code))
+
+    accession_key = (institute_code, germplasm_number)
+    if accession_key in accession_keys:
+        msg = 'This accession already exists in db: {} {}'
+        raise ValueError(msg.format(institute_code, germplasm_number))
+
+    for passport_struct in accession_struct.passports:
+        if passport_struct.institute_code not in institutes:
+            msg = '{} does not exist in database'
+            raise ValueError(msg.format(passport_struct.institute_code))
+
+        data_source = passport_struct.data_source
+        if data_source is not None:
+            kind = data_sources.get(data_source, passport_struct.data_source_kind)
+            if kind is None or kind != passport_struct.data_source_kind:
+                msg = '{} already in database, it must be defined with a different'
+                msg += 'kind'
+                raise ValueError(msg.format(data_source))
+
+        country = passport_struct.location.country
+        if country and country not in lookups['countries']:
+            raise ValueError('{} country not in db'.format(country))
+
+        collecting_institute = passport_struct.collection.institute
+        if collecting_institute and collecting_institute not in institutes:
+            msg = '{}: {} does not exist in our database'
+            raise ValueError(msg.format(passport_struct.germplasm_number,
+                                        collecting_institute))
+        try:
+            _get_passport_location_values(passport_struct)
+        except (InvalidOperation, DjangoValidationError):
+            msg = '{}:{} longitude or latitude data is wrong- {} {}'
+            msg = msg.format(institute_code, germplasm_number,
+                             passport_struct.location.longitude,
+                             passport_struct.location.latitude)
+            raise ValueError(msg)
+
+        for rank, _ in passport_struct.taxonomy.composed_taxons:
+            if rank not in lookups['ranks']:
+                raise ValueError('{} rank not in db'.format(rank))
+
+        passport_key = (passport_struct.institute_code,
+                        passport_struct.germplasm_number, data_source)
+        if passport_key in passport_keys:
+            msg = 'This passport is repeated in the accessions: {} {}'
+            raise ValueError(msg.format(passport_struct.institute_code,
+                                        passport_struct.germplasm_number))
+        passport_keys.add(passport_key)
+
+    accession_keys.add(accession_key)
+    for passport_struct in accession_struct.passports:
+        if passport_struct.data_source is not None:
+            data_sources[passport_struct.data_source] = passport_struct.data_source_kind
+
+
+def _get_or_create_taxa(taxa_to_add, ranks):
+    names = {name for _, name in taxa_to_add}
+    taxa = {(taxon.rank.name, taxon.name): taxon
+            for taxon in Taxon.objects.filter(name__in=names).select_related('rank')}
+    new_taxa = [Taxon(rank=ranks[rank], name=name)
+                for rank, name in taxa_to_add if (rank, name) not in taxa]
+    if new_taxa:
+        Taxon.objects.bulk_create(new_taxa, batch_size=BULK_CREATE_BATCH_SIZE,
+                                  ignore_conflicts=True)
+        taxa = {(taxon.rank.name, taxon.name): taxon
+                for taxon in Taxon.objects.filter(name__in=names).select_related('rank')}
+    return taxa
+
+
+def _bulk_create_accessions_chunk(accession_structs, group, is_public, lookups):
+    institutes = lookups['institutes']
+    accessions = []
+    for accession_struct in accession_structs:
+        accession_struct.metadata.is_public = is_public
+        accession_struct.metadata.group = group.name
+        accession = Accession(
+            institute=institutes[accession_struct.institute_code],
+            germplasm_number=accession_struct.germplasm_number,
+            conservation_status=accession_struct.conservation_status,
+            is_available=accession_struct.is_available,
+            in_nuclear_collection=accession_struct.in_nuclear_collection,
+            group=group, is_public=is_public, data=accession_struct.data)
+        accessions.append(accession)
+    Accession.objects.bulk_create(accessions, batch_size=BULK_CREATE_BATCH_SIZE)
+
+    passports = []
+    passports_taxa = []
+    for accession, accession_struct in zip(accessions, accession_structs):
+        for passport_struct in accession_struct.passports:
+            collection_number = passport_struct.collection.number
+            collection_field_number = passport_struct.collection.field_number
+            if not collection_number and collection_field_number:
+                collection_number = collection_field_number
+            latitude, longitude = _get_passport_location_values(passport_struct)
+            country = passport_struct.location.country
+            data_source = passport_struct.data_source
+            passport = Passport(
+                institute=institutes[passport_struct.institute_code],
+                germplasm_number=passport_struct.germplasm_number,
+                pdci=passport_struct.pdci,
+                country=lookups['countries'][country] if country else None,
+                state=passport_struct.location.state,
+                province=passport_struct.location.province,
+                municipality=passport_struct.location.municipality,
+                location_site=passport_struct.location.site,
+                biological_status=passport_struct.bio_status,
+                collection_source=passport_struct.collection_source,
+                latitude=latitude, longitude=longitude,
+                accession_name=passport_struct.germplasm_name,
+                crop_name=passport_struct.crop_name,
+                collection_number=collection_number,
+                data_source=lookups['data_sources'].get(data_source),
+                data=passport_struct.data,
+                accession=accession)
+            passports.append(passport)
+            taxa = {lookups['taxa'][composed_taxon]
+                    for composed_taxon in passport_struct.taxonomy.composed_taxons}
+            passports_taxa.append(taxa)
+    Passport.objects.bulk_create(passports, batch_size=BULK_CREATE_BATCH_SIZE)
+
+    PassportTaxa = Passport.taxa.through
+    through_rows = [PassportTaxa(passport_id=passport.passport_id,
+                                 taxon_id=taxon.taxon_id)
+                    for passport, taxa in zip(passports, passports_taxa)
+                    for taxon in taxa]
+    PassportTaxa.objects.bulk_create(through_rows,
+                                     batch_size=BULK_CREATE_BATCH_SIZE)
+    refresh_accession_summaries([accession.accession_id
+                                 for accession in accessions])
+
+
+def _parse_accession_structs(validated_data):
+    accession_structs = []
+    for api_data in validated_data:
+        try:
+            accession_struct = AccessionStruct(api_data=api_data)
+        except (AccessionValidationError, PassportValidationError) as error:
+            accession_structs.append(str(error))
+            continue
+        if (accession_struct.metadata.group or accession_struct.metadata.is_public):
+            msg = 'can not set group or is public while creating the accession'
+            accession_structs.append(msg)
+            continue
+        accession_structs.append(accession_struct)
+    return accession_structs
+
+
+def create_accessions_in_db(validated_data, user, is_public=None):
+    '''It creates all the given accessions resolving the related objects
+    (institutes, countries, data sources, ranks and taxa) with a few queries
+    for the whole payload.
+
+    It returns the per accession errors, if there is any error no accession
+    is added.
+    '''
+    errors = []
+    accession_structs = _parse_accession_structs(validated_data)
+    valid_structs = [struct for struct in accession_structs
+                     if isinstance(struct, AccessionStruct)]
+    (institute_codes, country_codes,
+     data_source_codes) = _collect_accession_lookup_keys(valid_structs)
+
+    institutes = Institute.objects.filter(code__in=institute_codes)
+    countries = Country.objects.filter(code__in=country_codes)
+    db_data_sources = DataSource.objects.filter(code__in=data_source_codes)
+    lookups = {
+        'institutes': {institute.code: institute for institute in institutes},
+        'countries': {country.code: country for country in countries},
+        'data_sources': {data_source.code: data_source
+                         for data_source in db_data_sources},
+        'ranks': {rank.name: rank for rank in Rank.objects.all()}}
+
+    germplasm_numbers = {struct.germplasm_number for struct in valid_structs}
+    accession_keys = set(Accession.objects.filter(
+        institute__code__in=institute_codes,
+        germplasm_number__in=germplasm_numbers).values_list('institute__code',
+                                                            'germplasm_number'))
+    passport_keys = set()
+    data_sources = {code: data_source.kind
+                    for code, data_source in lookups['data_sources'].items()}
+    for accession_struct in accession_structs:
+        if not isinstance(accession_struct, AccessionStruct):
+            errors.append(accession_struct)
+            continue
+        try:
+            _check_accession_struct(accession_struct, lookups, accession_keys,
+                                    passport_keys, data_sources)
+        except ValueError as error:
+            errors.append(str(error))
+
+    if errors:
+        return errors
+
+    if is_public is None:
+        is_public = False
+    group = get_permission_context(user).first_group
+    with transaction.atomic():
+        new_data_sources = [DataSource(code=code, kind=kind)
+                            for code, kind in data_sources.items()
+                            if code not in lookups['data_sources']]
+        DataSource.objects.bulk_create(new_data_sources)
+        lookups['data_sources'].update({data_source.code: data_source
+                                        for data_source in new_data_sources})
+
+        taxa_to_add = {composed_taxon for struct in valid_structs
+                       for passport_struct in struct.passports
+                       for composed_taxon in passport_struct.taxonomy.composed_taxons}
+        lookups['taxa'] = _get_or_create_taxa(taxa_to_add, lookups['ranks'])
+
+        for index in range(0, len(valid_structs), BULK_CREATE_BATCH_SIZE):
+            chunk = valid_structs[index:index + BULK_CREATE_BATCH_SIZE]
+            _bulk_create_accessions_chunk(chunk, group, is_public, lookups)
+        institute_ids = [institute.institute_id
+                         for institute in lookups['institutes'].values()]
+        refresh_entity_stats(institute_ids)
+        invalidate_institute_pdcis(institute_ids)
+        bump_data_versions(ACCESSION_DATA)
+    return errors
+
+
+def _to_copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, dict):
+        return json.dumps(value)
+    return value
+
+
+def _copy_rows_to_staging_table(cursor, table, columns, rows):
+    sql = raw_copy_sql_commands.COPY_TO_STAGING_TABLE.format(
+        table=table, columns=', '.join('"{}"'.format(col) for col in columns))
+    fhand = None
+    for index, row in enumerate(rows):
+        if fhand is None:
+            fhand = io.StringIO()
+            writer = csv.writer(fhand)
+        writer.writerow([_to_copy_value(value) for value in row])
+        if (index + 1) % BULK_CREATE_BATCH_SIZE == 0:
+            fhand.seek(0)
+            cursor.copy_expert(sql, fhand)
+            fhand = None
+    if fhand is not None:
+        fhand.seek(0)
+        cursor.copy_expert(sql, fhand)
+
+
+def _accession_staging_rows(accession_structs):
+    for row_number, accession_struct in accession_structs:
+        yield (row_number, accession_struct.institute_code,
+               accession_struct.germplasm_number,
+               accession_struct.conservation_status,
+               accession_struct.is_available,
+               accession_struct.in_nuclear_collection, accession_struct.data)
+
+
+def _passport_staging_rows(accession_structs):
+    for row_number, accession_struct in accession_structs:
+        for index, passport_struct in enumerate(accession_struct.passports):
+            collection_number = passport_struct.collection.number
+            collection_field_number = passport_struct.collection.field_number
+            if not collection_number and collection_field_number:
+                collection_number = collection_field_number
+            location = passport_struct.location
+            yield (row_number, index, passport_struct.institute_code,
+                   passport_struct.germplasm_number,
+                   passport_struct.data_source,
+                   passport_struct.data_source_kind,
+                   passport_struct.collection.institute or None,
+                   collection_number, passport_struct.germplasm_name,
+                   passport_struct.crop_name, location.country or None,
+                   location.state, location.province, location.municipality,
+                   location.site, passport_struct.bio_status,
+                   passport_struct.collection_source, location.latitude,
+                   location.longitude, passport_struct.pdci,
+                   passport_struct.data)
+
+
+def _passport_taxon_staging_rows(accession_structs):
+    for row_number, accession_struct in accession_structs:
+        for index, passport_struct in enumerate(accession_struct.passports):
+            for rank, taxon in passport_struct.taxonomy.composed_taxons:
+                yield row_number, index, rank, taxon
+
+
+# validation query and error message builder, in the order the row by row
+# loader checks them
+_STAGING_VALIDATIONS = [
+    (raw_copy_sql_commands.UNKNOWN_ACCESSION_INSTITUTES,
+     lambda code: '{} does not exist in database'.format(code)),
+    (raw_copy_sql_commands.EXISTING_ACCESSIONS,
+     lambda code, number: 'This accession already exists in db: {} {}'.format(code, number)),
+    (raw_copy_sql_commands.REPEATED_ACCESSIONS,
+     lambda code, number: 'This accession already exists in db: {} {}'.format(code, number)),
+    (raw_copy_sql_commands.UNKNOWN_PASSPORT_INSTITUTES,
+     lambda code: '{} does not exist in database'.format(code)),
+    (raw_copy_sql_commands.DATA_SOURCE_KIND_CONFLICTS,
+     lambda code: '{} already in database, it must be defined with a differentkind'.format(code)),
+    (raw_copy_sql_commands.UNKNOWN_COUNTRIES,
+     lambda code: '{} country not in db'.format(code)),
+    (raw_copy_sql_commands.UNKNOWN_COLLECTING_INSTITUTES,
+     lambda number, code: '{}: {} does not exist in our database'.format(number, code)),
+    (raw_copy_sql_commands.UNKNOWN_RANKS,
+     lambda rank: '{} rank not in db'.format(rank)),
+    (raw_copy_sql_commands.REPEATED_PASSPORTS,
+     lambda code, number: 'This passport is repeated in the accessions: {} {}'.format(code, number)),
+]
+
+
+def copy_accessions_in_db(validated_data, user, is_public=None):
+    '''It loads the accessions streaming them with COPY into temporary
+    staging tables, validates them with set based queries and merges them
+    into the accession, passport and taxa tables.
+
+    It returns the per accession errors, if there is any error no accession
+    is added.
+    '''
+    row_errors = {}
+    accession_structs = []
+    for row_number, accession_struct in enumerate(_parse_accession_structs(validated_data)):
+        if not isinstance(accession_struct, AccessionStruct):
+            row_errors[row_number] = accession_struct
+            continue
+        try:
+            for passport_struct in accession_struct.passports:
+                _get_passport_location_values(passport_struct)
+        except (InvalidOperation, DjangoValidationError):
+            msg = '{}:{} longitude or latitude data is wrong- {} {}'
+            row_errors[row_number] = msg.format(accession_struct.institute_code,
+                                                accession_struct.germplasm_number,
+                                                passport_struct.location.longitude,
+                                                passport_struct.location.latitude)
+            continue
+        accession_structs.append((row_number, accession_struct))
+
+    if is_public is None:
+        is_public = False
+    group = get_permission_context(user).first_group
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(raw_copy_sql_commands.DROP_ACCESSION_STAGING_TABLES)
+        for sql in raw_copy_sql_commands.CREATE_ACCESSION_STAGING_TABLES:
+            cursor.execute(sql)
+        _copy_rows_to_staging_table(cursor, 'vavilov_accession_staging',
+                                    raw_copy_sql_commands.ACCESSION_STAGING_COLUMNS,
+                                    _accession_staging_rows(accession_structs))
+        _copy_rows_to_staging_table(cursor, 'vavilov_passport_staging',
+                                    raw_copy_sql_commands.PASSPORT_STAGING_COLUMNS,
+                                    _passport_staging_rows(accession_structs))
+        _copy_rows_to_staging_table(cursor, 'vavilov_passport_taxon_staging',
+                                    raw_copy_sql_commands.PASSPORT_TAXON_STAGING_COLUMNS,
+                                    _passport_taxon_staging_rows(accession_structs))
+        for sql in raw_copy_sql_commands.RESOLVE_STAGING_IDS:
+            cursor.execute(sql)
+
+        for sql, build_msg in _STAGING_VALIDATIONS:
+            cursor.execute(sql)
+            for row in cursor.fetchall():
+                row_errors.setdefault(row[0], build_msg(*row[1:]))
+
+        if row_errors:
+            return [row_errors[row_number] for row_number in sorted(row_errors)]
+
+        cursor.execute(raw_copy_sql_commands.INSERT_STAGED_DATA_SOURCES)
+        cursor.execute(raw_copy_sql_commands.RESOLVE_STAGED_DATA_SOURCES)
+        cursor.execute(raw_copy_sql_commands.INSERT_STAGED_TAXA)
+        cursor.execute(raw_copy_sql_commands.MERGE_STAGED_ACCESSIONS,
+                       {'group_id': group.id, 'is_public': is_public})
+        cursor.execute(get_refresh_accession_summaries_sql(STAGED_ACCESSIONS_FILTER))
+        cursor.execute(raw_copy_sql_commands.SELECT_STAGED_INSTITUTES)
+        refresh_entity_stats(row[0] for row in cursor.fetchall())
+        cursor.execute(raw_copy_sql_commands.SELECT_STAGED_PASSPORT_INSTITUTES)
+        invalidate_institute_pdcis(row[0] for row in cursor.fetchall())
+        bump_data_versions(ACCESSION_DATA)
+    return []
+
+
 def update_accession_in_db(validated_data, instance, user):
     accession_struct = AccessionStruct(api_data=validated_data)
     if (accession_struct.institute_code != instance.institute.code or
@@ -461,7 +961,7 @@ def update_accession_in_db(validated_data, instance, user):
         msg = 'Can not change id in an update operation'
         raise ValidationError(format_error_message(msg))
 
-    group_belong_to_user = bool(user.groups.filter(name=accession_struct.metadata.group).count())
+    group_belong_to_user = get_permission_context(user).belongs_to(accession_struct.metadata.group)
 
     if not group_belong_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if group does not belong to you : {}'
@@ -484,36 +984,38 @@ def update_accession_in_db(validated_data, instance, user):
         instance.group = group
         instance.is_public = accession_struct.metadata.is_public
 
+        passport_institute_ids = set(instance.passports.values_list(
+            'institute_id', flat=True))
         instance.passports.all().delete()
         for passport_struct in accession_struct.passports:
-            _create_passport_in_db(passport_struct, instance)
+            passport = _create_passport_in_db(passport_struct, instance)
+            passport_institute_ids.add(passport.institute_id)
 
         instance.save()
+        refresh_accession_summaries([instance.accession_id])
+        refresh_entity_stats([instance.institute_id])
+        invalidate_institute_pdcis(passport_institute_ids)
+        bump_data_versions(ACCESSION_DATA)
         return instance
 
 
-def serialize_accessions_from_csv(fhand, data_source_code, data_source_kind):
-    reader = csv.DictReader(fhand, delimiter=',')
-    fields = reader.fieldnames
-    data = []
-    for row in reader:
-        row = OrderedDict(((field, row[field]) for field in fields))
+def iter_accessions_from_rows(rows, data_source_code, data_source_kind):
+    retrieval_date = datetime.now().strftime('%Y-%m-%d')
+    for row in rows:
         accession_struct = AccessionStruct()
         accession_struct.populate_from_csvrow(row)
         accession_struct.passports[0].data_source = data_source_code
         accession_struct.passports[0].data_source_kind = data_source_kind
-        accession_struct.passports[0].retrieval_date = datetime.now().strftime('%Y-%m-%d')
-        data.append(accession_struct.get_api_document())
-    return data
+        accession_struct.passports[0].retrieval_date = retrieval_date
+        yield accession_struct.get_api_document()
+
+
+def serialize_accessions_from_csv(fhand, data_source_code, data_source_kind):
+    return list(iter_accessions_from_rows(csv_dict_reader(fhand),
+                                          data_source_code, data_source_kind))
 
 
 def serialize_accessions_from_excel(fhand, data_source_code, data_source_kind):
-    data = []
-    for row in excel_dict_reader(fhand, values_as_text=True):
-        accession_struct = AccessionStruct()
-        accession_struct.populate_from_csvrow(row)
-        accession_struct.passports[0].data_source = data_source_code
-        accession_struct.passports[0].data_source_kind = data_source_kind
-        accession_struct.passports[0].retrieval_date = datetime.now().strftime('%Y-%m-%d')
-        data.append(accession_struct.get_api_document())
-    return data
+    rows = excel_dict_reader(fhand, values_as_text=True)
+    return list(iter_accessions_from_rows(rows, data_source_code,
+                                          data_source_kind))
@@ -21,6 +21,7 @@ from collections import OrderedDict
 
 from django.db.utils import IntegrityError
 from django.db import transaction
+from django.db.models import Prefetch
 
 from rest_framework.exceptions import ValidationError
 
@@ -28,9 +29,19 @@ from vavilov3.entities.tags import (INSTITUTE_CODE, GERMPLASM_NUMBER,
                                     ACCESSIONS, ACCESSIONSET_NUMBER)
 from vavilov3.entities.metadata import Metadata
 from vavilov3.views import format_error_message
-from vavilov3.models import AccessionSet, Accession, Institute, Group
-from vavilov3.permissions import is_user_admin
+from vavilov3.models import (AccessionSet, Accession, Institute, Group,
+                             Passport, bump_data_versions, ACCESSIONSET_DATA)
+from vavilov3.entities.passport import (get_passports_taxa_names,
+                                        get_passports_country_codes)
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.id_validator import validate_id
+from vavilov3.entities.stats import refresh_entity_stats
+from vavilov3.raw_stat_sql_commands import ACCESSIONSET_STATS
+
+
+# requested fields that are built from the passports of the set accessions
+ACCESSIONSET_PASSPORT_FIELDS = {'genera', 'species', 'countries', 'latitudes',
+                                'longitudes'}
 
 
 class AccessionSetValidationError(Exception):
@@ -183,19 +194,32 @@ class AccessionSetStruct():
         if fields is None or ACCESSIONSET_NUMBER in fields:
             self.accessionset_number = instance.accessionset_number
 
-        if instance.genera and fields and 'genera' in fields:
-            self.genera = instance.genera
-
-        if instance.species and fields and 'species' in fields:
-            self.species = instance.species
-
-        if instance.countries and fields and 'countries' in fields:
-            self.countries = instance.countries
-
-        if instance.latitudes and fields and 'latitudes' in fields:
-            self.latitudes = instance.latitudes
-        if instance.longitudes and fields and 'longitudes' in fields:
-            self.longitudes = instance.longitudes
+        if fields and ACCESSIONSET_PASSPORT_FIELDS.intersection(fields):
+            passports = [passport for accession in instance.accessions.all()
+                         for passport in accession.passports.all()]
+        if fields and 'genera' in fields:
+            genera = get_passports_taxa_names(passports, 'genus')
+            if genera:
+                self.genera = genera
+
+        if fields and 'species' in fields:
+            species = get_passports_taxa_names(passports, 'species')
+            if species:
+                self.species = species
+
+        if fields and 'countries' in fields:
+            countries = get_passports_country_codes(passports)
+            if countries:
+                self.countries = countries
+
+        if fields and 'latitudes' in fields:
+            latitudes = [passport.latitude for passport in passports]
+            if latitudes:
+                self.latitudes = latitudes
+        if fields and 'longitudes' in fields:
+            longitudes = [passport.longitude for passport in passports]
+            if longitudes:
+                self.longitudes = longitudes
 
         if fields is None or ACCESSIONS in fields:
             accessions = []
@@ -224,6 +248,25 @@ class AccessionSetStruct():
             setter(self, value)
 
 
+def plan_accessionset_queryset(queryset, fields):
+    queryset = queryset.select_related('group')
+    if fields is None or INSTITUTE_CODE in fields:
+        queryset = queryset.select_related('institute')
+
+    fields = set(fields) if fields is not None else None
+    if fields is None or ACCESSIONS in fields:
+        queryset = queryset.prefetch_related('accessions__institute')
+    if fields and fields.intersection(ACCESSIONSET_PASSPORT_FIELDS):
+        passports = Passport.objects.all()
+        if fields.intersection(('genera', 'species')):
+            passports = passports.prefetch_related('taxa__rank')
+        if 'countries' in fields:
+            passports = passports.select_related('country')
+        queryset = queryset.prefetch_related(
+            Prefetch('accessions__passports', queryset=passports))
+    return queryset
+
+
 def get_accessions(accessionset):
     accessions = []
     for accession in accessionset.accessions:
@@ -264,7 +307,8 @@ _ACCESSIONSET_CSV_FIELD_CONFS = [
 ACCESSIONSET_CSV_FIELD_CONFS = OrderedDict([(f['csv_field_name'], f) for f in _ACCESSIONSET_CSV_FIELD_CONFS])
 
 
-def create_accessionset_in_db(api_data, user, is_public=None):
+def create_accessionset_in_db(api_data, user, is_public=None,
+                              refresh_stats=True):
     # when we are creating
     try:
         accessionset_struct = AccessionSetStruct(api_data=api_data)
@@ -285,7 +329,7 @@ def create_accessionset_in_db(api_data, user, is_public=None):
     # in the doc we must enter whole document
     if is_public is None:
         is_public = False
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
     accessionset_struct.metadata.is_public = is_public
     accessionset_struct.metadata.group = group.name
 
@@ -315,10 +359,34 @@ def create_accessionset_in_db(api_data, user, is_public=None):
                 raise ValueError(msg)
             if accession_instance:
                 accessionset.accessions.add(accession_instance)
+        if refresh_stats:
+            refresh_entity_stats([accessionset.institute_id],
+                                 entity_types=(ACCESSIONSET_STATS,))
+            bump_data_versions(ACCESSIONSET_DATA)
 
     return accessionset
 
 
+def create_accessionsets_in_db(items, user):
+    '''It creates the accessionsets one by one and returns the errors.
+
+    The stats of their institutes are refreshed once for all of them'''
+    errors = []
+    institute_ids = set()
+    for item in items:
+        try:
+            accessionset = create_accessionset_in_db(item, user,
+                                                     refresh_stats=False)
+        except ValueError as error:
+            errors.append(str(error))
+            continue
+        institute_ids.add(accessionset.institute_id)
+    if institute_ids:
+        refresh_entity_stats(institute_ids, entity_types=(ACCESSIONSET_STATS,))
+        bump_data_versions(ACCESSIONSET_DATA)
+    return errors
+
+
 def update_accessionset_in_db(payload, instance, user):
     struct = AccessionSetStruct(payload)
 
@@ -350,7 +418,7 @@ def update_accessionset_in_db(payload, instance, user):
         msg = msg.format(','.join(not_allowed_changes))
         raise ValidationError(format_error_message(msg))
 
-    group_belong_to_user = bool(user.groups.filter(name=struct.metadata.group).count())
+    group_belong_to_user = get_permission_context(user).belongs_to(struct.metadata.group)
 
     if not group_belong_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if group does not belong to you : {}'
@@ -367,5 +435,8 @@ def update_accessionset_in_db(payload, instance, user):
     instance.is_public = struct.metadata.is_public
     instance.owner = group
     instance.save()
+    refresh_entity_stats([instance.institute_id],
+                         entity_types=(ACCESSIONSET_STATS,))
+    bump_data_versions(ACCESSIONSET_DATA)
 
     return instance
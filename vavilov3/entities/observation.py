@@ -34,10 +34,11 @@ from vavilov3.entities.tags import (OBSERVATION_VARIABLE, OBSERVATION_UNIT,
                                     INSTITUTE_CODE, GERMPLASM_NUMBER,
                                     OBSERVATION_STUDY, ACCESSION,
                                     OBSERVATION_ID, VALUE_BEAUTY)
-from vavilov3.conf.settings import DATETIME_FORMAT
+from vavilov3.conf.settings import DATETIME_FORMAT, BULK_CREATE_BATCH_SIZE
 from vavilov3.models import (ObservationUnit, ObservationVariable, Observation,
-                             Study, Accession)
-from vavilov3.permissions import is_user_admin
+                             Study, Accession, bump_data_versions,
+                             OBSERVATION_DATA)
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.data_io import ORDINAL, NOMINAL, NUMERICAL
 
 
@@ -207,7 +208,7 @@ class ObservationStruct():
             self.accession = {INSTITUTE_CODE: instance.observation_unit.accession.institute.code,
                               GERMPLASM_NUMBER: instance.observation_unit.accession.germplasm_number}
 
-        if instance.beauty_value and fields and VALUE_BEAUTY in fields:
+        if fields and VALUE_BEAUTY in fields and instance.beauty_value:
             self.beauty_value = instance.beauty_value
 
     def to_list_representation(self, fields):
@@ -229,6 +230,21 @@ class ObservationStruct():
                 setter(self, value)
 
 
+def plan_observation_queryset(queryset, fields):
+    related = ['observation_unit']
+    if fields is None or OBSERVATION_VARIABLE in fields:
+        related.append('observation_variable')
+    if fields is None or OBSERVATION_STUDY in fields:
+        related.append('observation_unit__study')
+    if fields is None or ACCESSION in fields:
+        related.append('observation_unit__accession__institute')
+    if fields and VALUE_BEAUTY in fields:
+        related.append('observation_variable__scale__data_type')
+        queryset = queryset.prefetch_related(
+            'observation_variable__scale__scalecategory_set')
+    return queryset.select_related(*related)
+
+
 _OBSERVATION_CSV_FIELD_CONFS = [
     {'csv_field_name': 'OBSERVATION_ID', 'getter': lambda x: x.observation_id,
      'setter': lambda obj, val: setattr(obj, 'observation_id', val)},
@@ -297,6 +313,27 @@ def get_datetime_from_strdate(str_date):
     datetime.strftime(str_date, "")
 
 
+def _parse_creation_time(creation_time):
+    if not creation_time:
+        return None
+    timezone = pytz.timezone(TIME_ZONE)
+    return timezone.localize(datetime.strptime(creation_time, DATETIME_FORMAT))
+
+
+def _get_error_row_id(struct):
+    if struct.observation_unit:
+        return struct.observation_unit
+    elif struct.accession and struct.study:
+        return '{} - {}'.format(struct.accession[GERMPLASM_NUMBER], struct.study)
+    return 'Unknown'
+
+
+def _get_integrity_error_msg(error):
+    if 'duplicate key value' in str(error):
+        return 'This observation already exists in db'
+    return str(error)
+
+
 def create_observation_in_db(api_data, user, conf=None):
     if conf is None:
         conf = {}
@@ -313,30 +350,17 @@ def create_observation_in_db(api_data, user, conf=None):
         msg = msg.format(struct.observation_variable)
         raise ValueError(msg)
 
-    if struct.creation_time:
-        timezone = pytz.timezone(TIME_ZONE)
-        creation_time = timezone.localize(datetime.strptime(struct.creation_time,
-                                                            DATETIME_FORMAT))
-    else:
-        creation_time = None
+    creation_time = _parse_creation_time(struct.creation_time)
     try:
         values = validate_value(str(struct.value), observation_variable)
     except ValueError as error:
-        if struct.observation_unit:
-            error_row_id = struct.observation_unit
-        elif struct.accession and struct.study:
-            error_row_id = '{} - {}'.format(struct.accession[GERMPLASM_NUMBER],
-                                            struct.study)
-        else:
-            error_row_id = 'Unknown'
-        msg = '{}: {}'.format(error_row_id, error)
-        raise ValueError(msg)
+        raise ValueError('{}: {}'.format(_get_error_row_id(struct), error))
 
     with transaction.atomic():
         observations = []
         for value in values:
             observation_unit = _get_or_create_observation_unit(struct, create_observation_unit)
-            study_belongs_to_user = bool(user.groups.filter(name=observation_unit.study.group.name).count())
+            study_belongs_to_user = get_permission_context(user).belongs_to(observation_unit.study.group.name)
 
             if not study_belongs_to_user and not is_user_admin(user):
                 msg = 'Can not add observation unit to a study you dont own: {}'
@@ -348,14 +372,13 @@ def create_observation_in_db(api_data, user, conf=None):
                     observation_variable=observation_variable,
                     observation_unit=observation_unit,
                     value=value,
+                    value_numeric=get_value_numeric(value, observation_variable),
                     observer=struct.observer,
                     creation_time=creation_time)
             except IntegrityError as error:
-                if 'duplicate key value' in str(error):
-                    msg = 'This observation already exists in db'
-                    raise ValueError(msg)
-                raise ValueError(str(error))
+                raise ValueError(_get_integrity_error_msg(error))
             observations.append(observation)
+        bump_data_versions(OBSERVATION_DATA)
 
     # only when creating by bulk we would have more than one value.
     # In this cases the values are not returned. In most cases we can return
@@ -367,31 +390,276 @@ def create_observation_in_db(api_data, user, conf=None):
     return observations
 
 
-def validate_value(value, observation_variable):
-    scale = observation_variable.scale
-    obs_var_name = observation_variable.name
-    values = []
-    data_type = scale.data_type.name
-    if ';' in value and data_type in (ORDINAL, NOMINAL):
-        values = value.split(';')
+class ObservationLookups():
+    '''In-task caches of the objects the observations refer to. They are
+    filled with a query per kind of object for every chunk of observations
+    and kept for the following chunks of the same task'''
+
+    def __init__(self):
+        self.variables = {}
+        self.value_validators = {}
+        self.units = {}
+        self.studies = {}
+        self.accessions = {}
+
+    def load(self, structs):
+        variable_names = {struct.observation_variable for struct in structs
+                          if struct.observation_variable not in self.variables}
+        if variable_names:
+            variables = ObservationVariable.objects.filter(
+                name__in=variable_names).select_related(
+                    'scale__data_type').prefetch_related('scale__scalecategory_set')
+            for variable in variables:
+                self.variables[variable.name] = variable
+                self.value_validators[variable.name] = get_value_validator(variable)
+
+        unit_names = {struct.observation_unit for struct in structs
+                      if struct.observation_unit and
+                      struct.observation_unit not in self.units}
+        if unit_names:
+            units = ObservationUnit.objects.filter(
+                name__in=unit_names).select_related('study__group')
+            self.units.update({unit.name: unit for unit in units})
+
+        study_names = {struct.study for struct in structs
+                       if not struct.observation_unit and struct.study and
+                       struct.study not in self.studies}
+        if study_names:
+            studies = Study.objects.filter(
+                name__in=study_names).select_related('group')
+            self.studies.update({study.name: study for study in studies})
+
+        accession_keys = {(struct.accession[INSTITUTE_CODE],
+                           struct.accession[GERMPLASM_NUMBER])
+                          for struct in structs
+                          if not struct.observation_unit and struct.accession}
+        accession_keys.difference_update(self.accessions)
+        if accession_keys:
+            accessions = Accession.objects.filter(
+                institute__code__in={key[0] for key in accession_keys},
+                germplasm_number__in={key[1] for key in accession_keys}
+            ).select_related('institute')
+            for accession in accessions:
+                key = (accession.institute.code, accession.germplasm_number)
+                if key in accession_keys:
+                    self.accessions[key] = accession
+
+
+def _get_observation_unit_from_lookups(struct, create_observation_unit,
+                                       lookups):
+    if not create_observation_unit and not struct.observation_unit:
+        msg = 'No observation unit provided'
+        raise ValueError(msg)
+    elif struct.observation_unit:
+        try:
+            return lookups.units[struct.observation_unit]
+        except KeyError:
+            msg = 'This observation Unit {} does not exist in db'
+            msg = msg.format(struct.observation_unit)
+            raise ValueError(msg)
+    elif not struct.observation_unit and create_observation_unit == 'foreach_observation':
+        try:
+            study = lookups.studies[struct.study]
+        except KeyError:
+            msg = 'Not able to get or create an observation unit with the given conf'
+            msg += ' {} study not found'
+            raise ValueError(msg.format(struct.study))
+        try:
+            accession = lookups.accessions[(struct.accession[INSTITUTE_CODE],
+                                            struct.accession[GERMPLASM_NUMBER])]
+        except KeyError:
+            msg = 'Not able to get or create an observation unit with the given conf '
+            msg += '{} accession not found'
+            raise ValueError(msg.format(struct.accession[GERMPLASM_NUMBER]))
+        # it is saved in bulk once the whole chunk is valid
+        return ObservationUnit(study=study, accession=accession,
+                               level='whole plant', name=uuid.uuid4())
     else:
-        values = [value]
+        msg = 'Not able to get or create an observation unit with the given conf'
+        raise ValueError(msg)
 
+
+def _get_observation_key(observation):
+    # postgres does not consider the null values as duplicated in an unique
+    # constraint and the new units can not have any observation
+    if (observation.observer is None or observation.creation_time is None or
+            observation.observation_unit.observation_unit_id is None):
+        return None
+    return (observation.observation_variable.observation_variable_id,
+            observation.observation_unit.observation_unit_id,
+            observation.value, observation.observer,
+            observation.creation_time)
+
+
+def _get_observations_in_db_keys(observations):
+    unit_ids = {observation.observation_unit.observation_unit_id
+                for observation in observations
+                if observation.observation_unit.observation_unit_id}
+    if not unit_ids:
+        return set()
+    variable_ids = {observation.observation_variable.observation_variable_id
+                    for observation in observations}
+    db_observations = Observation.objects.filter(
+        observation_unit_id__in=unit_ids,
+        observation_variable_id__in=variable_ids,
+        observer__isnull=False, creation_time__isnull=False)
+    return set(db_observations.values_list('observation_variable_id',
+                                           'observation_unit_id', 'value',
+                                           'observer', 'creation_time'))
+
+
+def _build_row_observations(struct, user, create_observation_unit, lookups):
+    try:
+        observation_variable = lookups.variables[struct.observation_variable]
+    except KeyError:
+        msg = 'Observation variable {} does not exist in db'
+        msg = msg.format(struct.observation_variable)
+        raise ValueError(msg)
+
+    creation_time = _parse_creation_time(struct.creation_time)
+    validate = lookups.value_validators[observation_variable.name]
+    try:
+        values = validate(str(struct.value))
+    except ValueError as error:
+        raise ValueError('{}: {}'.format(_get_error_row_id(struct), error))
+
+    observations = []
     for value in values:
-        if data_type == NUMERICAL:
-            float_value = float(value)
-            if scale.min and float_value < scale.min:
-                msg = '{}: Numeric value is less than minim: {} < {}'
-                raise ValueError(msg.format(obs_var_name, value, scale.min))
-            elif scale.max and float_value > scale.max:
-                msg = '{}: Numeric value is bigger than maxim: {} > {}'
-                raise ValueError(msg.format(obs_var_name, value, scale.max))
+        observation_unit = _get_observation_unit_from_lookups(
+            struct, create_observation_unit, lookups)
+        study_group = observation_unit.study.group
+        study_belongs_to_user = get_permission_context(user).belongs_to(study_group.name)
+        if not study_belongs_to_user and not is_user_admin(user):
+            msg = 'Can not add observation unit to a study you dont own: {}'
+            raise ValueError(msg.format(study_group.name))
+        value_numeric = get_value_numeric(value, observation_variable)
+        observations.append(Observation(observation_variable=observation_variable,
+                                        observation_unit=observation_unit,
+                                        value=value, value_numeric=value_numeric,
+                                        observer=struct.observer,
+                                        creation_time=creation_time))
+    return observations
+
+
+def _bulk_create_observations(observations):
+    errors = []
+    new_units = [observation.observation_unit for observation in observations
+                 if observation.observation_unit.observation_unit_id is None]
+    ObservationUnit.objects.bulk_create(new_units,
+                                        batch_size=BULK_CREATE_BATCH_SIZE)
+    for observation in observations:
+        # the pk of the new units is set after the bulk create
+        observation.observation_unit = observation.observation_unit
+
+    for index in range(0, len(observations), BULK_CREATE_BATCH_SIZE):
+        batch = observations[index:index + BULK_CREATE_BATCH_SIZE]
+        try:
+            with transaction.atomic():
+                Observation.objects.bulk_create(batch)
+        except IntegrityError:
+            # a concurrent load added some of them, we look for them one by one
+            for observation in batch:
+                try:
+                    with transaction.atomic():
+                        observation.save()
+                except IntegrityError as error:
+                    errors.append(_get_integrity_error_msg(error))
+    return errors
+
+
+def create_observations_in_db(validated_data, user, conf=None, lookups=None):
+    '''It validates all the given observations with the variables, units,
+    studies and accessions looked up for the whole chunk and it adds them
+    in bulk.
+
+    It returns the per observation errors, if there is any error no
+    observation is added.
+    '''
+    if conf is None:
+        conf = {}
+    if lookups is None:
+        lookups = ObservationLookups()
+    create_observation_unit = conf.get(CREATE_OBSERVATION_UNITS, None)
+
+    structs = [ObservationStruct(api_data) for api_data in validated_data]
+    lookups.load(structs)
+
+    errors = []
+    rows_observations = []
+    for struct in structs:
+        try:
+            rows_observations.append(_build_row_observations(
+                struct, user, create_observation_unit, lookups))
+        except ValueError as error:
+            errors.append(str(error))
+            rows_observations.append([])
+
+    keys_in_db = _get_observations_in_db_keys(
+        [observation for row_observations in rows_observations
+         for observation in row_observations])
+    keys_in_chunk = set()
+    for row_observations in rows_observations:
+        row_keys = [_get_observation_key(observation)
+                    for observation in row_observations]
+        row_keys = [key for key in row_keys if key is not None]
+        if any(key in keys_in_db or key in keys_in_chunk for key in row_keys):
+            errors.append('This observation already exists in db')
+        keys_in_chunk.update(row_keys)
+
+    if errors:
+        return errors
+
+    with transaction.atomic():
+        errors = _bulk_create_observations(
+            [observation for row_observations in rows_observations
+             for observation in row_observations])
+        bump_data_versions(OBSERVATION_DATA)
+    return errors
+
+
+def get_value_validator(observation_variable):
+    """It returns a function that validates the values of the given variable.
+    The scale is only read once, so the same function validates all the values
+    of the variable"""
+    scale = observation_variable.scale
+    obs_var_name = observation_variable.name
+    data_type = scale.data_type.name
+    if data_type != NUMERICAL:
+        # the categories could be already prefetched
+        valid_values = {category.value
+                        for category in scale.scalecategory_set.all()}
+
+    def validate(value):
+        if ';' in value and data_type in (ORDINAL, NOMINAL):
+            values = value.split(';')
         else:
-            valid_values = [valid['value'] for valid in scale.valid_values]
-            if value not in valid_values:
+            values = [value]
+
+        for value in values:
+            if data_type == NUMERICAL:
+                float_value = float(value)
+                if scale.min and float_value < scale.min:
+                    msg = '{}: Numeric value is less than minim: {} < {}'
+                    raise ValueError(msg.format(obs_var_name, value, scale.min))
+                elif scale.max and float_value > scale.max:
+                    msg = '{}: Numeric value is bigger than maxim: {} > {}'
+                    raise ValueError(msg.format(obs_var_name, value, scale.max))
+            elif value not in valid_values:
                 raise ValueError('{}: {} not in valid_values'.format(obs_var_name,
                                                                      value))
-    return values
+        return values
+
+    return validate
+
+
+def validate_value(value, observation_variable):
+    return get_value_validator(observation_variable)(value)
+
+
+def get_value_numeric(value, observation_variable):
+    if observation_variable.scale.data_type.name == NUMERICAL:
+        return float(value)
+    return None
 
 
 def update_observation_in_db(validated_data, instance, user):
@@ -412,7 +680,7 @@ def update_observation_in_db(validated_data, instance, user):
         msg = msg.format(struct.observation_unit)
         raise ValueError(msg)
 
-    study_belongs_to_user = bool(user.groups.filter(name=observation_unit.study.group.name).count())
+    study_belongs_to_user = get_permission_context(user).belongs_to(observation_unit.study.group.name)
     if not study_belongs_to_user and not is_user_admin(user):
         msg = 'Can not change observation unit because this is in a study you dont own: {}'
         msg = msg.format(observation_unit.study.name)
@@ -425,11 +693,21 @@ def update_observation_in_db(validated_data, instance, user):
     else:
         creation_time = None
 
+    # as the created ones, the numeric values are checked before casting them
+    try:
+        validate_value(str(struct.value), observation_variable)
+    except ValueError as error:
+        msg = 'Not valid value {} for {}: {}'
+        raise ValueError(msg.format(struct.value, observation_variable.name,
+                                    error))
+
     instance.observation_variable = observation_variable
     instance.observation_unit = observation_unit
     instance.value = struct.value
+    instance.value_numeric = get_value_numeric(struct.value, observation_variable)
     instance.observer = struct.observer
     instance.creation_time = creation_time
 
     instance.save()
+    bump_data_versions(OBSERVATION_DATA)
     return instance
@@ -24,6 +24,7 @@ from datetime import datetime
 
 from django.conf.global_settings import TIME_ZONE
 from django.db import transaction
+from django.db.models import Q
 from django.db.utils import IntegrityError
 from django.core.files.base import File
 
@@ -37,8 +38,11 @@ from vavilov3.entities.tags import (OBSERVATION_UNIT,
                                     OBSERVATION_IMAGE_UID, IMAGE_SMALL,
                                     IMAGE_MEDIUM, IMAGE_FPATH)
 from vavilov3.conf.settings import DATETIME_FORMAT
-from vavilov3.models import ObservationUnit, Study, Accession, ObservationImage
-from vavilov3.permissions import is_user_admin
+from vavilov3.models import (ObservationUnit, Study, Accession,
+                             ObservationImage, acquire_image_blob)
+from vavilov3.permissions import is_user_admin, get_permission_context
+from vavilov3.media_journal import journal_written_files
+from vavilov3.utils import remove_unreferenced_files
 
 
 class ObservationImageValidationError(Exception):
@@ -202,9 +206,10 @@ class ObservationImageStruct():
             self.observation_unit = instance.observation_unit.name
         if (fields is None or IMAGE in fields) and instance.image is not None:
             self.image = instance.image.url
-        if (fields is None or IMAGE_MEDIUM in fields) and instance.image_medium is not None:
+        # the thumbnails are created after the image is stored
+        if (fields is None or IMAGE_MEDIUM in fields) and instance.image_medium:
             self.image_medium = instance.image_medium.url
-        if (fields is None or IMAGE_SMALL in fields) and instance.image_small is not None:
+        if (fields is None or IMAGE_SMALL in fields) and instance.image_small:
             self.image_small = instance.image_small.url
         if (fields is None or OBSERVER in fields) and instance.observer is not None:
             self.observer = instance.observer
@@ -266,6 +271,15 @@ _OBSERVATION_VARIABLE_CSV_FIELD_CONFS = [
 OBSERVATION_VARIABLE_CSV_FIELD_CONFS = OrderedDict([(f['csv_field_name'], f) for f in _OBSERVATION_VARIABLE_CSV_FIELD_CONFS])
 
 
+def plan_observation_image_queryset(queryset, fields):
+    related = ['observation_unit']
+    if fields is None or OBSERVATION_STUDY in fields:
+        related.append('observation_unit__study')
+    if fields is None or ACCESSION in fields:
+        related.append('observation_unit__accession__institute')
+    return queryset.select_related(*related)
+
+
 def _get_or_create_observation_unit(struct, create_observation_unit):
     if not create_observation_unit and not struct.observation_unit:
         msg = 'No observation unit provided'
@@ -309,53 +323,55 @@ def get_datetime_from_strdate(str_date):
     datetime.strftime(str_date, "")
 
 
-def create_observation_image_in_db(api_data, user, conf=None):
-    if IMAGE_FPATH in api_data and IMAGE not in api_data:
-        api_data[IMAGE] = File(open(api_data.pop(IMAGE_FPATH), mode='rb'))
+def get_observation_image_uid(observation_unit, digest):
+    # the same image can be in several studies and accessions
+    accession = observation_unit.accession
+    key = '{}/{}#{}/{}'.format(observation_unit.study.name,
+                               accession.institute.code,
+                               accession.germplasm_number, digest)
+    return hashlib.sha256(key.encode()).hexdigest()
 
-    if conf is None:
-        conf = {}
-    create_observation_unit = conf.get(CREATE_OBSERVATION_UNITS, None)
-    try:
-        struct = ObservationImageStruct(api_data)
-    except ObservationImageValidationError as error:
-        print('a', error)
-        raise
-
-    uid = hashlib.sha256(struct.image.read()).hexdigest()
-    struct.image.seek(0)
-
-    if struct.creation_time:
-        timezone = pytz.timezone(TIME_ZONE)
-        creation_time = timezone.localize(datetime.strptime(struct.creation_time,
-                                                            DATETIME_FORMAT))
-    else:
-        creation_time = None
 
+def _create_observation_image(struct, user, digest, creation_time,
+                              create_observation_unit):
     with transaction.atomic():
         observation_unit = _get_or_create_observation_unit(struct, create_observation_unit)
-        study_belongs_to_user = bool(user.groups.filter(name=observation_unit.study.group.name).count())
+        study_belongs_to_user = get_permission_context(user).belongs_to(observation_unit.study.group.name)
 
         if not study_belongs_to_user and not is_user_admin(user):
             msg = 'Can not add observation unit to a study you dont own: {}'
             msg = msg.format(observation_unit.study.group.name)
             raise ValueError(msg)
 
-        try:
-            ObservationImage.objects.get(observation_image_uid=uid)
+        uid = get_observation_image_uid(observation_unit, digest)
+        # the duplicates are found before writing anything. The images
+        # created before the uids had the study and accession have the
+        # digest as uid
+        legacy_duplicates = Q(
+            observation_image_uid=digest,
+            observation_unit__study=observation_unit.study,
+            observation_unit__accession=observation_unit.accession)
+        if ObservationImage.objects.filter(Q(observation_image_uid=uid) |
+                                           legacy_duplicates).exists():
             msg = 'This image already exists in db: study {}, accession {}, uid, {}'
-            msg += msg.format(struct.study, struct.accession, uid)
+            msg = msg.format(observation_unit.study.name,
+                             observation_unit.accession.germplasm_number, uid)
             raise ValueError(msg)
-        except ObservationImage.DoesNotExist:
-            pass
 
         try:
-            observation = ObservationImage.objects.create(
-                observation_image_uid=uid,
-                observation_unit=observation_unit,
-                image=api_data['image'],
-                observer=struct.observer,
-                creation_time=creation_time)
+            with transaction.atomic():
+                # the same content in other study or accession shares the
+                # files and the thumbnails
+                blob = acquire_image_blob(digest, struct.image)
+                observation = ObservationImage.objects.create(
+                    observation_image_uid=uid,
+                    observation_unit=observation_unit,
+                    blob=blob,
+                    image=blob.image.name,
+                    image_medium=blob.image_medium.name or None,
+                    image_small=blob.image_small.name or None,
+                    observer=struct.observer,
+                    creation_time=creation_time)
         except IntegrityError as error:
             if 'duplicate key value' in str(error):
                 msg = 'This image already exists in db: {}'.format(uid)
@@ -368,6 +384,42 @@ def create_observation_image_in_db(api_data, user, conf=None):
 
     return observation
 
+
+def create_observation_image_in_db(api_data, user, conf=None):
+    if IMAGE_FPATH in api_data and IMAGE not in api_data:
+        api_data[IMAGE] = File(open(api_data.pop(IMAGE_FPATH), mode='rb'))
+
+    if conf is None:
+        conf = {}
+    create_observation_unit = conf.get(CREATE_OBSERVATION_UNITS, None)
+    try:
+        struct = ObservationImageStruct(api_data)
+    except ObservationImageValidationError as error:
+        print('a', error)
+        raise
+
+    digest = hashlib.sha256(struct.image.read()).hexdigest()
+    struct.image.seek(0)
+
+    if struct.creation_time:
+        timezone = pytz.timezone(TIME_ZONE)
+        creation_time = timezone.localize(datetime.strptime(struct.creation_time,
+                                                            DATETIME_FORMAT))
+    else:
+        creation_time = None
+
+    # the files written by a failed creation are removed, the rows that
+    # could reference them have been rolled back
+    with journal_written_files() as written_files:
+        try:
+            return _create_observation_image(struct, user, digest,
+                                             creation_time,
+                                             create_observation_unit)
+        except BaseException:
+            remove_unreferenced_files(written_files)
+            raise
+
+
 # def update_observation_in_db(validated_data, instance, user):
 #     struct = ObservationStruct(api_data=validated_data)
 #     if struct.observation_id != instance.observation_id:
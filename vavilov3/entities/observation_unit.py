@@ -29,8 +29,9 @@ from vavilov3.entities.tags import (OBSERVATION_UNIT_NAME,
                                     OBSERVATION_UNIT_REPLICATE,
                                     INSTITUTE_CODE, GERMPLASM_NUMBER, ACCESSION,
                                     OBSERVATION_UNIT_STUDY, PLANTS)
-from vavilov3.models import Accession, Study, Plant, ObservationUnit
-from vavilov3.permissions import is_user_admin
+from vavilov3.models import (Accession, Study, Plant, ObservationUnit,
+                             bump_data_versions, OBSERVATION_DATA)
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.id_validator import validate_name
 
 
@@ -182,7 +183,7 @@ class ObservationUnitStruct():
         if (fields is None or OBSERVATION_UNIT_STUDY in fields) and instance.study is not None:
             self.study = instance.study.name
         if (fields is None or PLANTS in fields) and instance.plant_set is not None:
-            self.plants = instance.plant_set.values_list('name', flat=True)
+            self.plants = [plant.name for plant in instance.plant_set.all()]
 
     def to_list_representation(self, fields):
         items = []
@@ -203,6 +204,15 @@ class ObservationUnitStruct():
                 setter(self, value)
 
 
+def plan_observation_unit_queryset(queryset, fields):
+    queryset = queryset.select_related('study__group')
+    if fields is None or ACCESSION in fields:
+        queryset = queryset.select_related('accession__institute')
+    if fields is None or PLANTS in fields:
+        queryset = queryset.prefetch_related('plant_set')
+    return queryset
+
+
 def process_accession(obj, value):
     try:
         institute_code, number = value.split(':', 1)
@@ -257,7 +267,7 @@ def create_observation_unit_in_db(api_data, user=None):
         msg = 'The given accessoin is not in db: {} {}'.format(institute_code,
                                                                germplasm_number)
         raise ValueError(msg)
-    study_belongs_to_user = bool(user.groups.filter(name=study.group.name).count())
+    study_belongs_to_user = get_permission_context(user).belongs_to(study.group.name)
 
     if not study_belongs_to_user and not is_user_admin(user):
         msg = 'Can not add observation unit to a study you dont own: {}'
@@ -285,7 +295,7 @@ def _add_plants_to_observation_unit(plants, user, observation_unit):
     for plant in plants:
         try:
             plant = Plant.objects.get(name=plant)
-            plant_belongs_to_user = bool(user.groups.filter(name=plant.group.name).count())
+            plant_belongs_to_user = get_permission_context(user).belongs_to(plant.group.name)
             if not plant_belongs_to_user and not is_user_admin(user):
                 msg = 'Can not add plant you dont own to observation unit: {}'
                 msg = msg.format(plant.name)
@@ -317,7 +327,7 @@ def update_observation_unit_in_db(validated_data, instance, user):
                                                                germplasm_number)
         raise ValueError(msg)
 
-    study_belongs_to_user = bool(user.groups.filter(name=study.group.name).count())
+    study_belongs_to_user = get_permission_context(user).belongs_to(study.group.name)
 
     if not study_belongs_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if study does not belong to you : {}'
@@ -334,5 +344,6 @@ def update_observation_unit_in_db(validated_data, instance, user):
 
     instance.plant_set.clear()
     _add_plants_to_observation_unit(plants, user, instance)
+    bump_data_versions(OBSERVATION_DATA)
 
     return instance
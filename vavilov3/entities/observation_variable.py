@@ -15,6 +15,8 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 
+import threading
+import time
 from copy import deepcopy
 from collections import OrderedDict
 
@@ -28,9 +30,12 @@ from vavilov3.views import format_error_message
 from vavilov3.entities.tags import (OBSERVATION_VARIABLE_NAME, TRAIT,
                                     OBSERVATION_VARIABLE_DESCRIPTION, METHOD,
                                     DATA_TYPE, SCALE)
-from vavilov3.models import Group, ObservationVariable, Scale, Trait
-from vavilov3.permissions import is_user_admin
+from vavilov3.models import (Group, ObservationVariable, Scale, Trait,
+                             OBSERVATION_VARIABLE_DATA, get_data_versions,
+                             bump_data_versions)
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.id_validator import validate_name
+from vavilov3.conf.settings import REGISTRY_CHECK_INTERVAL
 
 
 class ObservationVariableValidationError(Exception):
@@ -239,7 +244,7 @@ def create_observation_variable_in_db(api_data, user):
     except Trait.DoesNotExist:
         raise ValidationError('Trait not valid: ' + struct.scale)
 
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
     struct.metadata.group = group.name
 
     with transaction.atomic():
@@ -264,7 +269,7 @@ def update_observation_variable_in_db(validated_data, instance, user):
         msg = 'Can not change id in an update operation'
         raise ValidationError(format_error_message(msg))
 
-    group_belong_to_user = bool(user.groups.filter(name=struct.metadata.group).count())
+    group_belong_to_user = get_permission_context(user).belongs_to(struct.metadata.group)
 
     if not group_belong_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if group does not belong to you : {}'
@@ -294,3 +299,56 @@ def update_observation_variable_in_db(validated_data, instance, user):
 
     instance.save()
     return instance
+
+
+class ObservationVariableRegistry():
+    '''Process wide registry of the observation variable names with their
+    ids and scale data types.
+
+    Every change of the variables or scales increments a data version in
+    the database, and the registries of all the processes, web servers and
+    celery workers, reload the variables once they see the new version.
+    The version is read at most once by check interval'''
+
+    def __init__(self, check_interval=REGISTRY_CHECK_INTERVAL):
+        self._variables = None
+        self._version = None
+        self._check_interval = check_interval
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def _is_outdated(self):
+        if (self._checked is not None and
+                time.monotonic() - self._checked < self._check_interval):
+            return False
+        version = get_data_versions([OBSERVATION_VARIABLE_DATA])[0]
+        self._checked = time.monotonic()
+        return version != self._version
+
+    @property
+    def variables(self):
+        variables = self._variables
+        if variables is None or self._is_outdated():
+            with self._lock:
+                # read before the variables, a change made meanwhile is
+                # seen in the next check
+                version = get_data_versions([OBSERVATION_VARIABLE_DATA])[0]
+                queryset = ObservationVariable.objects.values_list(
+                    'name', 'observation_variable_id', 'scale__data_type__name')
+                variables = {name: (variable_id, data_type)
+                             for name, variable_id, data_type in queryset}
+                self._variables = variables
+                self._version = version
+                self._checked = time.monotonic()
+        return variables
+
+    def get(self, name):
+        return self.variables.get(name)
+
+    def invalidate(self):
+        # the other processes see the new version once it is committed
+        bump_data_versions(OBSERVATION_VARIABLE_DATA)
+        self._variables = None
+
+
+observation_variable_registry = ObservationVariableRegistry()
@@ -35,6 +35,26 @@ def merge_passports(passports):
     return PassportStruct(merged_passport.data)
 
 
+# These work on the passport instances prefetched by the list querysets, so
+# they do not hit the database once per serialized row
+def get_passports_taxa_names(passport_instances, rank):
+    names = []
+    for passport_instance in passport_instances:
+        for taxon in passport_instance.taxa.all():
+            if taxon.rank.name == rank and taxon.name not in names:
+                names.append(taxon.name)
+    return names
+
+
+def get_passports_country_codes(passport_instances):
+    codes = []
+    for passport_instance in passport_instances:
+        country = passport_instance.country
+        if country is not None and country.code not in codes:
+            codes.append(country.code)
+    return codes
+
+
 class PassportStruct(Passport):
 
     def __init__(self, api_data=None, instance=None, fields=None):
@@ -28,7 +28,7 @@ from vavilov3.views import format_error_message
 from vavilov3.entities.tags import (PLANT_NAME, PLANT_X, PLANT_Y, BLOCK_NUMBER,
                                     ENTRY_NUMBER, PLANT_NUMBER, PLOT_NUMBER)
 from vavilov3.models import Group, Plant
-from vavilov3.permissions import is_user_admin
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.id_validator import validate_name
 
 
@@ -220,7 +220,7 @@ def create_plant_in_db(api_data, user):
         msg = 'can not set group while creating the plant'
         raise ValueError(msg)
 
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
     struct.metadata.group = group.name
 
     with transaction.atomic():
@@ -246,7 +246,7 @@ def update_plant_in_db(validated_data, instance, user):
         msg = 'Can not change id in an update operation'
         raise ValidationError(format_error_message(msg))
 
-    group_belong_to_user = bool(user.groups.filter(name=struct.metadata.group).count())
+    group_belong_to_user = get_permission_context(user).belongs_to(struct.metadata.group)
 
     if not group_belong_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if group does not belong to you : {}'
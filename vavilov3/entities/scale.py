@@ -30,6 +30,7 @@ from vavilov3.entities.tags import (SCALE_NAME, SCALE_DESCRIPTION,
 from vavilov3.views import format_error_message
 from vavilov3.models import ScaleDataType, Scale, ScaleCategory
 from vavilov3.id_validator import validate_name
+from vavilov3.permissions import get_permission_context
 
 SCALE_ALLOWED_FIELDS = (SCALE_NAME, SCALE_DESCRIPTION, SCALE_DATA_TYPE,
                         SCALE_DECIMAL_PLACES, SCALE_MIN, SCALE_MAX,
@@ -230,7 +231,7 @@ def create_scale_in_db(api_data, user):
     except ScaleDataType.DoesNotExist:
         raise ValidationError('data type not valid: ' + struct.data_type)
 
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
 
     with transaction.atomic():
         try:
@@ -0,0 +1,107 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+from django.db import connection, transaction
+
+from vavilov3.models import EntityStats, invalidate_entity_stats_cache
+from vavilov3.raw_stat_sql_commands import (STATS_ENTITY_TYPES, STATS_SCOPES,
+                                            ACCESSION_STATS,
+                                            ACCESSIONSET_STATS,
+                                            ACCESSIONSET_STATS_INSTITUTES,
+                                            DELETE_ALL_ENTITY_STATS,
+                                            ENTITY_STATS_LOCK_ID,
+                                            LOCK_ENTITY_STATS,
+                                            INSTITUTE_SCOPE, COUNTRY_SCOPE,
+                                            TAXON_SCOPE,
+                                            get_insert_entity_stats_sql,
+                                            get_delete_entity_stats_sql,
+                                            get_refresh_all_entity_stats_sqls)
+
+
+def _refresh_scoped_stats(cursor, entity_type, scope, params):
+    for stats_type, stats_scope in STATS_SCOPES.items():
+        if stats_scope != scope:
+            continue
+        cursor.execute(get_delete_entity_stats_sql(stats_type, entity_type,
+                                                   scope), params)
+        cursor.execute(get_insert_entity_stats_sql(stats_type, entity_type,
+                                                   scope), params)
+
+
+def _get_institutes_countries_and_taxa(entity_type, institute_ids):
+    stats_types = [stats_type for stats_type, scope in STATS_SCOPES.items()
+                   if scope == INSTITUTE_SCOPE]
+    rows = EntityStats.objects.filter(entity_type=entity_type,
+                                      stats_type__in=stats_types,
+                                      institute_id__in=institute_ids)
+    countries, taxa = set(), set()
+    for country_id, taxon_id in rows.values_list('country_id', 'taxon_id'):
+        if country_id is not None:
+            countries.add(country_id)
+        if taxon_id is not None:
+            taxa.add(taxon_id)
+    return countries, taxa
+
+
+def _refresh_entity_stats(institute_ids, entity_types):
+    if institute_ids is not None:
+        institute_ids = list(set(institute_ids))
+        if not institute_ids:
+            return
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(LOCK_ENTITY_STATS, {'lock_id': ENTITY_STATS_LOCK_ID})
+        if institute_ids is None:
+            cursor.execute(DELETE_ALL_ENTITY_STATS)
+            for sql in get_refresh_all_entity_stats_sqls():
+                cursor.execute(sql)
+            return
+
+        accessionset_institute_ids = set(institute_ids)
+        # the changed accessions could be in the accessionsets of other
+        # institutes
+        if ACCESSION_STATS in entity_types and ACCESSIONSET_STATS in entity_types:
+            cursor.execute(ACCESSIONSET_STATS_INSTITUTES,
+                           {'institute_ids': institute_ids})
+            accessionset_institute_ids.update(row[0] for row in cursor.fetchall())
+
+        for entity_type in entity_types:
+            if entity_type == ACCESSIONSET_STATS:
+                entity_institute_ids = list(accessionset_institute_ids)
+            else:
+                entity_institute_ids = institute_ids
+            countries, taxa = _get_institutes_countries_and_taxa(
+                entity_type, entity_institute_ids)
+            _refresh_scoped_stats(cursor, entity_type, INSTITUTE_SCOPE,
+                                  {'institute_ids': entity_institute_ids})
+            new_countries, new_taxa = _get_institutes_countries_and_taxa(
+                entity_type, entity_institute_ids)
+            params = {'country_ids': list(countries.union(new_countries)),
+                      'taxon_ids': list(taxa.union(new_taxa))}
+            _refresh_scoped_stats(cursor, entity_type, COUNTRY_SCOPE, params)
+            _refresh_scoped_stats(cursor, entity_type, TAXON_SCOPE, params)
+
+
+def refresh_entity_stats(institute_ids=None, entity_types=STATS_ENTITY_TYPES):
+    '''It refreshes the stats of the accessions and accessionsets of the
+    given institutes, or all the stats.
+
+    The country and taxon stats are refreshed for the countries and taxa that
+    the institutes had before the refresh and have after it'''
+    _refresh_entity_stats(institute_ids, entity_types)
+    invalidate_entity_stats_cache()
@@ -29,8 +29,9 @@ from vavilov3.entities.tags import (
     STUDY_NAME, STUDY_DESCRIPTION, STUDY_ACTIVE, START_DATE, END_DATE,
     LOCATION, CONTACT, PROJECT_NAME, SEASON, INSTITUTION)
 from vavilov3.views import format_error_message
-from vavilov3.models import Group, Study, Project
-from vavilov3.permissions import is_user_admin
+from vavilov3.models import (Group, Study, Project, bump_data_versions,
+                             OBSERVATION_DATA)
+from vavilov3.permissions import is_user_admin, get_permission_context
 from vavilov3.id_validator import validate_name
 
 
@@ -302,7 +303,7 @@ def create_study_in_db(api_data, user, is_public=None):
     if is_public is None:
         is_public = False
 
-    group = user.groups.first()
+    group = get_permission_context(user).first_group
     study_struct.metadata.is_public = is_public
     study_struct.metadata.group = group.name
 
@@ -331,7 +332,7 @@ def update_study_in_db(validated_data, instance, user):
         msg = 'Can not change id in an update operation'
         raise ValidationError(format_error_message(msg))
 
-    group_belong_to_user = bool(user.groups.filter(name=study_struct.metadata.group).count())
+    group_belong_to_user = get_permission_context(user).belongs_to(study_struct.metadata.group)
 
     if not group_belong_to_user and not is_user_admin(user):
         msg = 'Can not change ownership if group does not belong to you : {}'
@@ -353,4 +354,6 @@ def update_study_in_db(validated_data, instance, user):
     instance.start_date = study_struct.start_date
     instance.end_date = study_struct.end_date
     instance.save()
+    # the observations of the study could be visible to other users
+    bump_data_versions(OBSERVATION_DATA)
     return instance
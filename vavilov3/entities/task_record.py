@@ -0,0 +1,164 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import json
+from datetime import timedelta
+
+from celery import states
+from celery.app import app_or_default
+
+from django.db import transaction
+from django.db.utils import IntegrityError
+from django.utils import timezone
+
+from django_celery_results.models import TaskResult
+
+from vavilov3.models import TaskRecord, UserTasks
+from vavilov3.entities.task_result_getter import (PROGRESS_STATE,
+                                                  get_task_artifact_url)
+from vavilov3.conf.settings import (TASK_RECORD_RETENTION,
+                                    UNOWNED_TASK_RECORD_RETENTION)
+
+
+def _to_json(value):
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return value
+
+
+def _get_task_result(state, retval):
+    if isinstance(retval, BaseException):
+        # as the celery result backends store the exceptions
+        return {'exc_type': type(retval).__name__,
+                'exc_message': [_to_json(arg) for arg in retval.args]}
+    if state == states.SUCCESS:
+        return _to_json(retval)
+    return None
+
+
+def register_task(task_id, **fields):
+    '''It creates or updates the registry row of the task, the celery
+    signals and the views fill it in any order'''
+    if not task_id:
+        return
+    if TaskRecord.objects.filter(task_id=task_id).update(**fields):
+        return
+    try:
+        with transaction.atomic():
+            TaskRecord.objects.create(task_id=task_id, **fields)
+    except IntegrityError:
+        # other signal has created it meanwhile
+        TaskRecord.objects.filter(task_id=task_id).update(**fields)
+
+
+def register_task_published(task_id, task_name):
+    register_task(task_id, task_name=task_name)
+
+
+def register_task_started(task_id, task_name):
+    register_task(task_id, task_name=task_name, status=states.STARTED,
+                  date_started=timezone.now())
+
+
+def register_task_progress(task_id, progress):
+    register_task(task_id, status=PROGRESS_STATE, progress=progress)
+
+
+def register_task_finished(task_id, task_name, state, retval):
+    fields = {'task_name': task_name, 'status': state,
+              'result': _get_task_result(state, retval)}
+    if state in states.READY_STATES:
+        fields['date_done'] = timezone.now()
+    register_task(task_id, **fields)
+
+
+def register_task_revoked(task_id):
+    register_task(task_id, status=states.REVOKED, date_done=timezone.now())
+
+
+def get_task_record_data(record):
+    '''It gives the task as the task result getter does'''
+    if record.status == states.FAILURE:
+        try:
+            result = record.result['exc_message'][0]
+        except (TypeError, KeyError, IndexError):
+            result = ''
+    elif record.status == states.SUCCESS:
+        if isinstance(record.result, dict) and 'detail' in record.result:
+            result = record.result['detail']
+        else:
+            result = 'Internal Job successful'
+    else:
+        result = ''
+
+    name = None
+    if record.task_name:
+        name = record.task_name.split('.')[-1].replace('_', ' ').title()
+
+    data = {'task_id': record.task_id,
+            'task_name': record.task_name,
+            'name': name,
+            'status': record.status,
+            'result': result,
+            'owner': record.user.username if record.user_id else None,
+            'date_done': record.date_done}
+    if get_task_record_artifact_path(record) is not None:
+        data['artifact'] = get_task_artifact_url(record.task_id)
+    if record.status == PROGRESS_STATE and record.progress is not None:
+        data['progress'] = record.progress
+    return data
+
+
+def get_task_record_artifact_path(record):
+    # the file written by the export tasks in the export storage
+    if record.status == states.SUCCESS and isinstance(record.result, dict):
+        return record.result.get('artifact')
+    return None
+
+
+def delete_task_record(record):
+    if record.status not in states.READY_STATES:
+        app_or_default().control.revoke(record.task_id, terminate=True)
+    TaskResult.objects.filter(task_id=record.task_id).delete()
+    UserTasks.objects.filter(task_id=record.task_id).delete()
+    record.delete()
+
+
+def remove_expired_task_records(retention=TASK_RECORD_RETENTION,
+                                unowned_retention=UNOWNED_TASK_RECORD_RETENTION):
+    '''It removes the tasks of the users older than the retention time, with
+    their results, and the internal tasks without owner (thumbnails, chord
+    parts, scheduled jobs) older than their shorter retention time.
+
+    It returns the number of removed tasks'''
+    now = timezone.now()
+    unowned_records = TaskRecord.objects.filter(
+        user__isnull=True,
+        date_created__lt=now - timedelta(seconds=unowned_retention))
+    num_removed = unowned_records.delete()[0]
+
+    records = TaskRecord.objects.filter(
+        date_created__lt=now - timedelta(seconds=retention))
+    task_ids = list(records.values_list('task_id', flat=True))
+    with transaction.atomic():
+        TaskResult.objects.filter(task_id__in=task_ids).delete()
+        UserTasks.objects.filter(task_id__in=task_ids).delete()
+        num_removed += TaskRecord.objects.filter(task_id__in=task_ids).delete()[0]
+    return num_removed
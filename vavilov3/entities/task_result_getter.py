@@ -20,6 +20,8 @@ import time
 
 from celery.app import app_or_default
 
+from django.urls import reverse
+
 from django_celery_results.models import TaskResult
 
 from vavilov3.models import UserTasks
@@ -32,6 +34,14 @@ class TaskDoesNotExistError(Exception):
 POLLING_STEP = 0.2
 TIMEOUT_LIMIT = 1
 
+# custom state of the tasks that report their progress
+PROGRESS_STATE = 'PROGRESS'
+
+
+def get_task_artifact_url(task_id):
+    # the artifacts are only downloaded by the owners of the tasks
+    return reverse('task-artifact', kwargs={'task_id': task_id})
+
 
 def task_in_active_tasks(active_tasks, task_id):
     for tasks in active_tasks.values():
@@ -85,7 +95,7 @@ def get_active_tasks(task_id=None):
 
 class TaskResultGetter():
 
-    def __init__(self, task_id):
+    def __init__(self, task_id, inspect_active=True):
         self._data = {}
         try:
             db_result = TaskResult.objects.get(task_id=task_id)
@@ -94,7 +104,7 @@ class TaskResultGetter():
         self._db_result = db_result
 
         active_task = None
-        if self._db_result is None:
+        if self._db_result is None and inspect_active:
             try:
                 active_tasks_by_id = get_active_tasks(task_id)
             except ValueError:
@@ -170,7 +180,7 @@ class TaskResultGetter():
             if result is not None and 'detail' in result:
                 return result['detail']
             return "Internal Job successful"
-        elif self.status == 'REVOKED':
+        elif self.status in ('REVOKED', PROGRESS_STATE):
             result = ''
 
         return result
@@ -202,15 +212,38 @@ class TaskResultGetter():
     def date_done(self, date_done):
         self._data['date_done'] = date_done
 
+    @property
+    def artifact_path(self):
+        # the file written by the export tasks in the export storage
+        if self.status != 'SUCCESS':
+            return None
+        result = json.loads(self._data['result'])
+        if isinstance(result, dict):
+            return result.get('artifact')
+        return None
+
+    @property
+    def progress(self):
+        # the running tasks store their progress as result
+        if self.status != PROGRESS_STATE:
+            return None
+        return json.loads(self._data['result'])
+
     @property
     def data(self):
-        return {'task_id': self.task_id,
+        data = {'task_id': self.task_id,
                 'task_name': self.task_name,
                 'name': self.name,
                 'status': self.status,
                 'result': self.result,
                 'owner': self.username,
                 'date_done': self.date_done}
+        if self.artifact_path is not None:
+            data['artifact'] = get_task_artifact_url(self.task_id)
+        progress = self.progress
+        if progress is not None:
+            data['progress'] = progress
+        return data
 
     def delete(self):
         app = app_or_default()
@@ -16,36 +16,140 @@
 #
 #
 
+import csv
+import io
+import os
+import zipfile
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
 import xlrd
-from collections import OrderedDict
+from openpyxl import load_workbook
 
+# xlsx cells are given with the same interface than the xlrd ones
+ExcelCell = namedtuple('ExcelCell', ['value', 'ctype'])
 
-def excel_dict_reader(fhand, sheet_name=None, values_as_text=False):
+
+XLS_SIGNATURE = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+
+def _is_xls(fhand):
+    if isinstance(fhand, str):
+        with open(fhand, 'rb') as bin_fhand:
+            return bin_fhand.read(len(XLS_SIGNATURE)) == XLS_SIGNATURE
+    signature = fhand.read(len(XLS_SIGNATURE))
+    fhand.seek(0)
+    return signature == XLS_SIGNATURE
+
+
+def _is_xlsx(fhand):
     if isinstance(fhand, str):
-        book = xlrd.open_workbook(filename=fhand)
+        return zipfile.is_zipfile(fhand)
+    is_xlsx = zipfile.is_zipfile(fhand)
+    fhand.seek(0)
+    return is_xlsx
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return ExcelCell('', xlrd.XL_CELL_EMPTY)
+    if isinstance(value, bool):
+        return ExcelCell(int(value), xlrd.XL_CELL_BOOLEAN)
+    if isinstance(value, (int, float)):
+        return ExcelCell(float(value), xlrd.XL_CELL_NUMBER)
+    if isinstance(value, datetime):
+        return ExcelCell(value, xlrd.XL_CELL_DATE)
+    return ExcelCell(str(value), xlrd.XL_CELL_TEXT)
+
+
+def _cell_to_text(cell):
+    str_value = str(cell.value)
+    if cell.ctype == xlrd.XL_CELL_NUMBER and cell.value == int(cell.value):
+        str_value = str_value.split('.')[0]
+    return str_value
+
+
+def _xlsx_rows(fhand, sheet_name=None):
+    # read only mode parses the sheet while it is iterated
+    book = load_workbook(fhand, read_only=True, data_only=True)
+    try:
+        sheet = book[sheet_name] if sheet_name else book.worksheets[0]
+        for row in sheet.iter_rows(values_only=True):
+            yield [_xlsx_cell(value) for value in row]
+    finally:
+        book.close()
+
+
+def _xls_rows(fhand, sheet_name=None):
+    # the old binary format can not be parsed incrementally, but with a file
+    # path xlrd maps the file instead of copying it in memory
+    # the big uploads are in temporary files in disk
+    fpath = fhand if isinstance(fhand, str) else getattr(fhand, 'name', None)
+    if isinstance(fpath, str) and os.path.isfile(fpath):
+        book = xlrd.open_workbook(filename=fpath, on_demand=True)
     else:
-        book = xlrd.open_workbook(file_contents=fhand.read())
+        book = xlrd.open_workbook(file_contents=fhand.read(), on_demand=True)
+    try:
+        if sheet_name:
+            sheet = book.sheet_by_name(sheet_name)
+        else:
+            sheet = book.sheet_by_index(0)
+        for row in sheet.get_rows():
+            yield row
+    finally:
+        book.release_resources()
+
 
-    if sheet_name:
-        sheet = book.sheet_by_name(sheet_name)
+def excel_dict_reader(fhand, sheet_name=None, values_as_text=False):
+    if _is_xlsx(fhand):
+        rows = _xlsx_rows(fhand, sheet_name=sheet_name)
     else:
-        sheet = book.sheets()[0]
+        rows = _xls_rows(fhand, sheet_name=sheet_name)
 
-    header = [header.value for header in sheet.row(0)]
+    try:
+        header = [header.value for header in next(rows)]
+    except StopIteration:
+        return
+    # xlsx sheets can report empty columns after the last one with data
+    while header and header[-1] == '':
+        header.pop()
 
-    first = True
-    for row in sheet.get_rows():
-        if first:
-            first = False
+    for row in rows:
+        if not any(str(cell.value) for cell in row):
             continue
+        if len(row) < len(header):
+            row = list(row) + [_xlsx_cell(None)] * (len(header) - len(row))
         if values_as_text:
-            rowcells = []
-            for cell in row:
-                str_value = str(cell.value)
-                if cell.ctype == 2 and cell.value == int(cell.value):
-                    str_value = str_value.split('.')[0]
-                rowcells.append(str_value)
+            rowcells = [_cell_to_text(cell) for cell in row]
         else:
             rowcells = [cell for cell in row]
         row_data = OrderedDict(zip(header, rowcells))
         yield row_data
+
+
+def csv_dict_reader(fhand, delimiter=','):
+    if isinstance(fhand, str):
+        with open(fhand, newline='') as text_fhand:
+            yield from _csv_dict_rows(text_fhand, delimiter)
+    elif isinstance(fhand, io.TextIOBase):
+        yield from _csv_dict_rows(fhand, delimiter)
+    else:
+        text_fhand = io.TextIOWrapper(fhand, encoding='utf-8', newline='')
+        yield from _csv_dict_rows(text_fhand, delimiter)
+
+
+def _csv_dict_rows(fhand, delimiter):
+    reader = csv.DictReader(fhand, delimiter=delimiter)
+    try:
+        fields = reader.fieldnames
+    except UnicodeDecodeError:
+        raise ValueError('This is not a csv file')
+    for row in reader:
+        yield OrderedDict(((field, row[field]) for field in fields))
+
+
+def tabular_dict_reader(fhand):
+    # rows of xlsx, xls or csv files are read lazily as text values
+    if _is_xlsx(fhand) or _is_xls(fhand):
+        return excel_dict_reader(fhand, values_as_text=True)
+    return csv_dict_reader(fhand)
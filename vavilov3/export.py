@@ -0,0 +1,173 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import gzip
+import json
+import os
+import tempfile
+import time
+from os.path import join
+
+from openpyxl import Workbook
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.http.request import HttpRequest, QueryDict
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from rest_framework.request import Request
+
+from vavilov3.models import get_data_versions
+from vavilov3.permissions import get_permission_context
+from vavilov3.conf.settings import EXPORT_ROOT, EXPORT_RETENTION, TMP_DIR
+
+CSV_EXPORT = 'csv'
+EXCEL_EXPORT = 'excel'
+EXPORT_FORMATS = (CSV_EXPORT, EXCEL_EXPORT)
+EXPORT_SUFFIXES = {CSV_EXPORT: '.csv.gz', EXCEL_EXPORT: '.xlsx'}
+
+
+def get_export_storage():
+    return FileSystemStorage(location=EXPORT_ROOT)
+
+
+def get_export_view(view_path, search_params, user):
+    '''It builds the list view as if the user had asked it with the search
+    params, so the export is filtered as the list'''
+    http_request = HttpRequest()
+    http_request.method = 'GET'
+    query = QueryDict(mutable=True)
+    for key, value in search_params.items():
+        if isinstance(value, (list, tuple)):
+            query.setlist(key, [str(item) for item in value])
+        else:
+            query[key] = str(value)
+    http_request.GET = query
+    request = Request(http_request)
+    request.user = user
+    view = import_string(view_path)(request=request, action='list',
+                                    args=(), kwargs={}, format_kwarg=None)
+    return view
+
+
+def _get_export_key(view_path, search_params, user, export_format):
+    context = get_permission_context(user)
+    permissions = 'admin' if context.is_admin else sorted(context.group_ids)
+    key = json.dumps([view_path, search_params, permissions, export_format],
+                     sort_keys=True, default=str)
+    # keyed with the secret key, so the name of an export can not be guessed
+    # from the search params
+    return salted_hmac('vavilov3.export', key).hexdigest()
+
+
+def _to_excel_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def _write_csv(view, queryset, fpath):
+    with gzip.open(fpath, 'wt', newline='') as fhand:
+        for lines in view.iter_csv_lines(queryset):
+            fhand.write(lines)
+
+
+def _write_excel(view, queryset, fpath):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(view.csv_fields)
+    for rows in view.iter_csv_row_chunks(queryset):
+        for row in rows:
+            sheet.append([_to_excel_value(value) for value in row])
+    workbook.save(fpath)
+
+
+def _remove_old_artifacts(storage, export_dir, key, artifact_name):
+    try:
+        fnames = storage.listdir(export_dir)[1]
+    except FileNotFoundError:
+        return
+    for fname in fnames:
+        if fname.startswith(key) and fname != artifact_name:
+            storage.delete(join(export_dir, fname))
+
+
+def remove_expired_exports(retention=EXPORT_RETENTION):
+    '''It removes the exports not written or reused in the retention time
+    and returns how many were removed'''
+    storage = get_export_storage()
+    try:
+        export_dirs = storage.listdir('')[0]
+    except FileNotFoundError:
+        return 0
+    oldest_time = time.time() - retention
+    num_removed = 0
+    for export_dir in export_dirs:
+        for fname in storage.listdir(export_dir)[1]:
+            fpath = join(export_dir, fname)
+            try:
+                if os.path.getmtime(storage.path(fpath)) < oldest_time:
+                    storage.delete(fpath)
+                    num_removed += 1
+            except FileNotFoundError:
+                # removed by other export meanwhile
+                continue
+    return num_removed
+
+
+def export_items(view_path, search_params, user, export_format=CSV_EXPORT):
+    '''It writes the items of the list view filtered by the search params
+    in a file in the export storage and returns its path.
+
+    The file is reused by the exports with the same search params and
+    permissions until the exported data changes'''
+    storage = get_export_storage()
+    view = get_export_view(view_path, search_params, user)
+    versions = get_data_versions(view.export_data_versions)
+    key = _get_export_key(view_path, search_params, user, export_format)
+    export_dir = view.serializer_class.data_type
+    artifact_name = '{}_{}{}'.format(key, '_'.join(map(str, versions)),
+                                     EXPORT_SUFFIXES[export_format])
+    artifact_path = join(export_dir, artifact_name)
+    if storage.exists(artifact_path):
+        # the reused exports start again their retention time
+        try:
+            os.utime(storage.path(artifact_path))
+            return artifact_path
+        except FileNotFoundError:
+            # expired meanwhile
+            pass
+
+    queryset = view.filter_queryset(view.get_queryset())
+    fdesc, fpath = tempfile.mkstemp(suffix=EXPORT_SUFFIXES[export_format],
+                                    dir=TMP_DIR)
+    os.close(fdesc)
+    try:
+        if export_format == CSV_EXPORT:
+            _write_csv(view, queryset, fpath)
+        else:
+            _write_excel(view, queryset, fpath)
+        with open(fpath, 'rb') as fhand:
+            # other export could have saved it meanwhile
+            if not storage.exists(artifact_path):
+                artifact_path = storage.save(artifact_path, File(fhand))
+    finally:
+        os.remove(fpath)
+    _remove_old_artifacts(storage, export_dir, key, artifact_name)
+    return artifact_path
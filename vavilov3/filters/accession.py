@@ -19,14 +19,23 @@
 from django.db.models import Q
 from django_filters import rest_framework as filters
 
-from vavilov3.filters.shared import TermFilterMixin
 from vavilov3.models import Accession
 from vavilov3.entities.tags import IS_ACTIVE
 from vavilov3.conf import settings
 
 
-class AccessionFilter(TermFilterMixin, filters.FilterSet):
-    term = filters.CharFilter(label='term', method='term_filter')
+# filter name: (accession summary array, value normalization)
+SUMMARY_ARRAY_FILTERS = {
+    'crop_name': ('crop_names', str.lower),
+    'country': ('countries', str.upper),
+    'biological_status': ('biological_statuses', None),
+    'collection_source': ('collection_sources', None),
+    'taxon': ('taxa', str.lower),
+    'rank': ('ranks', None)}
+
+
+class AccessionFilter(filters.FilterSet):
+    term = filters.CharFilter(label='term', method='number_filter')
     is_public = filters.BooleanFilter()
     group = filters.CharFilter(field_name='group__name', lookup_expr='exact')
     institute_code = filters.CharFilter(field_name='institute__code',
@@ -39,35 +48,27 @@ class AccessionFilter(TermFilterMixin, filters.FilterSet):
     is_available = filters.BooleanFilter()
     in_nulear_collection = filters.BooleanFilter()
 
-    # passport realted filters
-    crop_name = filters.CharFilter(
-        field_name='passports__crop_name', lookup_expr='iexact',
-        distinct=True)
-    country = filters.CharFilter(
-        field_name='passports__country__code', lookup_expr='iexact',
-        distinct=True)
-    biological_status = filters.CharFilter(
-        field_name='passports__biological_status', lookup_expr='exact',
-        distinct=True)
-    collection_source = filters.CharFilter(
-        field_name='passports__collection_source', lookup_expr='exact',
-        distinct=True)
-    taxon = filters.CharFilter(
-        label='Passport taxon',
-        field_name='passports__taxa__name',
-        lookup_expr='iexact', distinct=True)
+    # passport realted filters, they are read from the accession summary
+    crop_name = filters.CharFilter(label='Passport crop name',
+                                   method='summary_array_filter')
+    country = filters.CharFilter(label='Passport country',
+                                 method='summary_array_filter')
+    biological_status = filters.CharFilter(label='Passport biological status',
+                                           method='summary_array_filter')
+    collection_source = filters.CharFilter(label='Passport collection source',
+                                           method='summary_array_filter')
+    taxon = filters.CharFilter(label='Passport taxon',
+                               method='summary_array_filter')
     taxon_contains = filters.CharFilter(
         label='Passport taxon contains',
-        field_name='passports__taxa__name',
-        lookup_expr='icontains', distinct=True)
-    rank = filters.CharFilter(
-        label='Passport rank',
-        field_name='passports__taxa__rank__name',
-        lookup_expr='exact', distinct=True)
+        field_name='summary__taxa_text',
+        lookup_expr='icontains')
+    rank = filters.CharFilter(label='Passport rank',
+                              method='summary_array_filter')
 
     number_contains = filters.CharFilter(
         label='Any accession number in entity',
-        method='number_filter', distinct=True)
+        method='number_filter')
     site = filters.CharFilter(label='site', method='site_filter')
 
     study = filters.CharFilter(label='study', field_name='observationunit__study__name',
@@ -89,16 +90,16 @@ class AccessionFilter(TermFilterMixin, filters.FilterSet):
             queryset = queryset.filter(query).distinct()
         return queryset
 
+    def summary_array_filter(self, queryset, name, value):
+        summary_field, normalize = SUMMARY_ARRAY_FILTERS[name]
+        if normalize is not None:
+            value = normalize(value)
+        lookup = 'summary__{}__contains'.format(summary_field)
+        return queryset.filter(**{lookup: [value]})
+
     def number_filter(self, queryset, _, value):
-        queryset = queryset.filter(
-            Q(germplasm_number__icontains=value) |
-            Q(passports__accession_name__icontains=value) |
-            Q(passports__collection_number__icontains=value)).distinct()
-        return queryset
+        # the summary numbers include the germplasm number
+        return queryset.filter(summary__numbers_text__icontains=value)
 
     def site_filter(self, queryset, _, value):
-        return queryset.filter(
-            Q(passports__state__icontains=value) |
-            Q(passports__province__icontains=value) |
-            Q(passports__municipality__icontains=value) |
-            Q(passports__location_site__icontains=value)).distinct()
+        return queryset.filter(summary__sites_text__icontains=value)
@@ -16,45 +16,47 @@
 #
 #
 
-from operator import and_
-from functools import reduce
-
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
 
 from rest_framework.filters import BaseFilterBackend
-from vavilov3.models import ObservationVariable
+from vavilov3.models import Observation
+from vavilov3.entities.tags import NUMERICAL
+from vavilov3.entities.observation_variable import observation_variable_registry
+from vavilov3.filters.shared import to_numeric_filter_value
 
 
 class AccessionByObservationFilterBackend(BaseFilterBackend):
     """
-    Filter that only allows users to see their own objects.
+    It filters the accessions by the values of their observations, the query
+    params named as an observation variable are the trait filters.
     """
 
     def filter_queryset(self, request, queryset, _):
+        variables = observation_variable_registry.variables
         observation_variables_to_filter = []
-        new_query_params = {}
         for key, value in request.query_params.items():
             trait_method = key.split('__')[0]
-            try:
-                variable = ObservationVariable.objects.get(name=trait_method)
-                observation_variables_to_filter.append((key, value, variable))
-            except ObservationVariable.DoesNotExist:
-                new_query_params[key] = value
-
-        request._request.GET = new_query_params
+            if trait_method in variables:
+                observation_variables_to_filter.append((key, value,
+                                                        variables[trait_method]))
 
-        for filter_expresion, value, variable in observation_variables_to_filter:
-            trait_filter = []
+        for index, (filter_expresion, value, variable) in enumerate(observation_variables_to_filter):
+            variable_id, data_type = variable
             items = filter_expresion.split('__')
-            observation_variable_name = items[0]
-            trait_filter.append(Q(('observationunit__observation__observation_variable__name', observation_variable_name)))
-            if len(items) == 1:
-                lookup_expression = 'int__exact'
-            elif len(items) == 2:
-                lookup_expression = 'int__{}'.format(items[1])
-            trait_filter.append(Q(('observationunit__observation__value__{}'.format(lookup_expression),
-                                value)))
-            queryset = queryset.filter(reduce(and_, trait_filter))
+            lookup = items[1] if len(items) > 1 else 'exact'
+            if data_type == NUMERICAL:
+                # it uses the variable and value_numeric index
+                value_filter = {'value_numeric__{}'.format(lookup):
+                                to_numeric_filter_value(filter_expresion, value)}
+            else:
+                value_filter = {'value__int__{}'.format(lookup): value}
+            # an exists by trait, the accessions are not multiplied by their
+            # observations
+            observations = Observation.objects.filter(
+                observation_unit__accession=OuterRef('pk'),
+                observation_variable_id=variable_id, **value_filter)
+            trait_annotation = 'has_trait_{}'.format(index)
+            queryset = queryset.annotate(**{trait_annotation: Exists(observations)})
+            queryset = queryset.filter(**{trait_annotation: True})
 
-        # print(queryset.query)
         return queryset
@@ -90,15 +90,11 @@ class AccessionSetFilter(TermFilterMixin, filters.FilterSet):
 
     def site_filter(self, queryset, _, value):
         queryset = queryset.filter(
-            Q(accessions__passports__state__icontains=value) |
-            Q(accessions__passports__province__icontains=value) |
-            Q(accessions__passports__municipality__icontains=value) |
-            Q(accessions__passports__location_site__icontains=value))
+            accessions__summary__sites_text__icontains=value)
         return queryset.distinct()
 
     def number_contain_filter(self, queryset, _, value):
         queryset = queryset.filter(
             Q(accessionset_number__icontains=value) |
-            Q(accessions__germplasm_number__icontains=value) |
-            Q(accessions__passports__collection_number__icontains=value))
+            Q(accessions__summary__numbers_text__icontains=value))
         return queryset.distinct()
@@ -34,7 +34,7 @@ class InstituteFilter(TermFilterMixin, filters.FilterSet):
 
     class Meta:
         model = Institute
-        fields = {'code': ['exact', 'iexact', 'icontains'],
+        fields = {'code': ['exact', 'iexact', 'icontains', 'in'],
                   'name': ['exact', 'iexact', 'icontains']}
 
     def code_or_name_filter(self, queryset, _, value):
@@ -19,12 +19,13 @@
 from django_filters import rest_framework as filters
 
 from vavilov3.models import Observation, ObservationVariable
-from vavilov3.filters.shared import TermFilterMixin
+from vavilov3.filters.shared import TermFilterMixin, to_numeric_filter_value
 from django_filters.filters import DateTimeFromToRangeFilter
 from rest_framework.exceptions import ValidationError
 from django.db.models.lookups import Transform
 from django.db.models.fields import Field
 from vavilov3.views import format_error_message
+from vavilov3.entities.tags import NUMERICAL
 
 
 @Field.register_lookup
@@ -83,29 +84,32 @@ class ObservationFilter(TermFilterMixin, filters.FilterSet):
         model = Observation
         fields = {'observer': ['exact', 'iexact', 'icontains']}
 
-    def value_range_min_filter(self, queryset, _, value):
-        self._check_observation_variable_in_filter()
-        queryset = queryset.filter(value__int__gte=int(value))
-        return queryset
+    def value_range_min_filter(self, queryset, name, value):
+        observation_variable = self._check_observation_variable_in_filter()
+        # the variable and value_numeric index is used for the range
+        return queryset.filter(observation_variable=observation_variable,
+                               value_numeric__gte=to_numeric_filter_value(name, value))
 
-    def value_range_max_filter(self, queryset, _, value):
-        self._check_observation_variable_in_filter()
-        queryset = queryset.filter(value__int__lte=int(value))
-        return queryset
+    def value_range_max_filter(self, queryset, name, value):
+        observation_variable = self._check_observation_variable_in_filter()
+        return queryset.filter(observation_variable=observation_variable,
+                               value_numeric__lte=to_numeric_filter_value(name, value))
 
     def _check_observation_variable_in_filter(self):
         if 'observation_variable' not in self.data.keys():
             msg = 'Can not use value_range filter if not filtered by observation variable'
             raise ValidationError(format_error_message(msg))
         try:
-            observation_variable = ObservationVariable.objects.get(name=self.data['observation_variable'])
+            observation_variable = ObservationVariable.objects.select_related(
+                'scale__data_type').get(name=self.data['observation_variable'])
         except ObservationVariable.DoesNotExist:
             msg = 'Used observation_variable to filter does not exist'
             raise ValidationError(format_error_message(msg))
 
-        if observation_variable.scale.data_type.name not in ('Numerical',):
+        if observation_variable.scale.data_type.name != NUMERICAL:
             msg = "Used observation_variable's data type is not numeric"
             raise ValidationError(format_error_message(msg))
+        return observation_variable
 
     def studies_filter(self, queryset, _, value):
         return queryset.filter(observation_unit__study__name__in=value.split(','))
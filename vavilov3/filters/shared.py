@@ -18,9 +18,21 @@
 
 from django.db.models import Q
 
+from rest_framework.exceptions import ValidationError
+
+from vavilov3.views import format_error_message
+
 
 class TermFilterMixin():
 
     def term_filter(self, qs, _, value):
         return qs.filter(Q(code__icontains=value) |
                          Q(name__icontains=value))
+
+
+def to_numeric_filter_value(filter_name, value):
+    try:
+        return float(value)
+    except ValueError:
+        msg = '{} filter must be numeric: {}'.format(filter_name, value)
+        raise ValidationError(format_error_message(msg))
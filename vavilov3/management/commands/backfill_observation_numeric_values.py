@@ -0,0 +1,50 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Max, Min
+
+from vavilov3.models import Observation
+from vavilov3.entities.tags import NUMERICAL
+from vavilov3.raw_observation_sql_commands import BACKFILL_OBSERVATION_NUMERIC_VALUES
+
+
+class Command(BaseCommand):
+    help = 'Fill the numeric value of the observations of numerical variables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--batch_size', type=int, default=100000,
+                            help='Number of observation ids updated by transaction')
+
+    def handle(self, *arg, **options):
+        batch_size = options['batch_size']
+        ids = Observation.objects.aggregate(min_id=Min('observation_id'),
+                                            max_id=Max('observation_id'))
+        if ids['min_id'] is None:
+            return
+        num_updated = 0
+        # every batch is committed on its own, so the table is not locked
+        # during the whole backfill and it can be resumed
+        for min_id in range(ids['min_id'], ids['max_id'] + 1, batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(BACKFILL_OBSERVATION_NUMERIC_VALUES,
+                               {'data_type': NUMERICAL, 'min_id': min_id,
+                                'max_id': min_id + batch_size})
+                num_updated += cursor.rowcount
+        self.stdout.write('{} observations updated'.format(num_updated))
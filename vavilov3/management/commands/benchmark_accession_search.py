@@ -0,0 +1,80 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import math
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from vavilov3.filters.accession import AccessionFilter
+from vavilov3.models import Accession, Passport
+
+DEFAULT_SEARCHES = ['number_contains=BGE00', 'site=valencia',
+                    'taxon_contains=lycopersicum', 'term=001']
+
+
+def _percentile(timings, percent):
+    timings = sorted(timings)
+    index = max(int(math.ceil(percent / 100 * len(timings))) - 1, 0)
+    return timings[index]
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency of the accession list searches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-s', '--search', action='append',
+                            help='filter=value, it can be repeated')
+        parser.add_argument('-n', '--repeat', type=int, default=20)
+        parser.add_argument('-l', '--limit', type=int, default=100,
+                            help='page size')
+        parser.add_argument('--explain', action='store_true',
+                            help='print the query plan of every search')
+
+    def handle(self, *arg, **options):
+        self.stdout.write('passports in db: {}'.format(Passport.objects.count()))
+        self.stdout.write('search\tmatches\tp50 ms\tp95 ms\tmax ms')
+        limit = options['limit']
+        for search in options['search'] or DEFAULT_SEARCHES:
+            try:
+                filter_name, value = search.split('=', 1)
+            except ValueError:
+                raise CommandError('searches must be given as filter=value')
+            queryset = Accession.objects.all().order_by('germplasm_number')
+            filterset = AccessionFilter({filter_name: value}, queryset)
+            if not filterset.is_valid():
+                raise CommandError(str(filterset.errors))
+            queryset = filterset.qs
+
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                num_matches = queryset.count()
+                list(queryset[:limit])
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write('{}\t{}\t{:.1f}\t{:.1f}\t{:.1f}'.format(
+                search, num_matches, _percentile(timings, 50),
+                _percentile(timings, 95), max(timings)))
+
+            if options['explain']:
+                sql, params = queryset[:limit].query.sql_with_params()
+                with connection.cursor() as cursor:
+                    cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+                    for row in cursor.fetchall():
+                        self.stdout.write(row[0])
@@ -0,0 +1,43 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import threading
+from contextlib import contextmanager
+
+# the journals opened in this thread, the files written are added to all
+# of them
+_local = threading.local()
+
+
+def record_written_file(name):
+    for journal in getattr(_local, 'journals', []):
+        journal.append(name)
+
+
+@contextmanager
+def journal_written_files():
+    '''It collects the names of the media files written inside the block, so
+    the code that fails can remove exactly the files it has written'''
+    journal = []
+    if not hasattr(_local, 'journals'):
+        _local.journals = []
+    _local.journals.append(journal)
+    try:
+        yield journal
+    finally:
+        _local.journals.remove(journal)
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.11 on 2026-10-18 01:16
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0007_auto_20201211_1034'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkTaskProgress',
+            fields=[
+                ('bulk_task_progress_id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('task_id', models.CharField(max_length=100, unique=True)),
+                ('committed_chunks', models.IntegerField(default=0)),
+                ('num_items', models.IntegerField(default=0)),
+                ('errors', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+            ],
+            options={
+                'db_table': 'vavilov_bulk_task_progress',
+            },
+        ),
+    ]
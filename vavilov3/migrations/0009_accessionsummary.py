@@ -0,0 +1,142 @@
+# Generated by Django 2.2.11 on 2026-10-18 01:24
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the sql of the summary refresh when the table was created, so this
+# migration does not change with the runtime sql
+REFRESH_ACCESSION_SUMMARIES = '''
+INSERT INTO "vavilov_accession_summary" ("accession_id", "institute_code",
+                                         "germplasm_number", "group_id",
+                                         "is_public", "genera", "species",
+                                         "taxa", "ranks", "countries",
+                                         "latitudes", "longitudes",
+                                         "crop_names", "pdci", "data_sources",
+                                         "biological_statuses",
+                                         "collection_sources", "taxa_text",
+                                         "numbers_text", "sites_text")
+    SELECT "accession"."accession_id", "institute"."code",
+           "accession"."germplasm_number", "accession"."group_id",
+           "accession"."is_public",
+           COALESCE("taxa"."genera", '{}'), COALESCE("taxa"."species", '{}'),
+           COALESCE("taxa"."taxa", '{}'), COALESCE("taxa"."ranks", '{}'),
+           COALESCE("passport"."countries", '{}'),
+           COALESCE("passport"."latitudes", '{}'),
+           COALESCE("passport"."longitudes", '{}'),
+           COALESCE("passport"."crop_names", '{}'), "passport"."pdci",
+           COALESCE("passport"."data_sources", '{}'),
+           COALESCE("passport"."biological_statuses", '{}'),
+           COALESCE("passport"."collection_sources", '{}'),
+           COALESCE("taxa"."taxa_text", ''),
+           concat_ws(E'\\n', "accession"."germplasm_number", "passport"."numbers_text"),
+           COALESCE("passport"."sites_text", '')
+        FROM "vavilov_accession" AS "accession"
+            INNER JOIN "vavilov_institute" AS "institute" ON ("institute"."institute_id" = "accession"."institute_id")
+            LEFT JOIN LATERAL (
+                SELECT array_agg(DISTINCT "vavilov_taxon"."name") FILTER (WHERE "vavilov_rank"."name" = 'genus') AS "genera",
+                       array_agg(DISTINCT "vavilov_taxon"."name") FILTER (WHERE "vavilov_rank"."name" = 'species') AS "species",
+                       array_agg(DISTINCT lower("vavilov_taxon"."name")) AS "taxa",
+                       array_agg(DISTINCT "vavilov_rank"."name") AS "ranks",
+                       string_agg(DISTINCT "vavilov_taxon"."name", E'\\n') AS "taxa_text"
+                    FROM "vavilov_passport"
+                        INNER JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+                        INNER JOIN "vavilov_taxon" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
+                        INNER JOIN "vavilov_rank" ON ("vavilov_rank"."rank_id" = "vavilov_taxon"."rank_id")
+                    WHERE "vavilov_passport"."accession_id" = "accession"."accession_id"
+            ) AS "taxa" ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT array_agg(DISTINCT "vavilov_country"."code") FILTER (WHERE "vavilov_country"."code" IS NOT NULL) AS "countries",
+                       array_agg("vavilov_passport"."latitude" ORDER BY "vavilov_passport"."passport_id") FILTER (WHERE "vavilov_passport"."latitude" IS NOT NULL) AS "latitudes",
+                       array_agg("vavilov_passport"."longitude" ORDER BY "vavilov_passport"."passport_id") FILTER (WHERE "vavilov_passport"."longitude" IS NOT NULL) AS "longitudes",
+                       array_agg(DISTINCT lower("vavilov_passport"."crop_name")) FILTER (WHERE "vavilov_passport"."crop_name" IS NOT NULL) AS "crop_names",
+                       max("vavilov_passport"."pdci") AS "pdci",
+                       array_agg(DISTINCT "vavilov_data_source"."code") FILTER (WHERE "vavilov_data_source"."code" IS NOT NULL) AS "data_sources",
+                       array_agg(DISTINCT "vavilov_passport"."biological_status") FILTER (WHERE "vavilov_passport"."biological_status" IS NOT NULL) AS "biological_statuses",
+                       array_agg(DISTINCT "vavilov_passport"."collection_source") FILTER (WHERE "vavilov_passport"."collection_source" IS NOT NULL) AS "collection_sources",
+                       string_agg(concat_ws(E'\\n', "vavilov_passport"."accession_name",
+                                            "vavilov_passport"."collection_number"), E'\\n') AS "numbers_text",
+                       string_agg(concat_ws(E'\\n', "vavilov_passport"."state",
+                                            "vavilov_passport"."province",
+                                            "vavilov_passport"."municipality",
+                                            "vavilov_passport"."location_site"), E'\\n') AS "sites_text"
+                    FROM "vavilov_passport"
+                        LEFT JOIN "vavilov_country" ON ("vavilov_country"."country_id" = "vavilov_passport"."country_id")
+                        LEFT JOIN "vavilov_data_source" ON ("vavilov_data_source"."data_source_id" = "vavilov_passport"."data_source_id")
+                    WHERE "vavilov_passport"."accession_id" = "accession"."accession_id"
+            ) AS "passport" ON TRUE
+        
+ON CONFLICT ("accession_id") DO UPDATE
+    SET "institute_code" = EXCLUDED."institute_code",
+        "germplasm_number" = EXCLUDED."germplasm_number",
+        "group_id" = EXCLUDED."group_id",
+        "is_public" = EXCLUDED."is_public",
+        "genera" = EXCLUDED."genera",
+        "species" = EXCLUDED."species",
+        "taxa" = EXCLUDED."taxa",
+        "ranks" = EXCLUDED."ranks",
+        "countries" = EXCLUDED."countries",
+        "latitudes" = EXCLUDED."latitudes",
+        "longitudes" = EXCLUDED."longitudes",
+        "crop_names" = EXCLUDED."crop_names",
+        "pdci" = EXCLUDED."pdci",
+        "data_sources" = EXCLUDED."data_sources",
+        "biological_statuses" = EXCLUDED."biological_statuses",
+        "collection_sources" = EXCLUDED."collection_sources",
+        "taxa_text" = EXCLUDED."taxa_text",
+        "numbers_text" = EXCLUDED."numbers_text",
+        "sites_text" = EXCLUDED."sites_text"
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0008_bulktaskprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessionSummary',
+            fields=[
+                ('accession', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='vavilov3.Accession')),
+                ('institute_code', models.CharField(db_index=True, max_length=100)),
+                ('germplasm_number', models.CharField(db_index=True, max_length=100)),
+                ('is_public', models.BooleanField(db_index=True)),
+                ('genera', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('species', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('taxa', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('ranks', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), default=list, size=None)),
+                ('countries', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=3), default=list, size=None)),
+                ('latitudes', django.contrib.postgres.fields.ArrayField(base_field=models.DecimalField(decimal_places=4, max_digits=9), default=list, size=None)),
+                ('longitudes', django.contrib.postgres.fields.ArrayField(base_field=models.DecimalField(decimal_places=4, max_digits=9), default=list, size=None)),
+                ('crop_names', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=255), default=list, size=None)),
+                ('pdci', models.DecimalField(decimal_places=2, max_digits=4, null=True)),
+                ('data_sources', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=100), default=list, size=None)),
+                ('biological_statuses', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=3), default=list, size=None)),
+                ('collection_sources', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=3), default=list, size=None)),
+                ('taxa_text', models.TextField(default='')),
+                ('numbers_text', models.TextField(default='')),
+                ('sites_text', models.TextField(default='')),
+                ('group', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='vavilov3.Group')),
+            ],
+            options={
+                'db_table': 'vavilov_accession_summary',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='accessionsummary',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['taxa'], name='accsum_taxa_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='accessionsummary',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['countries'], name='accsum_countries_gin'),
+        ),
+        migrations.AddIndex(
+            model_name='accessionsummary',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['crop_names'], name='accsum_crop_names_gin'),
+        ),
+        migrations.RunSQL(REFRESH_ACCESSION_SUMMARIES,
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.11 on 2026-10-18 02:05
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+# icontains is translated by django to UPPER("column"::text) LIKE UPPER(%s),
+# so the trigram indexes are built on that same expression
+TRIGRAM_INDEXES = [
+    ('vavilov_accsum_numbers_trgm', 'vavilov_accession_summary', 'numbers_text'),
+    ('vavilov_accsum_sites_trgm', 'vavilov_accession_summary', 'sites_text'),
+    ('vavilov_accsum_taxa_trgm', 'vavilov_accession_summary', 'taxa_text'),
+    ('vavilov_accession_number_trgm', 'vavilov_accession', 'germplasm_number'),
+    ('vavilov_accessionset_number_trgm', 'vavilov_accessionset',
+     'accessionset_number'),
+    ('vavilov_institute_code_trgm', 'vavilov_institute', 'code'),
+    ('vavilov_institute_name_trgm', 'vavilov_institute', 'name'),
+]
+
+CREATE_TRIGRAM_INDEX = 'CREATE INDEX "{}" ON "{}" USING gin ((UPPER("{}"::text)) gin_trgm_ops)'
+DROP_INDEX = 'DROP INDEX IF EXISTS "{}"'
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0009_accessionsummary'),
+    ]
+
+    operations = [TrigramExtension()] + [
+        migrations.RunSQL(CREATE_TRIGRAM_INDEX.format(name, table, column),
+                          reverse_sql=DROP_INDEX.format(name))
+        for name, table, column in TRIGRAM_INDEXES]
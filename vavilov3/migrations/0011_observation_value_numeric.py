@@ -0,0 +1,22 @@
+# Generated by Django 2.2.11 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0010_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='observation',
+            name='value_numeric',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='observation',
+            index=models.Index(fields=['observation_variable', 'value_numeric'], name='vavilov_obs_value_numeric_idx'),
+        ),
+    ]
@@ -0,0 +1,221 @@
+# Generated by Django 2.2.11 on 2026-10-18 04:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# the sql of the stats refresh when the table was created, so this
+# migration does not change with the runtime sql
+REFRESH_ALL_ENTITY_STATS = [
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'institute_country', 'accession', "entity"."institute_id", "entity"."country_id", NULL,
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accession"."accession_id" AS "entity_id",
+                   "vavilov_accession"."institute_id",
+                   "vavilov_accession"."group_id",
+                   "vavilov_accession"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accession"
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."institute_id" IS NOT NULL AND "entity"."country_id" IS NOT NULL
+        GROUP BY "entity"."institute_id", "entity"."country_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'institute_taxon', 'accession', "entity"."institute_id", NULL, "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accession"."accession_id" AS "entity_id",
+                   "vavilov_accession"."institute_id",
+                   "vavilov_accession"."group_id",
+                   "vavilov_accession"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accession"
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."institute_id" IS NOT NULL AND "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."institute_id", "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'country_taxon', 'accession', NULL, "entity"."country_id", "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accession"."accession_id" AS "entity_id",
+                   "vavilov_accession"."institute_id",
+                   "vavilov_accession"."group_id",
+                   "vavilov_accession"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accession"
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."country_id" IS NOT NULL AND "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."country_id", "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'taxon', 'accession', NULL, NULL, "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accession"."accession_id" AS "entity_id",
+                   "vavilov_accession"."institute_id",
+                   "vavilov_accession"."group_id",
+                   "vavilov_accession"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accession"
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'institute_country', 'accessionset', "entity"."institute_id", "entity"."country_id", NULL,
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accessionset"."accessionset_id" AS "entity_id",
+                   "vavilov_accessionset"."institute_id",
+                   "vavilov_accessionset"."group_id",
+                   "vavilov_accessionset"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accessionset"
+                    INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."institute_id" IS NOT NULL AND "entity"."country_id" IS NOT NULL
+        GROUP BY "entity"."institute_id", "entity"."country_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'institute_taxon', 'accessionset', "entity"."institute_id", NULL, "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accessionset"."accessionset_id" AS "entity_id",
+                   "vavilov_accessionset"."institute_id",
+                   "vavilov_accessionset"."group_id",
+                   "vavilov_accessionset"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accessionset"
+                    INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."institute_id" IS NOT NULL AND "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."institute_id", "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'country_taxon', 'accessionset', NULL, "entity"."country_id", "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accessionset"."accessionset_id" AS "entity_id",
+                   "vavilov_accessionset"."institute_id",
+                   "vavilov_accessionset"."group_id",
+                   "vavilov_accessionset"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accessionset"
+                    INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."country_id" IS NOT NULL AND "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."country_id", "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''',
+    '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT 'taxon', 'accessionset', NULL, NULL, "entity"."taxon_id",
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM (
+            SELECT "vavilov_accessionset"."accessionset_id" AS "entity_id",
+                   "vavilov_accessionset"."institute_id",
+                   "vavilov_accessionset"."group_id",
+                   "vavilov_accessionset"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accessionset"
+                    INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+        ) AS "entity"
+        WHERE "entity"."taxon_id" IS NOT NULL
+        GROUP BY "entity"."taxon_id", "entity"."group_id", "entity"."is_public"
+''']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0011_observation_value_numeric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityStats',
+            fields=[
+                ('entity_stats_id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('stats_type', models.CharField(max_length=20)),
+                ('entity_type', models.CharField(max_length=20)),
+                ('is_public', models.BooleanField()),
+                ('num_entities', models.IntegerField()),
+                ('country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='vavilov3.Country')),
+                ('group', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='vavilov3.Group')),
+                ('institute', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='vavilov3.Institute')),
+                ('taxon', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='vavilov3.Taxon')),
+            ],
+            options={
+                'db_table': 'vavilov_entity_stats',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='entitystats',
+            index=models.Index(fields=['stats_type', 'institute'], name='entity_stats_institute_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entitystats',
+            index=models.Index(fields=['stats_type', 'country'], name='entity_stats_country_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='entitystats',
+            index=models.Index(fields=['stats_type', 'taxon'], name='entity_stats_taxon_idx'),
+        ),
+        migrations.RunSQL(REFRESH_ALL_ENTITY_STATS,
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.11 on 2026-10-18 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0012_entitystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('data_version_id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('version', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'vavilov_data_version',
+            },
+        ),
+    ]
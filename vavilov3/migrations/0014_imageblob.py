@@ -0,0 +1,34 @@
+# Generated by Django 2.2.11 on 2026-10-18 14:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import vavilov3.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0013_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('image_blob_id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('image', models.ImageField(max_length=1000, upload_to=vavilov3.models.get_blob_upload_path)),
+                ('image_medium', models.ImageField(blank=True, max_length=1000, null=True, upload_to=vavilov3.models.get_medium_blob_upload_path)),
+                ('image_small', models.ImageField(blank=True, max_length=1000, null=True, upload_to=vavilov3.models.get_small_blob_upload_path)),
+                ('num_references', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'vavilov_image_blob',
+            },
+        ),
+        migrations.AddField(
+            model_name='observationimage',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='vavilov3.ImageBlob'),
+        ),
+    ]
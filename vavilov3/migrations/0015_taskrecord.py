@@ -0,0 +1,42 @@
+# Generated by Django 2.2.11 on 2026-10-18 15:02
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0014_imageblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskRecord',
+            fields=[
+                ('task_record_id', models.AutoField(editable=False, primary_key=True, serialize=False)),
+                ('task_id', models.CharField(max_length=100, unique=True)),
+                ('task_name', models.CharField(max_length=255, null=True)),
+                ('status', models.CharField(default='PENDING', max_length=50)),
+                ('progress', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('result', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_started', models.DateTimeField(null=True)),
+                ('date_done', models.DateTimeField(null=True)),
+                ('user', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'vavilov_task_record',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='taskrecord',
+            index=models.Index(fields=['user', '-date_created'], name='task_record_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='taskrecord',
+            index=models.Index(fields=['-date_created'], name='task_record_created_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.11 on 2026-10-18 07:40
+
+from django.db import migrations
+from django.db.models import Max, Min
+
+BATCH_SIZE = 100000
+
+# the backfill sql when the numeric values were added, so this migration
+# does not change with the runtime sql
+BACKFILL_OBSERVATION_NUMERIC_VALUES = '''
+UPDATE "vavilov_observation"
+    SET "value_numeric" = CAST("vavilov_observation"."value" AS DOUBLE PRECISION)
+    FROM "vavilov_observation_variable"
+        INNER JOIN "vavilov_scale" ON ("vavilov_scale"."scale_id" = "vavilov_observation_variable"."scale_id")
+        INNER JOIN "vavilov_observation_data_type" ON ("vavilov_observation_data_type"."scale_data_type_id" = "vavilov_scale"."data_type_id")
+    WHERE "vavilov_observation_variable"."observation_variable_id" = "vavilov_observation"."observation_variable_id"
+        AND "vavilov_observation_data_type"."name" = 'Numerical'
+        AND "vavilov_observation"."observation_id" >= %(min_id)s
+        AND "vavilov_observation"."observation_id" < %(max_id)s
+        AND "vavilov_observation"."value_numeric" IS NULL
+        AND "vavilov_observation"."value" ~ '^\\s*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)([eE][-+]?[0-9]+)?\\s*$'
+'''
+
+
+def backfill_observation_numeric_values(apps, schema_editor):
+    # every batch is committed on its own, as the management command does,
+    # so the table is not locked during the whole backfill
+    Observation = apps.get_model('vavilov3', 'Observation')
+    ids = Observation.objects.aggregate(min_id=Min('observation_id'),
+                                        max_id=Max('observation_id'))
+    if ids['min_id'] is None:
+        return
+    connection = schema_editor.connection
+    for min_id in range(ids['min_id'], ids['max_id'] + 1, BATCH_SIZE):
+        with connection.cursor() as cursor:
+            cursor.execute(BACKFILL_OBSERVATION_NUMERIC_VALUES,
+                           {'min_id': min_id, 'max_id': min_id + BATCH_SIZE})
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('vavilov3', '0015_taskrecord'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_observation_numeric_values,
+                             reverse_code=migrations.RunPython.noop),
+    ]
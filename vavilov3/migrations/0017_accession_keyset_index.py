@@ -0,0 +1,17 @@
+# Generated by Django 2.2.11 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vavilov3', '0016_backfill_observation_value_numeric'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accession',
+            index=models.Index(fields=['germplasm_number', 'accession_id'], name='accession_keyset_idx'),
+        ),
+    ]
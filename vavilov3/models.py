@@ -17,22 +17,35 @@
 #
 
 import io
+import hashlib
+from collections import OrderedDict
 from operator import itemgetter
 from os.path import join, splitext, split
 
-from numpy import histogram
 from PIL import Image
 
-from django.db import models, connection
+from django.db import models, connection, transaction
+from django.db.models import Sum, F
+from django.db.utils import IntegrityError
+from django.core.cache import cache
 from django.contrib.auth.models import Group as DjangoGroup, AbstractUser
 from django.contrib.postgres.fields.jsonb import JSONField
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.files.base import ContentFile
 from django.conf.global_settings import MEDIA_ROOT
 
-from vavilov3.raw_stat_sql_commands import (get_institute_stats_raw_sql,
-                                            get_country_stats_raw_sql)
+from vavilov3.raw_stat_sql_commands import (INSTITUTE_COUNTRY_STATS,
+                                            INSTITUTE_TAXON_STATS,
+                                            COUNTRY_TAXON_STATS, TAXON_STATS,
+                                            INSTITUTE_PDCI_HISTOGRAMS,
+                                            PDCI_HISTOGRAM_BINS,
+                                            PDCI_HISTOGRAM_RANGE)
 from vavilov3.entities.tags import NOMINAL, ORDINAL
-from vavilov3.conf.settings import PHENO_IMAGE_DIR
+from vavilov3.conf.settings import (PHENO_IMAGE_DIR, STATS_CACHE_TIMEOUT,
+                                    IMAGE_BLOB_DIR)
+from vavilov3.permissions import get_permission_context
+from vavilov3.media_journal import record_written_file
 
 
 class User(AbstractUser):
@@ -51,6 +64,78 @@ class UserTasks(models.Model):
         db_table = 'vavilov_user_task'
 
 
+class TaskRecord(models.Model):
+    task_record_id = models.AutoField(primary_key=True, editable=False)
+    task_id = models.CharField(max_length=100, unique=True)
+    task_name = models.CharField(max_length=255, null=True)
+    user = models.ForeignKey(User, null=True, on_delete=models.CASCADE)
+    status = models.CharField(max_length=50, default='PENDING')
+    progress = JSONField(null=True)
+    result = JSONField(null=True)
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_started = models.DateTimeField(null=True)
+    date_done = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = 'vavilov_task_record'
+        indexes = [models.Index(fields=['user', '-date_created'],
+                                name='task_record_user_idx'),
+                   models.Index(fields=['-date_created'],
+                                name='task_record_created_idx')]
+
+
+class BulkTaskProgress(models.Model):
+    bulk_task_progress_id = models.AutoField(primary_key=True, editable=False)
+    task_id = models.CharField(max_length=100, unique=True)
+    committed_chunks = models.IntegerField(default=0)
+    num_items = models.IntegerField(default=0)
+    errors = JSONField(default=list)
+
+    class Meta:
+        db_table = 'vavilov_bulk_task_progress'
+
+
+# the exports are cached until the data they have changes
+ACCESSION_DATA = 'accession'
+ACCESSIONSET_DATA = 'accessionset'
+OBSERVATION_DATA = 'observation'
+# the observation variable registries of all the processes reload the
+# variables when this version changes
+OBSERVATION_VARIABLE_DATA = 'observation_variable'
+
+
+class DataVersion(models.Model):
+    data_version_id = models.AutoField(primary_key=True, editable=False)
+    name = models.CharField(max_length=100, unique=True)
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'vavilov_data_version'
+
+
+def get_data_versions(names):
+    versions = dict(DataVersion.objects.filter(name__in=names).values_list(
+        'name', 'version'))
+    return [versions.get(name, 0) for name in names]
+
+
+def _bump_data_versions(names):
+    for name in names:
+        if DataVersion.objects.filter(name=name).update(version=F('version') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                DataVersion.objects.create(name=name, version=1)
+        except IntegrityError:
+            DataVersion.objects.filter(name=name).update(version=F('version') + 1)
+
+
+def bump_data_versions(*names):
+    # after the commit, so the versions are not locked during the loads and
+    # an export can not see the new version with the old data
+    transaction.on_commit(lambda: _bump_data_versions(names))
+
+
 class Group(DjangoGroup):
 
     class Meta:
@@ -83,116 +168,197 @@ class Institute(models.Model):
 
     def stats_by_country(self, user=None):
         stats = {}
-        accession_stats = Country.objects.raw(
-            get_institute_stats_raw_sql(institute_id=self.institute_id,
-                                        stats_type='country',
-                                        entity_type='accession',
-                                        user=user))
-
-        accessionset_stats = Country.objects.raw(
-            get_institute_stats_raw_sql(institute_id=self.institute_id,
-                                        stats_type='country',
-                                        entity_type='accessionset',
-                                        user=user))
-
-        for row in accession_stats:
-            _integrate_country_stats(stats, row, 'accession')
-        for row in accessionset_stats:
-            _integrate_country_stats(stats, row, 'accessionset')
+        rows = get_entity_stats(INSTITUTE_COUNTRY_STATS,
+                                ('country__code', 'country__name'),
+                                user, institute_id=self.institute_id)
+        for row in rows:
+            _integrate_country_stats(stats, row)
         return sorted(stats.values(), key=itemgetter('num_accessions'),
                       reverse=True)
 
     def stats_by_taxa(self, user=None):
         stats = {}
-        accession_stats = Taxon.objects.raw(
-            get_institute_stats_raw_sql(institute_id=self.institute_id,
-                                        stats_type='taxa',
-                                        entity_type='accession',
-                                        user=user))
-        accessionset_stats = Taxon.objects.raw(
-            get_institute_stats_raw_sql(institute_id=self.institute_id,
-                                        stats_type='taxa',
-                                        entity_type='accessionset',
-                                        user=user))
-        for row in accession_stats:
-            _integrate_taxa_stats(stats, row, 'accession')
-        for row in accessionset_stats:
-            _integrate_taxa_stats(stats, row, 'accessionset')
+        rows = get_entity_stats(INSTITUTE_TAXON_STATS,
+                                ('taxon__name', 'taxon__rank__name'),
+                                user, institute_id=self.institute_id)
+        for row in rows:
+            _integrate_taxa_stats(stats, row)
         return stats
 
     @property
     def pdcis(self):
-        pdcis = [float(p['pdci']) for p in Passport.objects.filter(institute=self).values('pdci')]
-        return pdci_distrib(pdcis)
-
-
-def pdci_distrib(pdcis):
-        range_ = {}
-        for i in range(10):
-            range_[(i, i + 0.5)] = []
-            range_[(i + 0.5, i + 1)] = []
-
-        hist, bin_edges = histogram(pdcis, bins=20, range=(0, 10))
-        return zip(bin_edges, hist)
-
-
-def _integrate_country_stats(stats, query_stats, entity_type):
-    counts = query_stats.counts
-    code = query_stats.code
-    name = query_stats.name
-
-    if counts:
+        return get_institutes_pdcis([self.institute_id])[self.institute_id]
+
+
+def _get_pdcis_data_version_name(institute_id):
+    return 'institute_pdcis_{}'.format(institute_id)
+
+
+def _get_pdcis_cache_keys(institute_ids):
+    # the data versions are shared by all the processes, so a change made
+    # by a celery worker is seen by the web servers without a shared cache
+    institute_ids = list(institute_ids)
+    versions = get_data_versions([_get_pdcis_data_version_name(institute_id)
+                                  for institute_id in institute_ids])
+    return {'vavilov3_institute_pdcis_{}_{}'.format(institute_id, version): institute_id
+            for institute_id, version in zip(institute_ids, versions)}
+
+
+def _calc_institutes_pdcis(institute_ids):
+    min_pdci, max_pdci = PDCI_HISTOGRAM_RANGE
+    bin_width = (max_pdci - min_pdci) / PDCI_HISTOGRAM_BINS
+    bin_edges = [min_pdci + bin_width * index
+                 for index in range(PDCI_HISTOGRAM_BINS)]
+    counts = {institute_id: [0] * PDCI_HISTOGRAM_BINS
+              for institute_id in institute_ids}
+    with connection.cursor() as cursor:
+        cursor.execute(INSTITUTE_PDCI_HISTOGRAMS,
+                       {'institute_ids': list(institute_ids),
+                        'min_pdci': min_pdci, 'max_pdci': max_pdci,
+                        'bins': PDCI_HISTOGRAM_BINS})
+        for institute_id, bucket, count in cursor.fetchall():
+            counts[institute_id][bucket - 1] = count
+    return {institute_id: list(zip(bin_edges, institute_counts))
+            for institute_id, institute_counts in counts.items()}
+
+
+def get_institutes_pdcis(institute_ids):
+    '''It returns the pdci histogram of the passports of every institute.
+
+    The histograms are cached by institute, the ones not cached are
+    calculated together in one query'''
+    institute_ids = set(institute_ids)
+    keys = _get_pdcis_cache_keys(institute_ids)
+    pdcis = {keys[key]: pdci for key, pdci in cache.get_many(keys).items()}
+    not_cached = institute_ids.difference(pdcis)
+    if not_cached:
+        calculated = _calc_institutes_pdcis(not_cached)
+        cache.set_many({key: calculated[institute_id]
+                        for key, institute_id in keys.items()
+                        if institute_id in calculated},
+                       STATS_CACHE_TIMEOUT)
+        pdcis.update(calculated)
+    return pdcis
+
+
+def invalidate_institute_pdcis(institute_ids=None):
+    if institute_ids is None:
+        institute_ids = Institute.objects.values_list('institute_id', flat=True)
+    institute_ids = set(institute_ids)
+    if not institute_ids:
+        return
+    # this process does not use the cached histograms from now, the other
+    # ones once the new versions are committed
+    cache.delete_many(list(_get_pdcis_cache_keys(institute_ids)))
+    bump_data_versions(*[_get_pdcis_data_version_name(institute_id)
+                         for institute_id in institute_ids])
+
+
+ENTITY_STATS_GENERATION_CACHE_KEY = 'vavilov3_entity_stats_generation'
+# the entity stats cached by all the processes are outdated when this data
+# version changes
+ENTITY_STATS_DATA = 'entity_stats'
+# the stats variants: all the entities, the public ones or the private
+# ones of a group
+ALL_ENTITIES_STATS = 'all'
+PUBLIC_ENTITIES_STATS = 'public'
+
+
+def invalidate_entity_stats_cache():
+    # the generation of this process changes now, the version shared by all
+    # the processes once the refreshed stats are committed
+    try:
+        cache.incr(ENTITY_STATS_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(ENTITY_STATS_GENERATION_CACHE_KEY, 1, None)
+    bump_data_versions(ENTITY_STATS_DATA)
+
+
+def _get_entity_stats_variant(stats_type, fields, variant, filters, version):
+    generation = cache.get(ENTITY_STATS_GENERATION_CACHE_KEY, 0)
+    key = repr((stats_type, fields, variant, sorted(filters.items())))
+    key = 'vavilov3_entity_stats_{}_{}_{}'.format(
+        version, generation, hashlib.md5(key.encode()).hexdigest())
+    rows = cache.get(key)
+    if rows is not None:
+        return rows
+
+    queryset = EntityStats.objects.filter(stats_type=stats_type, **filters)
+    if variant == PUBLIC_ENTITIES_STATS:
+        queryset = queryset.filter(is_public=True)
+    elif variant != ALL_ENTITIES_STATS:
+        queryset = queryset.filter(is_public=False, group_id=variant)
+    queryset = queryset.values('entity_type', *fields)
+    rows = list(queryset.annotate(counts=Sum('num_entities')).order_by())
+    cache.set(key, rows, STATS_CACHE_TIMEOUT)
+    return rows
+
+
+def get_entity_stats(stats_type, fields, user=None, **filters):
+    '''It adds up the precomputed stats of the given type by entity type and
+    the given fields, counting only the entities that the user can see.
+
+    Every entity is public or private of one group, so the user stats are
+    the public stats plus the private stats of every user group. These
+    variants are computed when they are first asked and cached, the
+    anonymous users only use the public one'''
+    context = get_permission_context(user)
+    if context.is_admin:
+        variants = [ALL_ENTITIES_STATS]
+    else:
+        variants = [PUBLIC_ENTITIES_STATS] + sorted(context.group_ids)
+
+    fields = ('entity_type',) + tuple(fields)
+    version = get_data_versions([ENTITY_STATS_DATA])[0]
+    counts = OrderedDict()
+    for variant in variants:
+        for row in _get_entity_stats_variant(stats_type, fields[1:], variant,
+                                             filters, version):
+            key = tuple(row[field] for field in fields)
+            counts[key] = counts.get(key, 0) + row['counts']
+    return [dict(zip(fields, key), counts=count)
+            for key, count in counts.items()]
+
+
+def _integrate_country_stats(stats, row):
+    code = row['country__code']
+    if row['counts']:
         if code not in stats:
-            stats[code] = {'code': code, 'name': name,
+            stats[code] = {'code': code, 'name': row['country__name'],
                            'num_accessions': 0, 'num_accessionsets': 0}
 
-        stats[code]['num_{}s'.format(entity_type)] = counts
+        stats[code]['num_{}s'.format(row['entity_type'])] = row['counts']
 
 
-def _integrate_institute_stats(stats, query_stats, entity_type):
-    try:
-        counts = query_stats.counts
-    except AttributeError:
-        counts = query_stats['counts']
-    try:
-        code = query_stats.instituteCode
-    except AttributeError:
-        code = query_stats['instituteCode']
-
-    try:
-        name = query_stats.name
-    except AttributeError:
-        name = query_stats['name']
-
-    if counts:
+def _integrate_institute_stats(stats, row):
+    code = row['institute__code']
+    if row['counts']:
         if code not in stats:
-            stats[code] = {'instituteCode': code, 'name': name,
+            stats[code] = {'instituteCode': code, 'name': row['institute__name'],
                            'num_accessions': 0, 'num_accessionsets': 0}
 
-        stats[code]['num_{}s'.format(entity_type)] = counts
-
+        stats[code]['num_{}s'.format(row['entity_type'])] = row['counts']
 
-def _integrate_taxa_stats(stats, query_stats, entity_type):
-    try:
-        counts = query_stats['counts']
-    except (AttributeError, TypeError):
-        counts = query_stats.counts
-    try:
-        rank = query_stats['rank__name']
-    except TypeError:
-        rank = query_stats.rank.name
-    try:
-        taxon = query_stats['name']
-    except TypeError:
-        taxon = query_stats.taxon_name
 
-    if counts:
+def _integrate_taxa_stats(stats, row):
+    rank = row['taxon__rank__name']
+    taxon = row['taxon__name']
+    if row['counts']:
         if rank not in stats:
             stats[rank] = {}
         if taxon not in stats[rank]:
             stats[rank][taxon] = {'num_accessions': 0,
                                   'num_accessionsets': 0}
-        stats[rank][taxon]['num_{}s'.format(entity_type)] = counts
+        stats[rank][taxon]['num_{}s'.format(row['entity_type'])] = row['counts']
+
+
+def get_taxa_stats(user=None):
+    stats = {}
+    rows = get_entity_stats(TAXON_STATS, ('taxon__name', 'taxon__rank__name'),
+                            user)
+    for row in rows:
+        _integrate_taxa_stats(stats, row)
+    return stats
 
 
 class Country(models.Model):
@@ -218,57 +384,21 @@ class Country(models.Model):
 
     def stats_by_institute(self, user=None):
         stats = {}
-
-        with connection.cursor() as cursor:
-            cursor.execute(get_country_stats_raw_sql(country_id=self.country_id,
-                                                     stats_type='institute',
-                                                     entity_type='accession',
-                                                     user=user))
-            accession_stats = cursor.fetchall()
-
-        with connection.cursor() as cursor:
-            cursor.execute(get_country_stats_raw_sql(country_id=self.country_id,
-                                                     stats_type='institute',
-                                                     entity_type='accessionset',
-                                                     user=user))
-            accessionset_stats = cursor.fetchall()
-#         accession_stats = Country.objects.raw(
-#             get_country_stats_raw_sql(country_id=self.country_id,
-#                                       stats_type='institute',
-#                                       entity_type='accession',
-#                                       user=user))
-
-#         accessionset_stats = Country.objects.raw(
-#             get_country_stats_raw_sql(country_id=self.country_id,
-#                                       stats_type='institute',
-#                                       entity_type='accessionset',
-#                                       user=user))
-#         print(accession_stats.columns)
-        for row in accession_stats:
-            row = {'instituteCode': row[1], 'name': row[2], 'counts': row[3]}
-            _integrate_institute_stats(stats, row, 'accession')
-        for row in accessionset_stats:
-            row = {'instituteCode': row[1], 'name': row[2], 'counts': row[3]}
-            _integrate_institute_stats(stats, row, 'accessionset')
+        rows = get_entity_stats(INSTITUTE_COUNTRY_STATS,
+                                ('institute__code', 'institute__name'),
+                                user, country_id=self.country_id)
+        for row in rows:
+            _integrate_institute_stats(stats, row)
         return sorted(stats.values(), key=itemgetter('num_accessions'),
                       reverse=True)
 
     def stats_by_taxa(self, user=None):
         stats = {}
-        accession_stats = Taxon.objects.raw(
-            get_country_stats_raw_sql(country_id=self.country_id,
-                                      stats_type='taxa',
-                                      entity_type='accession',
-                                      user=user))
-        accessionset_stats = Taxon.objects.raw(
-            get_country_stats_raw_sql(country_id=self.country_id,
-                                      stats_type='taxa',
-                                      entity_type='accessionset',
-                                      user=user))
-        for row in accession_stats:
-            _integrate_taxa_stats(stats, row, 'accession')
-        for row in accessionset_stats:
-            _integrate_taxa_stats(stats, row, 'accessionset')
+        rows = get_entity_stats(COUNTRY_TAXON_STATS,
+                                ('taxon__name', 'taxon__rank__name'),
+                                user, country_id=self.country_id)
+        for row in rows:
+            _integrate_taxa_stats(stats, row)
         return stats
 
 
@@ -302,6 +432,9 @@ class Accession(models.Model):
     class Meta:
         unique_together = ('institute', 'germplasm_number')
         db_table = 'vavilov_accession'
+        # the accessions are paginated by keyset in this order
+        indexes = [models.Index(fields=['germplasm_number', 'accession_id'],
+                                name='accession_keyset_idx')]
 
     @property
     def genera(self):
@@ -430,6 +563,72 @@ class Passport(models.Model):
         db_table = 'vavilov_passport'
         unique_together = ('institute', 'germplasm_number', 'data_source')
 
+
+class AccessionSummary(models.Model):
+    # One row per accession with the passport derived data already
+    # aggregated. It is kept up to date by the accession create, update and
+    # toggle public operations, the arrays used to filter are lower cased
+    accession = models.OneToOneField(Accession, primary_key=True,
+                                     on_delete=models.CASCADE,
+                                     related_name='summary')
+    institute_code = models.CharField(max_length=100, db_index=True)
+    germplasm_number = models.CharField(max_length=100, db_index=True)
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL, null=True)
+    is_public = models.BooleanField(db_index=True)
+    genera = ArrayField(models.CharField(max_length=255), default=list)
+    species = ArrayField(models.CharField(max_length=255), default=list)
+    taxa = ArrayField(models.CharField(max_length=255), default=list)
+    ranks = ArrayField(models.CharField(max_length=100), default=list)
+    countries = ArrayField(models.CharField(max_length=3), default=list)
+    latitudes = ArrayField(models.DecimalField(max_digits=9,
+                                               decimal_places=4),
+                           default=list)
+    longitudes = ArrayField(models.DecimalField(max_digits=9,
+                                                decimal_places=4),
+                            default=list)
+    crop_names = ArrayField(models.CharField(max_length=255), default=list)
+    pdci = models.DecimalField(max_digits=4, decimal_places=2, null=True)
+    data_sources = ArrayField(models.CharField(max_length=100), default=list)
+    biological_statuses = ArrayField(models.CharField(max_length=3),
+                                     default=list)
+    collection_sources = ArrayField(models.CharField(max_length=3),
+                                    default=list)
+    taxa_text = models.TextField(default='')
+    numbers_text = models.TextField(default='')
+    sites_text = models.TextField(default='')
+
+    class Meta:
+        db_table = 'vavilov_accession_summary'
+        indexes = [GinIndex(fields=['taxa'], name='accsum_taxa_gin'),
+                   GinIndex(fields=['countries'], name='accsum_countries_gin'),
+                   GinIndex(fields=['crop_names'],
+                            name='accsum_crop_names_gin')]
+
+
+class EntityStats(models.Model):
+    '''Precomputed number of accessions or accessionsets of every stats type
+    (institute by country, institute by taxon, country by taxon and taxon),
+    split by the entity permissions'''
+    entity_stats_id = models.AutoField(primary_key=True, editable=False)
+    stats_type = models.CharField(max_length=20)
+    entity_type = models.CharField(max_length=20)
+    institute = models.ForeignKey(Institute, on_delete=models.CASCADE,
+                                  null=True)
+    country = models.ForeignKey(Country, on_delete=models.CASCADE, null=True)
+    taxon = models.ForeignKey(Taxon, on_delete=models.CASCADE, null=True)
+    group = models.ForeignKey(Group, on_delete=models.SET_NULL, null=True)
+    is_public = models.BooleanField()
+    num_entities = models.IntegerField()
+
+    class Meta:
+        db_table = 'vavilov_entity_stats'
+        indexes = [models.Index(fields=['stats_type', 'institute'],
+                                name='entity_stats_institute_idx'),
+                   models.Index(fields=['stats_type', 'country'],
+                                name='entity_stats_country_idx'),
+                   models.Index(fields=['stats_type', 'taxon'],
+                                name='entity_stats_taxon_idx')]
+
 #  Phenotyping #
 
 
@@ -566,19 +765,26 @@ class Observation(models.Model):
     value = models.CharField(max_length=255)
     observer = models.CharField(max_length=255, null=True)
     creation_time = models.DateTimeField(null=True)
+    # the value of the numerical variables, to filter them by range
+    value_numeric = models.FloatField(null=True)
 
     class Meta:
         db_table = 'vavilov_observation'
         unique_together = ('observation_variable', 'observation_unit', 'value',
                            'observer', 'creation_time')
+        indexes = [models.Index(fields=['observation_variable', 'value_numeric'],
+                                name='vavilov_obs_value_numeric_idx')]
 
     @property
     def beauty_value(self):
-        if self.observation_variable.scale.data_type.name in (NOMINAL, ORDINAL):
-            cat = ScaleCategory.objects.get(scale=self.observation_variable.scale,
-                                            value=self.value)
-
-            return '{} ({})'.format(self.value, cat.description)
+        scale = self.observation_variable.scale
+        if scale.data_type.name in (NOMINAL, ORDINAL):
+            # the categories could be already prefetched by the list views
+            for cat in scale.scalecategory_set.all():
+                if cat.value == self.value:
+                    return '{} ({})'.format(self.value, cat.description)
+            raise ScaleCategory.DoesNotExist('{} is not a category of {}'.format(
+                self.value, scale.name))
         return self.value
 
 
@@ -594,6 +800,12 @@ def _get_upload_path(instance, filename, prefix=None):
     return join(MEDIA_ROOT, PHENO_IMAGE_DIR, accession, study, filename)
 
 
+# the renditions from the biggest to the smallest, each one is made from the
+# previous one
+THUMBNAIL_SIZES = (('medium', (600, 400)), ('small', (128, 128)))
+THUMBNAIL_FORMATS = {'JPEG': 'jpg', 'PNG': 'png'}
+
+
 def get_image_upload_path(instance, filename):
     return _get_upload_path(instance, filename)
 
@@ -606,6 +818,135 @@ def get_medium_image_upload_path(instance, filename):
     return _get_upload_path(instance, filename, 'medium')
 
 
+def create_image_thumbnails(instance):
+    '''It creates the missing renditions of the image of an instance with
+    image, image_medium and image_small fields.
+
+    The image is decoded once, JPEGs already downscaled by the decoder,
+    and the small rendition is made from the medium one. The renditions
+    that already exist are kept, so it can be retried'''
+    missing = [(kind, size) for kind, size in THUMBNAIL_SIZES
+               if not getattr(instance, 'image_{}'.format(kind))]
+    if not instance.image or not missing:
+        return []
+
+    instance.image.open('rb')
+    try:
+        image = Image.open(instance.image)
+        pil_format = image.format
+        if pil_format not in THUMBNAIL_FORMATS:
+            pil_format = 'PNG'
+        if pil_format == 'JPEG':
+            image.draft('RGB', THUMBNAIL_SIZES[0][1])
+        image.load()
+    finally:
+        instance.image.close()
+
+    created_fields = []
+    for kind, size in THUMBNAIL_SIZES:
+        image.thumbnail(size, Image.LANCZOS)
+        if (kind, size) not in missing:
+            continue
+        temp_handle = io.BytesIO()
+        image.save(temp_handle, pil_format)
+        field_name = 'image_{}'.format(kind)
+        fname = '{}_{}.{}'.format(splitext(split(instance.image.name)[-1])[0],
+                                  kind, THUMBNAIL_FORMATS[pil_format])
+        # the file of a failed previous try would get a new name
+        fpath = instance._meta.get_field(field_name).generate_filename(
+            instance, fname)
+        field_file = getattr(instance, field_name)
+        field_file.storage.delete(fpath)
+        field_file.save(fname, ContentFile(temp_handle.getvalue()),
+                        save=False)
+        record_written_file(field_file.name)
+        created_fields.append(field_name)
+    instance.save(update_fields=created_fields)
+    return created_fields
+
+
+def _get_blob_upload_path(instance, filename, prefix=None):
+    # content addressed, the path only depends on the image digest
+    suffix = splitext(filename)[1].lower()
+    filename = '{}_'.format(prefix) if prefix else ''
+    filename += '{}{}'.format(instance.digest, suffix)
+    return join(MEDIA_ROOT, PHENO_IMAGE_DIR, IMAGE_BLOB_DIR,
+                instance.digest[:2], filename)
+
+
+def get_blob_upload_path(instance, filename):
+    return _get_blob_upload_path(instance, filename)
+
+
+def get_small_blob_upload_path(instance, filename):
+    return _get_blob_upload_path(instance, filename, 'small')
+
+
+def get_medium_blob_upload_path(instance, filename):
+    return _get_blob_upload_path(instance, filename, 'medium')
+
+
+class ImageBlob(models.Model):
+    image_blob_id = models.AutoField(primary_key=True, editable=False)
+    digest = models.CharField(max_length=64, unique=True)
+    image = models.ImageField(upload_to=get_blob_upload_path, max_length=1000)
+    image_medium = models.ImageField(upload_to=get_medium_blob_upload_path,
+                                     null=True, blank=True, max_length=1000)
+    image_small = models.ImageField(upload_to=get_small_blob_upload_path,
+                                    null=True, blank=True, max_length=1000)
+    num_references = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'vavilov_image_blob'
+
+    def create_thumbnails(self):
+        return create_image_thumbnails(self)
+
+    def delete_files(self):
+        for field_name in ('image', 'image_medium', 'image_small'):
+            field_file = getattr(self, field_name)
+            if field_file:
+                field_file.storage.delete(field_file.name)
+
+
+def acquire_image_blob(digest, image):
+    '''It returns the blob of the image content with one more reference.
+
+    The content is only written if no other image has it. It has to be
+    called inside a transaction'''
+    blob = ImageBlob.objects.select_for_update().filter(digest=digest).first()
+    if blob is None:
+        blob = ImageBlob(digest=digest)
+        blob.image.save(image.name, image, save=False)
+        record_written_file(blob.image.name)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # other upload has stored the same content meanwhile
+            blob.image.storage.delete(blob.image.name)
+            blob = ImageBlob.objects.select_for_update().get(digest=digest)
+    blob.num_references += 1
+    blob.save(update_fields=['num_references'])
+    return blob
+
+
+def release_image_blob(image_blob_id):
+    '''It removes a reference of the blob. The blob is removed with its last
+    reference and its files once that is committed'''
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(
+            pk=image_blob_id).first()
+        if blob is None:
+            return
+        blob.num_references -= 1
+        if blob.num_references > 0:
+            blob.save(update_fields=['num_references'])
+            return
+        blob.delete()
+    transaction.on_commit(blob.delete_files)
+
+
 class ObservationImage(models.Model):
     observation_image_id = models.AutoField(primary_key=True, editable=False)
     observation_image_uid = models.TextField(unique=True)
@@ -618,56 +959,29 @@ class ObservationImage(models.Model):
                                     null=True, blank=True, max_length=1000)
     observer = models.CharField(max_length=255, null=True)
     creation_time = models.DateTimeField(null=True)
+    # the files of the images stored by content are the ones of its blob
+    blob = models.ForeignKey(ImageBlob, null=True, blank=True,
+                             on_delete=models.PROTECT)
 
     class Meta:
         db_table = 'vavilov_observation_images'
 
-    def _create_thumbnail(self, size=(128, 128), kind='small'):
-        """
-        Create a thumbnail from a saved image
-        Adapted from this gist: https://gist.github.com/valberg/2429288
-        """
-
-        if not self.image:
-            return
-
-        im = Image.open(self.image)
-        pil_format = im.format
-
-        if pil_format == 'JPEG':
-            pil_type = 'jpeg'
-            extension = 'jpg'
-            django_type = 'image/jpg'
-
-        if pil_format == 'PNG':
-            pil_type = 'png'
-            extension = 'png'
-            django_type = 'image/png'
-
-        try:
-            self.image.seek(0)
-            image = Image.open(io.BytesIO(self.image.read()))
-            image.thumbnail(size, Image.ANTIALIAS)
-            temp_handle = io.BytesIO()
-            image.save(temp_handle, pil_type)
-            temp_handle.seek(0)
-
-            suf = SimpleUploadedFile(split(self.image.name)[-1],
-                                     temp_handle.read(), content_type=django_type)
-            field = self.image_small if kind == 'small' else self.image_medium
-            field.save(
-                '{}_{}.{}'.format(splitext(suf.name)[0], kind, extension),
-                suf,
-                save=False)
-        except IOError as error:
-            print("Cannot create {} for {}: {}".format(kind, self.image.name,
-                                                       error))
-
-    def save(self, *args, **kwargs):
-        self._create_thumbnail(kind='small')
-        self._create_thumbnail((600, 400), kind='medium')
-
-        super(ObservationImage, self).save(*args, **kwargs)
+    def create_thumbnails(self):
+        '''It creates the missing renditions of the image.
+
+        The images stored in a blob use the renditions of the blob'''
+        if self.blob_id is None:
+            return create_image_thumbnails(self)
+        self.blob.create_thumbnails()
+        updated_fields = []
+        for field_name in ('image_medium', 'image_small'):
+            blob_file = getattr(self.blob, field_name)
+            if blob_file and getattr(self, field_name).name != blob_file.name:
+                setattr(self, field_name, blob_file.name)
+                updated_fields.append(field_name)
+        if updated_fields:
+            self.save(update_fields=updated_fields)
+        return updated_fields
 
     @property
     def accession(self):
@@ -0,0 +1,155 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.db.models import Avg, Q
+
+# pyarrow is optional, only the columnar exports need it
+try:
+    import pyarrow
+    from pyarrow import ipc, parquet
+except ImportError:
+    pyarrow = None
+
+from vavilov3.models import Observation
+from vavilov3.entities.tags import NUMERICAL
+from vavilov3.staging import chunks
+from vavilov3.conf.settings import OBSERVATION_MATRIX_BATCH_SIZE
+
+PARQUET_FORMAT = 'parquet'
+ARROW_FORMAT = 'arrow'
+MATRIX_FORMATS = (PARQUET_FORMAT, ARROW_FORMAT)
+MATRIX_CONTENT_TYPES = {PARQUET_FORMAT: 'application/vnd.apache.parquet',
+                        ARROW_FORMAT: 'application/vnd.apache.arrow.stream'}
+MATRIX_SUFFIXES = {PARQUET_FORMAT: '.parquet', ARROW_FORMAT: '.arrows'}
+
+# the non numeric variables with several values in an observation unit
+VALUES_DELIMITER = ';'
+
+UNIT_COLUMNS = (('observation_unit', 'observation_unit__name'),
+                ('study', 'observation_unit__study__name'),
+                ('institute_code',
+                 'observation_unit__accession__institute__code'),
+                ('germplasm_number',
+                 'observation_unit__accession__germplasm_number'))
+
+
+def is_columnar_export_available():
+    return pyarrow is not None
+
+
+def get_matrix_variables(observations):
+    variables = observations.order_by().values_list(
+        'observation_variable_id', 'observation_variable__name',
+        'observation_variable__scale__data_type__name').distinct()
+    return sorted(variables, key=lambda variable: variable[1])
+
+
+def get_matrix_column_names(variables):
+    '''It returns the names of the matrix columns, the variables named as
+    an observation unit column are renamed with a prefix'''
+    column_names = [name for name, _ in UNIT_COLUMNS]
+    unit_names = set(column_names)
+    used_names = unit_names.union(name for _, name, _ in variables)
+    for _, name, _ in variables:
+        if name in unit_names:
+            while name in used_names:
+                name = 'variable_' + name
+            used_names.add(name)
+        column_names.append(name)
+    return column_names
+
+
+def get_observation_matrix_queryset(observations, variables):
+    '''It pivots the observations in the database, one row by observation
+    unit and one column by variable.
+
+    The numeric variables have the mean of the unit values and the other
+    variables their distinct values joined'''
+    queryset = Observation.objects.filter(pk__in=observations.values('pk'))
+    aggregates = {}
+    for index, (variable_id, _, data_type) in enumerate(variables):
+        filter_ = Q(observation_variable_id=variable_id)
+        if data_type == NUMERICAL:
+            aggregate = Avg('value_numeric', filter=filter_)
+        else:
+            aggregate = StringAgg('value', VALUES_DELIMITER, distinct=True,
+                                  filter=filter_)
+        aggregates['variable_{}'.format(index)] = aggregate
+    fields = [field for _, field in UNIT_COLUMNS]
+    queryset = queryset.values('observation_unit_id', *fields)
+    return queryset.annotate(**aggregates).order_by('observation_unit_id')
+
+
+class _StreamSink:
+    # pyarrow writes here and we give the written bytes to the response
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_observation_matrix(observations, matrix_format=PARQUET_FORMAT,
+                            batch_size=OBSERVATION_MATRIX_BATCH_SIZE):
+    variables = get_matrix_variables(observations)
+    types = [pyarrow.string()] * len(UNIT_COLUMNS)
+    for _, _, data_type in variables:
+        types.append(pyarrow.float64() if data_type == NUMERICAL else pyarrow.string())
+    schema = pyarrow.schema(zip(get_matrix_column_names(variables), types))
+    keys = [field for _, field in UNIT_COLUMNS]
+    keys.extend('variable_{}'.format(index) for index in range(len(variables)))
+
+    sink = _StreamSink()
+    if matrix_format == PARQUET_FORMAT:
+        writer = parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'),
+                                       schema)
+    else:
+        writer = ipc.new_stream(pyarrow.PythonFile(sink, mode='w'), schema)
+
+    queryset = get_observation_matrix_queryset(observations, variables)
+    for rows in chunks(queryset.iterator(chunk_size=batch_size), batch_size):
+        arrays = [pyarrow.array([row[key] for row in rows], type=field.type)
+                  for key, field in zip(keys, schema)]
+        batch = pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+        if matrix_format == PARQUET_FORMAT:
+            writer.write_table(pyarrow.Table.from_batches([batch]))
+        else:
+            writer.write_batch(batch)
+        yield sink.pop()
+    writer.close()
+    yield sink.pop()
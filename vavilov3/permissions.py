@@ -26,14 +26,60 @@ from vavilov3.conf import settings
 import requests
 
 
+PERMISSION_CONTEXT_ATTR = '_vavilov_permission_context'
+
+
+class PermissionContext():
+    '''The groups and admin flag of a user.
+
+    It is resolved once and cached in the user instance, that lives for one
+    request or task, so the permission checks done for every object or row
+    do not query the user groups again.
+    '''
+
+    def __init__(self, user):
+        if user is None or isinstance(user, AnonymousUser):
+            self.groups = []
+            self.is_admin = False
+        else:
+            self.groups = list(user.groups.order_by('pk'))
+            group_names = [group.name for group in self.groups]
+            self.is_admin = bool(user.is_staff or
+                                 settings.ADMIN_GROUP in group_names)
+        self.group_ids = frozenset(group.id for group in self.groups)
+        self.group_names = frozenset(group.name for group in self.groups)
+
+    @property
+    def first_group(self):
+        return self.groups[0] if self.groups else None
+
+    def belongs_to(self, group):
+        # group can be given as a group instance or by its name
+        if group is None:
+            return False
+        name = group if isinstance(group, str) else group.name
+        return name in self.group_names
+
+
+def get_permission_context(user):
+    if user is None:
+        return PermissionContext(user)
+    context = getattr(user, PERMISSION_CONTEXT_ATTR, None)
+    if not isinstance(context, PermissionContext):
+        context = PermissionContext(user)
+        setattr(user, PERMISSION_CONTEXT_ATTR, context)
+    return context
+
+
+def clear_permission_context(user):
+    if isinstance(getattr(user, PERMISSION_CONTEXT_ATTR, None),
+                  PermissionContext):
+        delattr(user, PERMISSION_CONTEXT_ATTR)
+
+
 def is_user_admin(user):
-    if isinstance(user, AnonymousUser):
-        return False
-    if user and user.is_staff:
-        return True
-    if settings.ADMIN_GROUP in user.groups.all().values_list('name', flat=True):
-        return True
-    return False
+    return get_permission_context(user).is_admin
+
 
 class IsUserAdminGroup(permissions.BasePermission):
     """
@@ -87,7 +133,7 @@ class UserGroupObjectPublicPermission(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         is_public = obj.is_public
         action = view.action
-        user_is_owner = bool(request.user.groups.filter(name=obj.group).count())
+        user_is_owner = get_permission_context(request.user).belongs_to(obj.group)
         if action in ['retrieve']:
             if (obj.is_public or is_user_admin(request.user) or
                     user_is_owner):
@@ -138,7 +184,7 @@ class ByStudyPermission(permissions.BasePermission):
         is_public = study.is_public
         group = study.group
         action = view.action
-        user_is_owner = bool(request.user.groups.filter(name=group.name).count())
+        user_is_owner = get_permission_context(request.user).belongs_to(group)
         if action in ['retrieve']:
             if (is_public or is_user_admin(request.user) or
                     user_is_owner):
@@ -171,7 +217,7 @@ class UserGroupObjectPermission(UserGroupObjectPublicPermission):
 
     def has_object_permission(self, request, view, obj):
         action = view.action
-        user_is_owner = bool(request.user.groups.filter(name=obj.group).count())
+        user_is_owner = get_permission_context(request.user).belongs_to(obj.group)
         if action in ['retrieve']:
             return True
         # partial updates only change metadata and it only can be changed by
@@ -201,13 +247,10 @@ def filter_queryset_by_user_group_public_permissions(queryset, user):
     elif is_user_admin(user):
         return queryset
     else:
-        try:
-            user_groups = user.groups.all()
-        except (IndexError, AttributeError):
-            user_groups = None
-        if user_groups:
+        user_group_ids = get_permission_context(user).group_ids
+        if user_group_ids:
             return queryset.filter(Q(is_public=True) |
-                                   Q(group__in=user_groups))
+                                   Q(group__in=user_group_ids))
         else:
             return queryset.filter(is_public=True)
 
@@ -220,13 +263,10 @@ def filter_queryset_by_study_permissions(queryset, user):
     elif is_user_admin(user):
         return queryset
     else:
-        try:
-            user_groups = user.groups.all()
-        except (IndexError, AttributeError):
-            user_groups = None
-        if user_groups:
+        user_group_ids = get_permission_context(user).group_ids
+        if user_group_ids:
             return queryset.filter(Q(study__is_public=True) |
-                                   Q(study__group__in=user_groups))
+                                   Q(study__group__in=user_group_ids))
         else:
             return queryset.filter(study__is_public=True)
 
@@ -239,13 +279,10 @@ def filter_queryset_by_obs_unit_in_study_permissions(queryset, user):
     elif is_user_admin(user):
         return queryset
     else:
-        try:
-            user_groups = user.groups.all()
-        except (IndexError, AttributeError):
-            user_groups = None
-        if user_groups:
+        user_group_ids = get_permission_context(user).group_ids
+        if user_group_ids:
             return queryset.filter(Q(observation_unit__study__is_public=True) |
-                                   Q(observation_unit__study__group__in=user_groups))
+                                   Q(observation_unit__study__group__in=user_group_ids))
         else:
             return queryset.filter(study__is_public=True)
 
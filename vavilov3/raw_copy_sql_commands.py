@@ -0,0 +1,281 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+# Staging tables used by the COPY accession ingestion. They only live during
+# the transaction that loads them.
+CREATE_ACCESSION_STAGING_TABLES = [
+    '''
+CREATE TEMPORARY TABLE "vavilov_accession_staging" (
+    "row_number" integer NOT NULL,
+    "institute_code" text NOT NULL,
+    "germplasm_number" varchar(100) NOT NULL,
+    "conservation_status" varchar(50),
+    "is_available" boolean,
+    "in_nuclear_collection" boolean,
+    "data" jsonb NOT NULL,
+    "institute_id" integer
+) ON COMMIT DROP
+''',
+    '''
+CREATE TEMPORARY TABLE "vavilov_passport_staging" (
+    "row_number" integer NOT NULL,
+    "passport_index" integer NOT NULL,
+    "institute_code" text NOT NULL,
+    "germplasm_number" varchar(100) NOT NULL,
+    "data_source_code" text,
+    "data_source_kind" varchar(100),
+    "collecting_institute_code" text,
+    "collection_number" varchar(255),
+    "accession_name" varchar(255),
+    "crop_name" varchar(255),
+    "country_code" text,
+    "state" varchar(255),
+    "province" varchar(255),
+    "municipality" varchar(255),
+    "location_site" text,
+    "biological_status" varchar(3),
+    "collection_source" varchar(3),
+    "latitude" numeric(9, 4),
+    "longitude" numeric(9, 4),
+    "pdci" numeric(4, 2),
+    "data" jsonb NOT NULL,
+    "institute_id" integer,
+    "country_id" integer,
+    "data_source_id" integer
+) ON COMMIT DROP
+''',
+    '''
+CREATE TEMPORARY TABLE "vavilov_passport_taxon_staging" (
+    "row_number" integer NOT NULL,
+    "passport_index" integer NOT NULL,
+    "rank_name" varchar(100) NOT NULL,
+    "taxon_name" varchar(255) NOT NULL
+) ON COMMIT DROP
+''']
+
+# the staging tables are dropped on commit, but a load can be done in several
+# chunks inside the same transaction
+DROP_ACCESSION_STAGING_TABLES = '''
+DROP TABLE IF EXISTS "vavilov_accession_staging", "vavilov_passport_staging",
+                     "vavilov_passport_taxon_staging"
+'''
+
+ACCESSION_STAGING_COLUMNS = ('row_number', 'institute_code',
+                             'germplasm_number', 'conservation_status',
+                             'is_available', 'in_nuclear_collection', 'data')
+
+PASSPORT_STAGING_COLUMNS = ('row_number', 'passport_index', 'institute_code',
+                            'germplasm_number', 'data_source_code',
+                            'data_source_kind', 'collecting_institute_code',
+                            'collection_number', 'accession_name', 'crop_name',
+                            'country_code', 'state', 'province',
+                            'municipality', 'location_site',
+                            'biological_status', 'collection_source',
+                            'latitude', 'longitude', 'pdci', 'data')
+
+PASSPORT_TAXON_STAGING_COLUMNS = ('row_number', 'passport_index', 'rank_name',
+                                  'taxon_name')
+
+COPY_TO_STAGING_TABLE = '''
+COPY "{table}" ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')
+'''
+
+RESOLVE_STAGING_IDS = [
+    '''
+UPDATE "vavilov_accession_staging"
+    SET "institute_id" = "vavilov_institute"."institute_id"
+    FROM "vavilov_institute"
+    WHERE "vavilov_institute"."code" = "vavilov_accession_staging"."institute_code"
+''',
+    '''
+UPDATE "vavilov_passport_staging"
+    SET "institute_id" = "vavilov_institute"."institute_id"
+    FROM "vavilov_institute"
+    WHERE "vavilov_institute"."code" = "vavilov_passport_staging"."institute_code"
+''',
+    '''
+UPDATE "vavilov_passport_staging"
+    SET "country_id" = "vavilov_country"."country_id"
+    FROM "vavilov_country"
+    WHERE "vavilov_country"."code" = "vavilov_passport_staging"."country_code"
+''']
+
+# Each validation query returns the row number and the values needed to
+# build the error message. They are run in the same order that the row by
+# row loader checks them.
+UNKNOWN_ACCESSION_INSTITUTES = '''
+SELECT "row_number", "institute_code"
+    FROM "vavilov_accession_staging"
+    WHERE "institute_id" IS NULL
+'''
+
+EXISTING_ACCESSIONS = '''
+SELECT "staging"."row_number", "staging"."institute_code",
+       "staging"."germplasm_number"
+    FROM "vavilov_accession_staging" AS "staging"
+        INNER JOIN "vavilov_accession" ON ("vavilov_accession"."institute_id" = "staging"."institute_id"
+                                           AND "vavilov_accession"."germplasm_number" = "staging"."germplasm_number")
+'''
+
+REPEATED_ACCESSIONS = '''
+SELECT "row_number", "institute_code", "germplasm_number" FROM (
+    SELECT "row_number", "institute_code", "germplasm_number",
+           ROW_NUMBER() OVER (PARTITION BY "institute_code", "germplasm_number"
+                              ORDER BY "row_number") AS "occurrence"
+        FROM "vavilov_accession_staging"
+    ) AS TMP
+WHERE "occurrence" > 1
+'''
+
+UNKNOWN_PASSPORT_INSTITUTES = '''
+SELECT "row_number", "institute_code"
+    FROM "vavilov_passport_staging"
+    WHERE "institute_id" IS NULL
+'''
+
+DATA_SOURCE_KIND_CONFLICTS = '''
+SELECT "row_number", "data_source_code" FROM (
+    SELECT "staging"."row_number", "staging"."data_source_code",
+           "staging"."data_source_kind",
+           COALESCE("vavilov_data_source"."kind",
+                    FIRST_VALUE("staging"."data_source_kind") OVER (PARTITION BY "staging"."data_source_code"
+                                                                    ORDER BY "staging"."row_number")) AS "expected_kind"
+        FROM "vavilov_passport_staging" AS "staging"
+            LEFT OUTER JOIN "vavilov_data_source" ON ("vavilov_data_source"."code" = "staging"."data_source_code")
+        WHERE "staging"."data_source_code" IS NOT NULL
+    ) AS TMP
+WHERE "data_source_kind" IS DISTINCT FROM "expected_kind"
+'''
+
+UNKNOWN_COUNTRIES = '''
+SELECT "row_number", "country_code"
+    FROM "vavilov_passport_staging"
+    WHERE "country_code" IS NOT NULL AND "country_id" IS NULL
+'''
+
+UNKNOWN_COLLECTING_INSTITUTES = '''
+SELECT "staging"."row_number", "staging"."germplasm_number",
+       "staging"."collecting_institute_code"
+    FROM "vavilov_passport_staging" AS "staging"
+        LEFT OUTER JOIN "vavilov_institute" ON ("vavilov_institute"."code" = "staging"."collecting_institute_code")
+    WHERE "staging"."collecting_institute_code" IS NOT NULL
+          AND "vavilov_institute"."institute_id" IS NULL
+'''
+
+UNKNOWN_RANKS = '''
+SELECT "staging"."row_number", "staging"."rank_name"
+    FROM "vavilov_passport_taxon_staging" AS "staging"
+        LEFT OUTER JOIN "vavilov_rank" ON ("vavilov_rank"."name" = "staging"."rank_name")
+    WHERE "vavilov_rank"."rank_id" IS NULL
+'''
+
+REPEATED_PASSPORTS = '''
+SELECT "row_number", "institute_code", "germplasm_number" FROM (
+    SELECT "row_number", "institute_code", "germplasm_number",
+           ROW_NUMBER() OVER (PARTITION BY "institute_code", "germplasm_number", "data_source_code"
+                              ORDER BY "row_number", "passport_index") AS "occurrence"
+        FROM "vavilov_passport_staging"
+    ) AS TMP
+WHERE "occurrence" > 1
+'''
+
+INSERT_STAGED_DATA_SOURCES = '''
+INSERT INTO "vavilov_data_source" ("code", "kind")
+    SELECT DISTINCT "data_source_code", "data_source_kind"
+        FROM "vavilov_passport_staging"
+        WHERE "data_source_code" IS NOT NULL
+ON CONFLICT ("code") DO NOTHING
+'''
+
+RESOLVE_STAGED_DATA_SOURCES = '''
+UPDATE "vavilov_passport_staging"
+    SET "data_source_id" = "vavilov_data_source"."data_source_id"
+    FROM "vavilov_data_source"
+    WHERE "vavilov_data_source"."code" = "vavilov_passport_staging"."data_source_code"
+'''
+
+INSERT_STAGED_TAXA = '''
+INSERT INTO "vavilov_taxon" ("name", "rank_id")
+    SELECT DISTINCT "staging"."taxon_name", "vavilov_rank"."rank_id"
+        FROM "vavilov_passport_taxon_staging" AS "staging"
+            INNER JOIN "vavilov_rank" ON ("vavilov_rank"."name" = "staging"."rank_name")
+ON CONFLICT ("name", "rank_id") DO NOTHING
+'''
+
+# accessions, passports and their taxa are merged in a single statement
+MERGE_STAGED_ACCESSIONS = '''
+WITH "new_accession" AS (
+    INSERT INTO "vavilov_accession" ("group_id", "is_public", "institute_id",
+                                     "germplasm_number", "is_available",
+                                     "conservation_status",
+                                     "in_nuclear_collection", "data")
+        SELECT %(group_id)s, %(is_public)s, "institute_id", "germplasm_number",
+               "is_available", "conservation_status", "in_nuclear_collection",
+               "data"
+            FROM "vavilov_accession_staging"
+            ORDER BY "row_number"
+    RETURNING "accession_id", "institute_id", "germplasm_number"
+), "new_passport" AS (
+    INSERT INTO "vavilov_passport" ("data", "data_source_id", "institute_id",
+                                    "germplasm_number", "accession_id",
+                                    "collection_number", "accession_name",
+                                    "crop_name", "country_id", "state",
+                                    "province", "municipality",
+                                    "location_site", "biological_status",
+                                    "collection_source", "latitude",
+                                    "longitude", "pdci")
+        SELECT "passport"."data", "passport"."data_source_id",
+               "passport"."institute_id", "passport"."germplasm_number",
+               "new_accession"."accession_id", "passport"."collection_number",
+               "passport"."accession_name", "passport"."crop_name",
+               "passport"."country_id", "passport"."state",
+               "passport"."province", "passport"."municipality",
+               "passport"."location_site", "passport"."biological_status",
+               "passport"."collection_source", "passport"."latitude",
+               "passport"."longitude", "passport"."pdci"
+            FROM "vavilov_passport_staging" AS "passport"
+                INNER JOIN "vavilov_accession_staging" AS "accession" ON ("accession"."row_number" = "passport"."row_number")
+                INNER JOIN "new_accession" ON ("new_accession"."institute_id" = "accession"."institute_id"
+                                               AND "new_accession"."germplasm_number" = "accession"."germplasm_number")
+    RETURNING "passport_id", "accession_id", "institute_id",
+              "germplasm_number", "data_source_id"
+)
+INSERT INTO "vavilov_passport_taxa" ("passport_id", "taxon_id")
+    SELECT DISTINCT "new_passport"."passport_id", "vavilov_taxon"."taxon_id"
+        FROM "new_passport"
+            INNER JOIN "new_accession" ON ("new_accession"."accession_id" = "new_passport"."accession_id")
+            INNER JOIN "vavilov_accession_staging" AS "accession" ON ("accession"."institute_id" = "new_accession"."institute_id"
+                                                                     AND "accession"."germplasm_number" = "new_accession"."germplasm_number")
+            INNER JOIN "vavilov_passport_staging" AS "passport" ON ("passport"."row_number" = "accession"."row_number"
+                                                                   AND "passport"."institute_id" = "new_passport"."institute_id"
+                                                                   AND "passport"."germplasm_number" = "new_passport"."germplasm_number"
+                                                                   AND "passport"."data_source_id" IS NOT DISTINCT FROM "new_passport"."data_source_id")
+            INNER JOIN "vavilov_passport_taxon_staging" AS "taxon" ON ("taxon"."row_number" = "passport"."row_number"
+                                                                      AND "taxon"."passport_index" = "passport"."passport_index")
+            INNER JOIN "vavilov_rank" ON ("vavilov_rank"."name" = "taxon"."rank_name")
+            INNER JOIN "vavilov_taxon" ON ("vavilov_taxon"."name" = "taxon"."taxon_name"
+                                           AND "vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
+'''
+
+SELECT_STAGED_INSTITUTES = '''
+SELECT DISTINCT "institute_id" FROM "vavilov_accession_staging"
+'''
+
+SELECT_STAGED_PASSPORT_INSTITUTES = '''
+SELECT DISTINCT "institute_id" FROM "vavilov_passport_staging"
+'''
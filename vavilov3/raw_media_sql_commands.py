@@ -0,0 +1,42 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+# the media files referenced by the database, sorted by their bytes as the
+# storage listing of the sweeper
+SORTED_MEDIA_FILE_NAMES = '''
+SELECT "name" FROM (
+    SELECT "image" AS "name" FROM "vavilov_observation_images"
+    UNION SELECT "image_medium" FROM "vavilov_observation_images"
+    UNION SELECT "image_small" FROM "vavilov_observation_images"
+    UNION SELECT "image" FROM "vavilov_image_blob"
+    UNION SELECT "image_medium" FROM "vavilov_image_blob"
+    UNION SELECT "image_small" FROM "vavilov_image_blob"
+) AS "media_files"
+    WHERE "name" IS NOT NULL AND "name" <> ''
+    ORDER BY "name" COLLATE "C"
+'''
+
+# the given files that are referenced by the database
+REFERENCED_MEDIA_FILE_NAMES = '''
+SELECT "image" FROM "vavilov_observation_images" WHERE "image" = ANY(%(names)s)
+UNION SELECT "image_medium" FROM "vavilov_observation_images" WHERE "image_medium" = ANY(%(names)s)
+UNION SELECT "image_small" FROM "vavilov_observation_images" WHERE "image_small" = ANY(%(names)s)
+UNION SELECT "image" FROM "vavilov_image_blob" WHERE "image" = ANY(%(names)s)
+UNION SELECT "image_medium" FROM "vavilov_image_blob" WHERE "image_medium" = ANY(%(names)s)
+UNION SELECT "image_small" FROM "vavilov_image_blob" WHERE "image_small" = ANY(%(names)s)
+'''
@@ -0,0 +1,33 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+# It fills the numeric value of the observations of numerical variables with
+# the ids in the given range. The values that are not numbers are left empty
+BACKFILL_OBSERVATION_NUMERIC_VALUES = '''
+UPDATE "vavilov_observation"
+    SET "value_numeric" = CAST("vavilov_observation"."value" AS DOUBLE PRECISION)
+    FROM "vavilov_observation_variable"
+        INNER JOIN "vavilov_scale" ON ("vavilov_scale"."scale_id" = "vavilov_observation_variable"."scale_id")
+        INNER JOIN "vavilov_observation_data_type" ON ("vavilov_observation_data_type"."scale_data_type_id" = "vavilov_scale"."data_type_id")
+    WHERE "vavilov_observation_variable"."observation_variable_id" = "vavilov_observation"."observation_variable_id"
+        AND "vavilov_observation_data_type"."name" = %(data_type)s
+        AND "vavilov_observation"."observation_id" >= %(min_id)s
+        AND "vavilov_observation"."observation_id" < %(max_id)s
+        AND "vavilov_observation"."value_numeric" IS NULL
+        AND "vavilov_observation"."value" ~ '^\\s*[-+]?([0-9]+\\.?[0-9]*|\\.[0-9]+)([eE][-+]?[0-9]+)?\\s*$'
+'''
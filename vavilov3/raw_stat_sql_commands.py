@@ -16,226 +16,135 @@
 #
 #
 
-INSTITUTE_ACCESSION_COUNTRY_STATS = """
-SELECT  "country_id",
-        "country_code",
-        "country_name",
-       COUNT(*) AS "counts" FROM (
-            SELECT DISTINCT
-                "vavilov_accession"."accession_id",
-                "vavilov_country"."country_id" AS "country_id",
-                "vavilov_country"."code" AS "country_code",
-                "vavilov_country"."name" AS "country_name"
-                    FROM "vavilov_country"
-                        INNER JOIN "vavilov_passport" ON ("vavilov_country"."country_id" = "vavilov_passport"."country_id")
-                        INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-                    WHERE "vavilov_accession"."institute_id" = {institute_id}
-            ) as TMP
-GROUP BY "country_id", "country_code", "country_name"
-"""
-
-INSTITUTE_ACCESSIONSET_COUNTRY_STATS = """
-SELECT  "country_id",
-        "country_code",
-        "country_name",
-       COUNT(*) AS "counts" FROM (
-            SELECT DISTINCT
-                "vavilov_accessionset"."accessionset_id",
-                "vavilov_country"."country_id" AS "country_id",
-                "vavilov_country"."code" AS "country_code",
-                "vavilov_country"."name" AS "country_name"
-                    FROM "vavilov_country"
-                        INNER JOIN "vavilov_passport" ON ("vavilov_country"."country_id" = "vavilov_passport"."country_id")
-                        INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-                        INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
-                        INNER JOIN "vavilov_accessionset" ON ("vavilov_accessionset"."accessionset_id" = "vavilov_accessionset_accessions"."accessionset_id")
-                    WHERE "vavilov_accessionset"."institute_id" = {institute_id}
-            ) as TMP
-GROUP BY "country_id", "country_code", "country_name"
-"""
-
-INSTITUTE_ACCESSION_TAXA_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT "vavilov_accession"."accession_id",
-            "vavilov_taxon"."taxon_id" as "taxon_id",
-            "vavilov_taxon"."name" as "taxon_name",
-            "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-        WHERE "vavilov_accession"."institute_id" = {institute_id}) as TMP
-GROUP BY "taxon_name", "rank_name", "taxon_id";
-'''
+# The stats are precomputed in the entity stats table. Every stats type
+# counts the accessions or accessionsets by its dimensions and by the
+# entity permissions (group, is_public), so the counts of every permission
+# can be added without counting twice the same entity
+ACCESSION_STATS = 'accession'
+ACCESSIONSET_STATS = 'accessionset'
+STATS_ENTITY_TYPES = (ACCESSION_STATS, ACCESSIONSET_STATS)
 
-INSTITUTE_ACCESSIONSET_TAXA_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT "vavilov_accessionset"."accessionset_id",
-                "vavilov_taxon"."taxon_id" as "taxon_id",
-                "vavilov_taxon"."name" as "taxon_name",
-                "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
-            INNER JOIN "vavilov_accessionset" ON ("vavilov_accessionset"."accessionset_id" = "vavilov_accessionset_accessions"."accessionset_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-        WHERE "vavilov_accessionset"."institute_id" = {institute_id}) as TMP
-GROUP BY "taxon_name", "rank_name", "taxon_id";
-'''
+INSTITUTE_COUNTRY_STATS = 'institute_country'
+INSTITUTE_TAXON_STATS = 'institute_taxon'
+COUNTRY_TAXON_STATS = 'country_taxon'
+TAXON_STATS = 'taxon'
 
-COUNTRY_ACCESSION_INSTITUTE_STATS = """
-SELECT
-    "institute_id",
-    "institute_code",
-    "institute_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT
-            "vavilov_accession"."accession_id",
-            "vavilov_institute"."institute_id" AS "institute_id",
-            "vavilov_institute"."code" AS "institute_code",
-            "vavilov_institute"."name" AS "institute_name"
-        FROM "vavilov_institute"
-            INNER JOIN "vavilov_accession" ON ("vavilov_accession"."institute_id" = "vavilov_institute"."institute_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-        WHERE "vavilov_passport"."country_id" = {country_id}
-    ) as TMP
-GROUP BY "institute_id", "institute_code", "institute_name"
-"""
-
-COUNTRY_ACCESSIONSET_INSTITUTE_STATS = """
-SELECT
-    "institute_id",
-    "institute_code",
-    "institute_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT
-            "vavilov_accessionset"."accessionset_id",
-            "vavilov_institute"."institute_id" AS "institute_id",
-            "vavilov_institute"."code" AS "institute_code",
-            "vavilov_institute"."name" AS "institute_name"
-        FROM "vavilov_institute"
-            INNER JOIN "vavilov_accessionset" ON ("vavilov_accessionset"."institute_id" = "vavilov_institute"."institute_id")
-            INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-        WHERE "vavilov_passport"."country_id" = {country_id}
-    ) as TMP
-GROUP BY "institute_id", "institute_code", "institute_name"
-"""
-
-COUNTRY_ACCESSION_TAXA_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT "vavilov_accession"."accession_id",
-            "vavilov_taxon"."taxon_id" as "taxon_id",
-            "vavilov_taxon"."name" as "taxon_name",
-            "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-        WHERE "vavilov_passport"."country_id" = {country_id}
-    ) as TMP
-GROUP BY "taxon_name", "rank_name", "taxon_id";
-'''
-COUNTRY_ACCESSIONSET_TAXA_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "counts" FROM (
-        SELECT DISTINCT "vavilov_accessionset"."accessionset_id",
-            "vavilov_taxon"."taxon_id" as "taxon_id",
-            "vavilov_taxon"."name" as "taxon_name",
-            "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
-            INNER JOIN "vavilov_accessionset" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-        WHERE "vavilov_passport"."country_id" = {country_id}
-    ) as TMP
-GROUP BY "taxon_name", "rank_name", "taxon_id";
+ENTITY_PASSPORTS = {
+    ACCESSION_STATS: '''
+            SELECT "vavilov_accession"."accession_id" AS "entity_id",
+                   "vavilov_accession"."institute_id",
+                   "vavilov_accession"."group_id",
+                   "vavilov_accession"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accession"
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")''',
+    ACCESSIONSET_STATS: '''
+            SELECT "vavilov_accessionset"."accessionset_id" AS "entity_id",
+                   "vavilov_accessionset"."institute_id",
+                   "vavilov_accessionset"."group_id",
+                   "vavilov_accessionset"."is_public",
+                   "vavilov_passport"."country_id",
+                   "vavilov_passport_taxa"."taxon_id"
+                FROM "vavilov_accessionset"
+                    INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+                    INNER JOIN "vavilov_passport" ON ("vavilov_passport"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+                    LEFT JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")'''}
+
+# the dimensions of every stats type: institute, country and taxon
+STATS_DIMENSIONS = {
+    INSTITUTE_COUNTRY_STATS: ('"entity"."institute_id"', '"entity"."country_id"', None),
+    INSTITUTE_TAXON_STATS: ('"entity"."institute_id"', None, '"entity"."taxon_id"'),
+    COUNTRY_TAXON_STATS: (None, '"entity"."country_id"', '"entity"."taxon_id"'),
+    TAXON_STATS: (None, None, '"entity"."taxon_id"')}
+
+# the dimension used to refresh only a part of every stats type
+INSTITUTE_SCOPE = 'institute'
+COUNTRY_SCOPE = 'country'
+TAXON_SCOPE = 'taxon'
+STATS_SCOPES = {INSTITUTE_COUNTRY_STATS: INSTITUTE_SCOPE,
+                INSTITUTE_TAXON_STATS: INSTITUTE_SCOPE,
+                COUNTRY_TAXON_STATS: COUNTRY_SCOPE,
+                TAXON_STATS: TAXON_SCOPE}
+SCOPE_FILTERS = {INSTITUTE_SCOPE: '"{table}"."institute_id" = ANY(%(institute_ids)s)',
+                 COUNTRY_SCOPE: '"{table}"."country_id" = ANY(%(country_ids)s)',
+                 TAXON_SCOPE: '"{table}"."taxon_id" = ANY(%(taxon_ids)s)'}
+
+INSERT_ENTITY_STATS = '''
+INSERT INTO "vavilov_entity_stats" ("stats_type", "entity_type",
+                                    "institute_id", "country_id", "taxon_id",
+                                    "group_id", "is_public", "num_entities")
+    SELECT '{stats_type}', '{entity_type}', {institute}, {country}, {taxon},
+           "entity"."group_id", "entity"."is_public",
+           COUNT(DISTINCT "entity"."entity_id")
+        FROM ({entity_passports}
+        ) AS "entity"
+        WHERE {where}
+        GROUP BY {group_by}, "entity"."group_id", "entity"."is_public"
 '''
-TAXA_ACCESSION_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "num_accessions" FROM (
-        SELECT DISTINCT "vavilov_accession"."accession_id",
-            "vavilov_taxon"."taxon_id" as "taxon_id",
-            "vavilov_taxon"."name" as "taxon_name",
-            "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-    ) AS TMP
-GROUP BY "taxon_name", "rank_name", "taxon_id";
+
+DELETE_ENTITY_STATS = '''
+DELETE FROM "vavilov_entity_stats"
+    WHERE "stats_type" = '{stats_type}' AND "entity_type" = '{entity_type}'
+          AND {scope_filter}
 '''
-TAXA_ACCESSIONSET_STATS = '''
-SELECT "taxon_id",
-    "taxon_name",
-    "rank_name",
-    COUNT(*) AS "num_accessionsets" FROM (
-        SELECT DISTINCT "vavilov_accessionset"."accessionset_id",
-            "vavilov_taxon"."taxon_id" as "taxon_id",
-            "vavilov_taxon"."name" as "taxon_name",
-            "vavilov_rank"."name" as "rank_name"
-        FROM "vavilov_taxon"
-            INNER JOIN "vavilov_passport_taxa" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
-            INNER JOIN "vavilov_passport" ON ("vavilov_passport"."passport_id" = "vavilov_passport_taxa"."passport_id")
-            INNER JOIN "vavilov_accession" ON ("vavilov_passport"."accession_id" = "vavilov_accession"."accession_id")
-            INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
-            INNER JOIN "vavilov_accessionset" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
-            INNER JOIN "vavilov_rank" ON ("vavilov_taxon"."rank_id" = "vavilov_rank"."rank_id")
-    ) AS TMP2
-GROUP BY "taxon_name", "rank_name", "taxon_id";
+
+DELETE_ALL_ENTITY_STATS = 'DELETE FROM "vavilov_entity_stats"'
+
+# the refreshes delete and insert the stats rows, so the parallel ones would
+# count twice the same entities. This lock serializes them until the commit
+ENTITY_STATS_LOCK_ID = 3214001
+LOCK_ENTITY_STATS = 'SELECT pg_advisory_xact_lock(%(lock_id)s)'
+
+# the accessionsets of other institutes can have accessions of the given ones
+ACCESSIONSET_STATS_INSTITUTES = '''
+SELECT DISTINCT "vavilov_accessionset"."institute_id"
+    FROM "vavilov_accessionset"
+        INNER JOIN "vavilov_accessionset_accessions" ON ("vavilov_accessionset_accessions"."accessionset_id" = "vavilov_accessionset"."accessionset_id")
+        INNER JOIN "vavilov_accession" ON ("vavilov_accession"."accession_id" = "vavilov_accessionset_accessions"."accession_id")
+    WHERE "vavilov_accession"."institute_id" = ANY(%(institute_ids)s)
 '''
 
 
-def get_institute_stats_raw_sql(institute_id, stats_type, entity_type, user):
-    if stats_type == 'country':
-        if entity_type == 'accession':
-            return INSTITUTE_ACCESSION_COUNTRY_STATS.format(institute_id=institute_id)
-        elif entity_type == 'accessionset':
-            return INSTITUTE_ACCESSIONSET_COUNTRY_STATS.format(institute_id=institute_id)
-    elif stats_type == 'taxa':
-        if entity_type == 'accession':
-            return INSTITUTE_ACCESSION_TAXA_STATS.format(institute_id=institute_id)
-        elif entity_type == 'accessionset':
-            return INSTITUTE_ACCESSIONSET_TAXA_STATS.format(institute_id=institute_id)
-
-
-def get_country_stats_raw_sql(country_id, stats_type, entity_type, user):
-    if stats_type == 'institute':
-        if entity_type == 'accession':
-            return COUNTRY_ACCESSION_INSTITUTE_STATS.format(country_id=country_id)
-        elif entity_type == 'accessionset':
-            return COUNTRY_ACCESSIONSET_INSTITUTE_STATS.format(country_id=country_id)
-    elif stats_type == 'taxa':
-        if entity_type == 'accession':
-            return COUNTRY_ACCESSION_TAXA_STATS.format(country_id=country_id)
-        elif entity_type == 'accessionset':
-            return COUNTRY_ACCESSIONSET_TAXA_STATS.format(country_id=country_id)
-
-
-def get_taxa_stas_raw_sql(entity_type, user=None):
-    if entity_type == 'accession':
-        return TAXA_ACCESSION_STATS
-    elif entity_type == 'accessionset':
-        return TAXA_ACCESSIONSET_STATS
+def get_insert_entity_stats_sql(stats_type, entity_type, scope=None):
+    dimensions = STATS_DIMENSIONS[stats_type]
+    institute, country, taxon = [dimension or 'NULL' for dimension in dimensions]
+    not_nulls = ['{} IS NOT NULL'.format(dimension) for dimension in dimensions
+                 if dimension]
+    if scope:
+        not_nulls.append(SCOPE_FILTERS[scope].format(table='entity'))
+    return INSERT_ENTITY_STATS.format(
+        stats_type=stats_type, entity_type=entity_type,
+        institute=institute, country=country, taxon=taxon,
+        entity_passports=ENTITY_PASSPORTS[entity_type],
+        where=' AND '.join(not_nulls),
+        group_by=', '.join(dimension for dimension in dimensions if dimension))
+
+
+def get_delete_entity_stats_sql(stats_type, entity_type, scope):
+    scope_filter = SCOPE_FILTERS[scope].format(table='vavilov_entity_stats')
+    return DELETE_ENTITY_STATS.format(stats_type=stats_type,
+                                      entity_type=entity_type,
+                                      scope_filter=scope_filter)
+
+
+def get_refresh_all_entity_stats_sqls():
+    return [get_insert_entity_stats_sql(stats_type, entity_type)
+            for entity_type in STATS_ENTITY_TYPES
+            for stats_type in STATS_DIMENSIONS]
+
+
+# pdci histogram of the passports of every institute, 20 bins from 0 to 10,
+# the last bin includes the 10 as numpy.histogram did
+PDCI_HISTOGRAM_BINS = 20
+PDCI_HISTOGRAM_RANGE = (0, 10)
+INSTITUTE_PDCI_HISTOGRAMS = '''
+SELECT "institute_id",
+       LEAST(width_bucket("pdci", %(min_pdci)s, %(max_pdci)s, %(bins)s), %(bins)s) AS "bucket",
+       count(*)
+    FROM "vavilov_passport"
+    WHERE "institute_id" = ANY(%(institute_ids)s)
+        AND "pdci" BETWEEN %(min_pdci)s AND %(max_pdci)s
+    GROUP BY "institute_id", "bucket"
+'''
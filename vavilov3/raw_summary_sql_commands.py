@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+# It (re)builds the summary rows of the accessions selected by the
+# accession_filter, one row per accession
+REFRESH_ACCESSION_SUMMARIES = '''
+INSERT INTO "vavilov_accession_summary" ("accession_id", "institute_code",
+                                         "germplasm_number", "group_id",
+                                         "is_public", "genera", "species",
+                                         "taxa", "ranks", "countries",
+                                         "latitudes", "longitudes",
+                                         "crop_names", "pdci", "data_sources",
+                                         "biological_statuses",
+                                         "collection_sources", "taxa_text",
+                                         "numbers_text", "sites_text")
+    SELECT "accession"."accession_id", "institute"."code",
+           "accession"."germplasm_number", "accession"."group_id",
+           "accession"."is_public",
+           COALESCE("taxa"."genera", '{{}}'), COALESCE("taxa"."species", '{{}}'),
+           COALESCE("taxa"."taxa", '{{}}'), COALESCE("taxa"."ranks", '{{}}'),
+           COALESCE("passport"."countries", '{{}}'),
+           COALESCE("passport"."latitudes", '{{}}'),
+           COALESCE("passport"."longitudes", '{{}}'),
+           COALESCE("passport"."crop_names", '{{}}'), "passport"."pdci",
+           COALESCE("passport"."data_sources", '{{}}'),
+           COALESCE("passport"."biological_statuses", '{{}}'),
+           COALESCE("passport"."collection_sources", '{{}}'),
+           COALESCE("taxa"."taxa_text", ''),
+           concat_ws(E'\\n', "accession"."germplasm_number", "passport"."numbers_text"),
+           COALESCE("passport"."sites_text", '')
+        FROM "vavilov_accession" AS "accession"
+            INNER JOIN "vavilov_institute" AS "institute" ON ("institute"."institute_id" = "accession"."institute_id")
+            LEFT JOIN LATERAL (
+                SELECT array_agg(DISTINCT "vavilov_taxon"."name") FILTER (WHERE "vavilov_rank"."name" = 'genus') AS "genera",
+                       array_agg(DISTINCT "vavilov_taxon"."name") FILTER (WHERE "vavilov_rank"."name" = 'species') AS "species",
+                       array_agg(DISTINCT lower("vavilov_taxon"."name")) AS "taxa",
+                       array_agg(DISTINCT "vavilov_rank"."name") AS "ranks",
+                       string_agg(DISTINCT "vavilov_taxon"."name", E'\\n') AS "taxa_text"
+                    FROM "vavilov_passport"
+                        INNER JOIN "vavilov_passport_taxa" ON ("vavilov_passport_taxa"."passport_id" = "vavilov_passport"."passport_id")
+                        INNER JOIN "vavilov_taxon" ON ("vavilov_taxon"."taxon_id" = "vavilov_passport_taxa"."taxon_id")
+                        INNER JOIN "vavilov_rank" ON ("vavilov_rank"."rank_id" = "vavilov_taxon"."rank_id")
+                    WHERE "vavilov_passport"."accession_id" = "accession"."accession_id"
+            ) AS "taxa" ON TRUE
+            LEFT JOIN LATERAL (
+                SELECT array_agg(DISTINCT "vavilov_country"."code") FILTER (WHERE "vavilov_country"."code" IS NOT NULL) AS "countries",
+                       array_agg("vavilov_passport"."latitude" ORDER BY "vavilov_passport"."passport_id") FILTER (WHERE "vavilov_passport"."latitude" IS NOT NULL) AS "latitudes",
+                       array_agg("vavilov_passport"."longitude" ORDER BY "vavilov_passport"."passport_id") FILTER (WHERE "vavilov_passport"."longitude" IS NOT NULL) AS "longitudes",
+                       array_agg(DISTINCT lower("vavilov_passport"."crop_name")) FILTER (WHERE "vavilov_passport"."crop_name" IS NOT NULL) AS "crop_names",
+                       max("vavilov_passport"."pdci") AS "pdci",
+                       array_agg(DISTINCT "vavilov_data_source"."code") FILTER (WHERE "vavilov_data_source"."code" IS NOT NULL) AS "data_sources",
+                       array_agg(DISTINCT "vavilov_passport"."biological_status") FILTER (WHERE "vavilov_passport"."biological_status" IS NOT NULL) AS "biological_statuses",
+                       array_agg(DISTINCT "vavilov_passport"."collection_source") FILTER (WHERE "vavilov_passport"."collection_source" IS NOT NULL) AS "collection_sources",
+                       string_agg(concat_ws(E'\\n', "vavilov_passport"."accession_name",
+                                            "vavilov_passport"."collection_number"), E'\\n') AS "numbers_text",
+                       string_agg(concat_ws(E'\\n', "vavilov_passport"."state",
+                                            "vavilov_passport"."province",
+                                            "vavilov_passport"."municipality",
+                                            "vavilov_passport"."location_site"), E'\\n') AS "sites_text"
+                    FROM "vavilov_passport"
+                        LEFT JOIN "vavilov_country" ON ("vavilov_country"."country_id" = "vavilov_passport"."country_id")
+                        LEFT JOIN "vavilov_data_source" ON ("vavilov_data_source"."data_source_id" = "vavilov_passport"."data_source_id")
+                    WHERE "vavilov_passport"."accession_id" = "accession"."accession_id"
+            ) AS "passport" ON TRUE
+        {accession_filter}
+ON CONFLICT ("accession_id") DO UPDATE
+    SET "institute_code" = EXCLUDED."institute_code",
+        "germplasm_number" = EXCLUDED."germplasm_number",
+        "group_id" = EXCLUDED."group_id",
+        "is_public" = EXCLUDED."is_public",
+        "genera" = EXCLUDED."genera",
+        "species" = EXCLUDED."species",
+        "taxa" = EXCLUDED."taxa",
+        "ranks" = EXCLUDED."ranks",
+        "countries" = EXCLUDED."countries",
+        "latitudes" = EXCLUDED."latitudes",
+        "longitudes" = EXCLUDED."longitudes",
+        "crop_names" = EXCLUDED."crop_names",
+        "pdci" = EXCLUDED."pdci",
+        "data_sources" = EXCLUDED."data_sources",
+        "biological_statuses" = EXCLUDED."biological_statuses",
+        "collection_sources" = EXCLUDED."collection_sources",
+        "taxa_text" = EXCLUDED."taxa_text",
+        "numbers_text" = EXCLUDED."numbers_text",
+        "sites_text" = EXCLUDED."sites_text"
+'''
+
+ACCESSION_IDS_FILTER = '''WHERE "accession"."accession_id" = ANY(%(accession_ids)s)'''
+
+STAGED_ACCESSIONS_FILTER = '''
+        WHERE ("accession"."institute_id", "accession"."germplasm_number") IN (
+            SELECT "institute_id", "germplasm_number" FROM "vavilov_accession_staging")'''
+
+# toggle public only changes the accession metadata
+SYNC_ACCESSION_SUMMARY_PERMISSIONS = '''
+UPDATE "vavilov_accession_summary"
+    SET "group_id" = "vavilov_accession"."group_id",
+        "is_public" = "vavilov_accession"."is_public"
+    FROM "vavilov_accession"
+    WHERE "vavilov_accession"."accession_id" = "vavilov_accession_summary"."accession_id"
+        AND ("vavilov_accession_summary"."is_public" <> "vavilov_accession"."is_public"
+             OR "vavilov_accession_summary"."group_id" IS DISTINCT FROM "vavilov_accession"."group_id")
+'''
+
+
+def get_refresh_accession_summaries_sql(accession_filter=''):
+    return REFRESH_ACCESSION_SUMMARIES.format(accession_filter=accession_filter)
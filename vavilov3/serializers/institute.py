@@ -31,6 +31,7 @@ from vavilov3.entities.institute import (InstituteStruct,
                                          update_institute_in_db)
 from vavilov3.views import format_error_message
 from vavilov3.tasks import create_institutes_task, wait_func, add_task_to_user
+from vavilov3.permissions import get_permission_context
 
 
 class InstituteListSerializer(serializers.ListSerializer):
@@ -44,7 +45,7 @@ class InstituteListSerializer(serializers.ListSerializer):
             error = 'User must be logged'
             raise ValidationError(format_error_message(error))
 
-        if not user.groups.exists():
+        if not get_permission_context(user).groups:
             error = 'User must belong to a group'
             raise ValidationError(format_error_message(error))
 
@@ -104,7 +105,7 @@ class InstituteSerializer(DynamicFieldsSerializer):
             error = 'User must be logged'
             raise ValidationError(format_error_message(error))
 
-        if not user.groups.exists():
+        if not get_permission_context(user).groups:
             error = 'User must belong to a group'
             raise ValidationError(format_error_message(error))
         try:
@@ -123,7 +124,7 @@ class InstituteSerializer(DynamicFieldsSerializer):
             error = 'User must be logged'
             raise ValidationError(format_error_message(error))
 
-        if not user.groups.exists():
+        if not get_permission_context(user).groups:
             error = 'User must belong to a group'
             raise ValidationError(format_error_message(error))
         try:
@@ -16,9 +16,6 @@
 #
 #
 
-import csv
-from collections import OrderedDict
-
 from django.db import transaction, models
 from django.utils.datastructures import MultiValueDictKeyError
 
@@ -31,14 +28,33 @@ from vavilov3.views import format_error_message
 from vavilov3.entities.metadata import (validate_metadata_data,
                                         MetadataValidationError)
 from vavilov3.tasks import (create_accessions_task, add_task_to_user,
+                            copy_accessions_task,
                             create_accessionsets_task,
                             create_observation_units_task,
                             create_plants_task,
                             create_observation_variables_task,
                             create_studies_task, create_observations_task,
                             create_trait_task, create_scale_task,
-                            create_observation_images_task)
-from vavilov3.excel import excel_dict_reader
+                            create_items_in_partitions)
+from vavilov3.excel import excel_dict_reader, csv_dict_reader
+from vavilov3.permissions import get_permission_context
+from vavilov3.entities.accession import INGESTION_MODE, COPY_INGESTION_MODE
+from vavilov3.conf.settings import (VALID_TRUE_VALUES, BULK_PARTITIONS,
+                                    BULK_PARTITION_MIN_ITEMS)
+from vavilov3.entities.tags import (INSTITUTE_CODE, OBSERVATION_UNIT_STUDY,
+                                    OBSERVATION_STUDY)
+from vavilov3.staging import (count_staged_items, is_staged_items_path,
+                              stage_items, remove_staged_items)
+
+CHUNKED = 'chunked'
+
+# key used to split big uploads of each data type in partitions that can be
+# loaded in parallel
+BULK_PARTITION_KEYS = {
+    'accession': lambda item: item['data'].get(INSTITUTE_CODE),
+    'accessionset': lambda item: item['data'].get(INSTITUTE_CODE),
+    'observation_unit': lambda item: item['data'].get(OBSERVATION_UNIT_STUDY),
+    'observation': lambda item: item.get('data', item).get(OBSERVATION_STUDY)}
 
 
 class DynamicFieldsSerializer(serializers.Serializer):
@@ -90,42 +106,59 @@ class VavilovListSerializer(serializers.ListSerializer):
 #         async_result = wait_func.delay(30)
 #         add_task_to_user(user, async_result)
 #         return async_result
+        conf = getattr(self.context.get('view'), 'conf', None)
+        task_args = ()
         if self.data_type == 'accession':
-            async_result = create_accessions_task.delay(validated_data,
-                                                        user.username)
+            if conf and conf.get(INGESTION_MODE) == COPY_INGESTION_MODE:
+                task = copy_accessions_task
+            else:
+                task = create_accessions_task
         elif self.data_type == 'accessionset':
-            async_result = create_accessionsets_task.delay(validated_data,
-                                                           user.username)
+            task = create_accessionsets_task
         elif self.data_type == 'study':
-            async_result = create_studies_task.delay(validated_data,
-                                                     user.username)
+            task = create_studies_task
         elif self.data_type == 'observation_variable':
-            async_result = create_observation_variables_task.delay(validated_data,
-                                                                   user.username)
+            task = create_observation_variables_task
         elif self.data_type == 'observation_unit':
-            async_result = create_observation_units_task.delay(validated_data,
-                                                               user.username)
+            task = create_observation_units_task
         elif self.data_type == 'plant':
-            async_result = create_plants_task.delay(validated_data,
-                                                    user.username)
+            task = create_plants_task
         elif self.data_type == 'observation':
-            conf = self.context['view'].conf
-            async_result = create_observations_task.delay(validated_data,
-                                                          user.username,
-                                                          conf)
-        elif self.data_type == 'observation_image':
-            conf = self.context['view'].conf
-            async_result = create_observation_images_task.delay(validated_data,
-                                                                user.username,
-                                                                conf)
+            task = create_observations_task
+            task_args = (conf,)
         elif self.data_type == 'trait':
-            async_result = create_trait_task.delay(validated_data, user.username)
+            task = create_trait_task
         elif self.data_type == 'scale':
-            async_result = create_scale_task.delay(validated_data, user.username)
+            task = create_scale_task
         else:
             msg = 'We dont have a create task for the given data type {}'
             raise NotImplementedError(msg.format(self.data_type))
 
+        # by default nothing is added if any item fails, a chunked upload
+        # commits every chunk on its own and leaves out only the wrong items
+        chunked = False
+        if request is not None:
+            chunked = request.query_params.get(CHUNKED) in VALID_TRUE_VALUES
+        # the tasks get the path of a compressed file with the items, not
+        # the items, to keep big payloads out of the broker
+        if not is_staged_items_path(validated_data):
+            validated_data = stage_items(validated_data)
+        partition_key = BULK_PARTITION_KEYS.get(self.data_type)
+        try:
+            if (partition_key and chunked and BULK_PARTITIONS > 1 and
+                    count_staged_items(validated_data) >= BULK_PARTITION_MIN_ITEMS):
+                async_result = create_items_in_partitions(task, validated_data,
+                                                          user.username,
+                                                          task_args,
+                                                          partition_key)
+            else:
+                async_result = task.delay(validated_data, user.username,
+                                          *task_args,
+                                          all_or_nothing=not chunked)
+        except BaseException:
+            remove_staged_items(validated_data)
+            raise
+
         add_task_to_user(user, async_result)
         return async_result
 
@@ -245,7 +278,7 @@ class VavilovSerializer(DynamicFieldsSerializer):
             error = 'User must be logged'
             raise ValidationError(format_error_message(error))
 
-        if not user.groups.exists():
+        if not get_permission_context(user).groups:
             error = 'User must belong to a group'
             raise ValidationError(format_error_message(error))
 
@@ -263,7 +296,7 @@ class VavilovSerializer(DynamicFieldsSerializer):
             error = 'User must be logged'
             raise ValidationError(format_error_message(error))
 
-        if not user.groups.exists():
+        if not get_permission_context(user).groups:
             error = 'User must belong to a group'
             raise ValidationError(format_error_message(error))
 
@@ -273,26 +306,17 @@ class VavilovSerializer(DynamicFieldsSerializer):
             raise ValidationError(format_error_message(error))
 
 
-def serialize_entity_from_csv(fhand, Struct):
-    try:
-        reader = csv.DictReader(fhand, delimiter=',')
-        fields = reader.fieldnames
-    except UnicodeDecodeError:
-        raise ValueError('This is not a csv file')
+def iter_entities_from_rows(rows, Struct):
+    for row in rows:
+        struct = Struct()
+        struct.populate_from_csvrow(row)
+        yield struct.get_api_document()
 
-    data = []
-    for row in reader:
-        row = OrderedDict(((field, row[field]) for field in fields))
-        study_struct = Struct()
-        study_struct.populate_from_csvrow(row)
-        data.append(study_struct.get_api_document())
-    return data
+
+def serialize_entity_from_csv(fhand, Struct):
+    return list(iter_entities_from_rows(csv_dict_reader(fhand), Struct))
 
 
 def serialize_entity_from_excel(fhand, Struct):
-    data = []
-    for row in excel_dict_reader(fhand, values_as_text=True):
-        struct = Struct()
-        struct.populate_from_csvrow(row)
-        data.append(struct.get_api_document())
-    return data
+    rows = excel_dict_reader(fhand, values_as_text=True)
+    return list(iter_entities_from_rows(rows, Struct))
@@ -0,0 +1,122 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+import gzip
+import json
+import os
+import tempfile
+import zlib
+from itertools import islice
+
+from vavilov3.conf.settings import TMP_DIR
+
+STAGED_FILE_PREFIX = 'vavilov3_staged_'
+STAGED_FILE_SUFFIX = '.jsonl.gz'
+# fast compression, json documents compress well even with the lowest levels
+STAGED_FILE_COMPRESSLEVEL = 1
+
+
+def chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ItemStager:
+    """It writes the validated items in a file that the celery tasks read
+    back, so the items are not sent through the broker"""
+
+    def __init__(self):
+        fdesc, self.fpath = tempfile.mkstemp(prefix=STAGED_FILE_PREFIX,
+                                             suffix=STAGED_FILE_SUFFIX,
+                                             dir=TMP_DIR)
+        os.close(fdesc)
+        self._fhand = gzip.open(self.fpath, 'wt',
+                                compresslevel=STAGED_FILE_COMPRESSLEVEL)
+        self.num_items = 0
+
+    def write(self, items):
+        for item in items:
+            self._fhand.write(json.dumps(item))
+            self._fhand.write('\n')
+            self.num_items += 1
+
+    def close(self):
+        if not self._fhand.closed:
+            self._fhand.close()
+
+    def remove(self):
+        self.close()
+        remove_staged_items(self.fpath)
+
+
+def stage_items(items):
+    stager = ItemStager()
+    try:
+        stager.write(items)
+    except BaseException:
+        stager.remove()
+        raise
+    stager.close()
+    return stager.fpath
+
+
+def is_staged_items_path(items):
+    return isinstance(items, str)
+
+
+def iter_staged_items(items):
+    if not is_staged_items_path(items):
+        yield from items
+        return
+    with gzip.open(items, 'rt') as fhand:
+        for line in fhand:
+            yield json.loads(line)
+
+
+def remove_staged_items(items):
+    if is_staged_items_path(items) and os.path.exists(items):
+        os.remove(items)
+
+
+def count_staged_items(items):
+    if not is_staged_items_path(items):
+        return len(items)
+    with gzip.open(items, 'rt') as fhand:
+        return sum(1 for _ in fhand)
+
+
+def partition_staged_items(items, key, num_partitions):
+    stagers = {}
+    try:
+        for item in iter_staged_items(items):
+            partition_key = str(key(item)).encode()
+            partition = zlib.crc32(partition_key) % num_partitions
+            if partition not in stagers:
+                stagers[partition] = ItemStager()
+            stagers[partition].write([item])
+    except BaseException:
+        for stager in stagers.values():
+            stager.remove()
+        raise
+    for stager in stagers.values():
+        stager.close()
+    return [stager.fpath for stager in stagers.values()]
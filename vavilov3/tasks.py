@@ -17,37 +17,55 @@
 #
 
 from __future__ import absolute_import, unicode_literals
-import shutil
 import functools
 import os
 import subprocess
 import logging
+from os.path import basename
 
-from zipfile import is_zipfile, ZipFile
+from zipfile import ZipFile, BadZipFile
 
-from vavilov3.entities.tags import INSTITUTE_CODE, GERMPLASM_NUMBER
-from celery import shared_task
+from vavilov3.entities.tags import (INSTITUTE_CODE, GERMPLASM_NUMBER, IMAGE,
+                                    OBSERVATION_STUDY)
+from celery import shared_task, group, chord
+from celery.exceptions import SoftTimeLimitExceeded
 
 from django.db import transaction
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 
 from vavilov3.views import DETAIL, format_error_message
-from vavilov3.models import UserTasks, ObservationImage
-from vavilov3.entities.accession import create_accession_in_db
+from vavilov3.models import UserTasks, ObservationImage, BulkTaskProgress
+from vavilov3.entities.accession import (create_accessions_in_db,
+                                         copy_accessions_in_db)
 from vavilov3.entities.institute import create_institute_in_db
-from vavilov3.entities.accessionset import create_accessionset_in_db
+from vavilov3.entities.accessionset import create_accessionsets_in_db
 from vavilov3.entities.study import create_study_in_db
 from vavilov3.entities.observation_variable import create_observation_variable_in_db
 from vavilov3.entities.observation_unit import create_observation_unit_in_db
 from vavilov3.entities.plant import create_plant_in_db
-from vavilov3.entities.observation import create_observation_in_db
+from vavilov3.entities.observation import (create_observations_in_db,
+                                           ObservationLookups)
 from vavilov3.entities.trait import create_trait_in_db
+from vavilov3.entities.stats import refresh_entity_stats
 from vavilov3.entities.scale import create_scale_in_db
-from vavilov3.entities.observation_image import create_observation_image_in_db
+from vavilov3.entities.observation_image import (
+    create_observation_image_in_db, validate_observation_image_data,
+    ObservationImageValidationError)
+from vavilov3.entities.task_result_getter import PROGRESS_STATE
+from vavilov3.entities.task_record import (register_task, register_task_progress,
+                                           remove_expired_task_records)
 from vavilov3.conf.settings import (LONG_PROCESS_TIMEOUT,
-                                    SHORT_PROCESS_TIMEOUT)
-from vavilov3.utils import observation_image_cleanup
+                                    SHORT_PROCESS_TIMEOUT, BULK_CHUNK_SIZE,
+                                    BULK_TASK_MAX_RETRIES,
+                                    BULK_PARTITIONS, THUMBNAIL_QUEUE,
+                                    THUMBNAIL_MAX_RETRIES)
+from vavilov3.staging import (chunks, iter_staged_items, remove_staged_items,
+                              partition_staged_items)
+from vavilov3.utils import observation_image_cleanup, remove_unreferenced_files
+from vavilov3.media_journal import journal_written_files
+from vavilov3.export import export_items, remove_expired_exports
 
 User = get_user_model()
 logger = logging.getLogger('vavilov.prod')
@@ -68,11 +86,11 @@ def add_user_to_task(user):
     return decorator
 
 
-def _create_items_task(validated_data, username, func, item_type, conf=None):
-    errors = []
-    with transaction.atomic():
-        user = User.objects.get(username=username) if username else None
-        for item in validated_data:
+def _create_items_one_by_one(func, conf=None):
+
+    def create_items(items, user):
+        errors = []
+        for item in items:
             if conf:
                 try:
                     func(item, user, conf)
@@ -83,90 +101,318 @@ def _create_items_task(validated_data, username, func, item_type, conf=None):
                     func(item, user)
                 except ValueError as error:
                     errors.append(str(error))
+        return errors
 
+    return create_items
+
+
+def _create_items_all_or_nothing(validated_data, user, create_items):
+    errors = []
+    num_items = 0
+    with transaction.atomic():
+        for chunk in chunks(iter_staged_items(validated_data), BULK_CHUNK_SIZE):
+            num_items += len(chunk)
+            errors.extend(create_items(chunk, user))
         if errors:
             raise ValidationError(format_error_message(errors))
-    return {DETAIL: '{} {} added'.format(len(validated_data), item_type)}
+    return num_items
+
+
+def _create_chunk_items(items, user, create_items):
+    """It creates the items in a savepoint. If some of them fail, the
+    savepoint is rolled back and the items are created again by halves, so
+    only the wrong items are left out"""
+    savepoint = transaction.savepoint()
+    errors = create_items(items, user)
+    if not errors:
+        transaction.savepoint_commit(savepoint)
+        return len(items), []
+    transaction.savepoint_rollback(savepoint)
+    if len(items) == 1:
+        return 0, errors
+
+    num_items = 0
+    errors = []
+    half = len(items) // 2
+    for half_items in (items[:half], items[half:]):
+        half_num_items, half_errors = _create_chunk_items(half_items, user,
+                                                          create_items)
+        num_items += half_num_items
+        errors.extend(half_errors)
+    return num_items, errors
+
+
+def _create_items_in_chunks(task_id, validated_data, user, create_items):
+    # every chunk is committed with the task progress, so a task redelivered
+    # after its worker was killed continues from the last committed chunk
+    progress = BulkTaskProgress.objects.get_or_create(task_id=task_id)[0]
+    for index, chunk in enumerate(chunks(iter_staged_items(validated_data),
+                                         BULK_CHUNK_SIZE)):
+        if index < progress.committed_chunks:
+            continue
+        with transaction.atomic():
+            num_items, chunk_errors = _create_chunk_items(chunk, user,
+                                                          create_items)
+            progress.num_items += num_items
+            progress.errors.extend(chunk_errors)
+            progress.committed_chunks = index + 1
+            progress.save()
+    progress.delete()
+    return progress.num_items, progress.errors
+
+
+def _remove_bulk_task_data(task_id, validated_data):
+    BulkTaskProgress.objects.filter(task_id=task_id).delete()
+    remove_staged_items(validated_data)
+
+
+def _create_items_task(task, validated_data, username, create_items,
+                       item_type, all_or_nothing=False, return_errors=False):
+    # the staged items and the progress are kept until the task finishes for
+    # good, so the retries and the redelivered tasks can resume the load
+    errors = []
+    try:
+        user = User.objects.get(username=username) if username else None
+        if all_or_nothing:
+            num_items = _create_items_all_or_nothing(validated_data, user,
+                                                     create_items)
+        else:
+            num_items, errors = _create_items_in_chunks(task.request.id,
+                                                        validated_data, user,
+                                                        create_items)
+    except SoftTimeLimitExceeded as error:
+        if task.request.retries < BULK_TASK_MAX_RETRIES:
+            raise task.retry(exc=error, countdown=0,
+                             max_retries=BULK_TASK_MAX_RETRIES)
+        _remove_bulk_task_data(task.request.id, validated_data)
+        raise
+    except Exception:
+        _remove_bulk_task_data(task.request.id, validated_data)
+        raise
+    _remove_bulk_task_data(task.request.id, validated_data)
 
+    # the tasks of a partitioned upload give their errors to the chord
+    # callback that merges them
+    if return_errors:
+        return {'num_items': num_items, 'errors': errors,
+                'item_type': item_type}
+    if errors:
+        raise ValidationError(_format_load_errors(errors, num_items))
+    return {DETAIL: '{} {} added'.format(num_items, item_type)}
 
-@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+
+def _format_load_errors(errors, num_items):
+    # the items without errors are committed, the failure tells how many
+    error = format_error_message(errors)
+    error['num_items'] = num_items
+    return error
+
+
+@shared_task
+def merge_partition_results_task(results):
+    errors = []
+    num_items = 0
+    for result in results:
+        num_items += result['num_items']
+        errors.extend(result['errors'])
+    if errors:
+        raise ValidationError(_format_load_errors(errors, num_items))
+    item_type = results[0]['item_type'] if results else 'items'
+    return {DETAIL: '{} {} added'.format(num_items, item_type)}
+
+
+def create_items_in_partitions(task, validated_data, username, task_args,
+                               partition_key):
+    """It splits the items by the given key (institute, study...) and loads
+    every partition in parallel, so the partitions do not contend for the
+    same unique keys"""
+    partitions = partition_staged_items(validated_data, partition_key,
+                                        BULK_PARTITIONS)
+    remove_staged_items(validated_data)
+    header = group(task.s(partition, username, *task_args, return_errors=True)
+                   for partition in partitions)
+    return chord(header)(merge_partition_results_task.s())
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=LONG_PROCESS_TIMEOUT,
              soft_time_limit=LONG_PROCESS_TIMEOUT)
-def create_accessions_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_accession_in_db, 'accessions')
+def create_accessions_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              create_accessions_in_db, 'accessions', **options)
 
 
-@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=LONG_PROCESS_TIMEOUT,
              soft_time_limit=LONG_PROCESS_TIMEOUT)
-def create_accessionsets_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_accessionset_in_db, 'accessionsets')
+def copy_accessions_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              copy_accessions_in_db, 'accessions', **options)
 
 
-@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=LONG_PROCESS_TIMEOUT,
+             soft_time_limit=LONG_PROCESS_TIMEOUT)
+def create_accessionsets_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              create_accessionsets_in_db, 'accessionsets',
+                              **options)
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def create_studies_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_study_in_db, 'studies')
+def create_studies_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_study_in_db),
+                              'studies', **options)
 
 
-@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def create_observation_variables_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_observation_variable_in_db, 'observation_variables')
+def create_observation_variables_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_observation_variable_in_db),
+                              'observation_variables', **options)
 
 
-@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def create_observation_units_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_observation_unit_in_db,
-                              'observation_units')
+def create_observation_units_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_observation_unit_in_db),
+                              'observation_units', **options)
 
 
-@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def create_plants_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_plant_in_db, 'plants')
+def create_plants_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_plant_in_db),
+                              'plants', **options)
 
 
-@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=LONG_PROCESS_TIMEOUT,
              soft_time_limit=LONG_PROCESS_TIMEOUT)
-def create_observations_task(validated_data, username, conf=None):
-    return _create_items_task(validated_data, username,
-                              create_observation_in_db, 'observations', conf)
+def create_observations_task(self, validated_data, username, conf=None, **options):
+    # the lookups are shared by all the chunks of the task
+    create_items = functools.partial(create_observations_in_db, conf=conf,
+                                     lookups=ObservationLookups())
+    return _create_items_task(self, validated_data, username, create_items,
+                              'observations', **options)
+
+
+def _get_zip_member_data(member):
+    # the images are in accession/study directories:
+    # institute_code#germplasm_number/study/image
+    directory_tree = member.filename.split('/')
+    try:
+        study = directory_tree[-2]
+        accession = directory_tree[-3]
+        institute_code, germplasm_number = accession.split('#', 1)
+    except (IndexError, ValueError):
+        raise ValueError("The zip file's Directory tree is wrong!")
+    return {OBSERVATION_STUDY: study, INSTITUTE_CODE: institute_code,
+            GERMPLASM_NUMBER: germplasm_number}
+
+
+def create_observation_images_from_zip(zip_path, user, conf=None,
+                                       report_progress=None):
+    """It creates an observation image for each image in the zip, reading
+    them one by one from the zip into the storage, so the zip is never
+    extracted. Every image is committed on its own"""
+    errors = []
+    num_items = 0
+    with ZipFile(zip_path) as zip_file:
+        members = [member for member in zip_file.infolist()
+                   if not member.is_dir()]
+        # all the paths are checked before anything is created
+        members = [(member, _get_zip_member_data(member))
+                   for member in members]
+        for index, (member, data) in enumerate(members):
+            try:
+                data[IMAGE] = ContentFile(zip_file.read(member),
+                                          name=basename(member.filename))
+                validate_observation_image_data(data, conf)
+                create_observation_image_in_db(data, user, conf)
+                num_items += 1
+            except (ValueError, ObservationImageValidationError,
+                    BadZipFile) as error:
+                errors.append('{}: {}'.format(member.filename, error))
+            if report_progress is not None:
+                report_progress(index + 1, len(members))
+    return num_items, errors
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=LONG_PROCESS_TIMEOUT,
+             soft_time_limit=LONG_PROCESS_TIMEOUT)
+def create_observation_images_from_zip_task(self, zip_path, username,
+                                            conf=None):
 
+    def report_progress(current, total):
+        progress = {'current': current, 'total': total}
+        self.update_state(state=PROGRESS_STATE, meta=progress)
+        register_task_progress(self.request.id, progress)
 
-@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
-             soft_time_limit=LONG_PROCESS_TIMEOUT)
-def create_observation_images_task(validated_data, username, conf=None):
     try:
-        return _create_items_task(validated_data, username,
-                                  create_observation_image_in_db,
-                                  'observation_images', conf)
-    except ValidationError:
-        try:
-            observation_image_cleanup(delete=True)
-        except Exception as error:
-            raise ValidationError(error)
-        raise
+        user = User.objects.get(username=username)
+        num_items, errors = create_observation_images_from_zip(
+            zip_path, user, conf, report_progress=report_progress)
+    except ValueError as error:
+        raise ValidationError(format_error_message(str(error)))
     finally:
-        shutil.rmtree(conf['extraction_dir'])
+        os.remove(zip_path)
 
+    # every failed image has already removed the files it had written
+    if errors:
+        raise ValidationError(format_error_message(errors))
+    return {DETAIL: '{} observation_images added'.format(num_items)}
 
-@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def create_trait_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_trait_in_db, 'traits')
+def create_trait_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_trait_in_db),
+                              'traits', **options)
 
 
-@shared_task
-def create_scale_task(validated_data, username):
-    return _create_items_task(validated_data, username,
-                              create_scale_in_db, 'scales')
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def create_scale_task(self, validated_data, username, **options):
+    return _create_items_task(self, validated_data, username,
+                              _create_items_one_by_one(create_scale_in_db),
+                              'scales', **options)
+
+
+@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+             soft_time_limit=LONG_PROCESS_TIMEOUT)
+def refresh_entity_stats_task(institute_ids=None):
+    # the stats are refreshed by every load, this is the scheduled full
+    # rebuild that fixes the changes done outside the api
+    refresh_entity_stats(institute_ids)
+
+
+@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+             soft_time_limit=LONG_PROCESS_TIMEOUT)
+def export_items_task(view_path, search_params, username, export_format):
+    user = User.objects.get(username=username)
+    artifact_path = export_items(view_path, search_params, user,
+                                 export_format)
+    # the path in the export storage, it is served by the task artifact view
+    return {DETAIL: 'Export finished', 'artifact': artifact_path}
+
+
+@shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
+             soft_time_limit=SHORT_PROCESS_TIMEOUT)
+def remove_expired_exports_task():
+    num_removed = remove_expired_exports()
+    return {DETAIL: '{} expired exports removed'.format(num_removed)}
 
 
 @shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
@@ -193,50 +439,61 @@ def create_tmp_dir(extracted_dir):
 
 def add_task_to_user(user, async_result):
     UserTasks.objects.create(user=user, task_id=async_result.task_id)
+    register_task(async_result.task_id, user=user)
 
 
 @shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def extract_files_from_zip(fpath, extract_dir=None):
-    if not is_zipfile(fpath):
-        raise ValueError('File must be a zip file')
-    if extract_dir is not None:
-        os.mkdir(extract_dir)
-
-    zip_file = ZipFile(fpath)
-    valid_data = []
-    for member in zip_file.filelist:
-        try:
-            # this.method exists strting in python 3.6
-            is_dir = member.is_dir()
-        except AttributeError:
-            is_dir = member.filename.endswith('/')
-
-        if is_dir:
-            continue
-        directory_tree = member.filename.split('/')
-        try:
-            study = directory_tree[-2]
-            accession = directory_tree[-3]
-            institute_code, germplasm_number = accession.split('#', 1)
-        except (IndexError, ValueError):
-            raise ValueError("The zip file's Directory tree is wrong!")
+def delete_image(uid):
+    try:
+        ObservationImage.objects.get(observation_image_uid=uid).delete()
+    except ObservationImage.DoesNotExist:
+        raise ValidationError('Could not find image')
+
+
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True,
+             max_retries=THUMBNAIL_MAX_RETRIES, default_retry_delay=60,
+             time_limit=SHORT_PROCESS_TIMEOUT,
+             soft_time_limit=SHORT_PROCESS_TIMEOUT)
+def create_observation_image_thumbnails_task(self, observation_image_ids):
+    # the images with their thumbnails are skipped, so a retry or a
+    # redelivered task only makes the missing ones
+    failed_ids = []
+    error = None
+    for observation_image in ObservationImage.objects.filter(
+            observation_image_id__in=observation_image_ids):
+        with journal_written_files() as written_files:
+            try:
+                observation_image.create_thumbnails()
+            except (IOError, ValueError) as image_error:
+                remove_unreferenced_files(written_files)
+                logger.warning('Could not create the thumbnails of {}: {}'.format(
+                    observation_image.image.name, image_error))
+                failed_ids.append(observation_image.observation_image_id)
+                error = image_error
+    if failed_ids:
+        raise self.retry(args=[failed_ids], exc=error)
 
-        image_path = zip_file.extract(member, path=extract_dir)
 
-        valid_data.append({'study': study, INSTITUTE_CODE: institute_code,
-                           GERMPLASM_NUMBER: germplasm_number,
-                           'image_path': image_path})
-    return valid_data
+@shared_task(time_limit=LONG_PROCESS_TIMEOUT,
+             soft_time_limit=LONG_PROCESS_TIMEOUT)
+def sweep_orphan_media_files_task():
+    # the failed uploads remove their own files, this scheduled sweep
+    # removes the ones left by the killed workers
+    num_orphans = observation_image_cleanup(delete=True)
+    return {DETAIL: '{} orphan media files removed'.format(num_orphans)}
 
 
 @shared_task(time_limit=SHORT_PROCESS_TIMEOUT,
              soft_time_limit=SHORT_PROCESS_TIMEOUT)
-def delete_image(uid):
-    try:
-        ObservationImage.objects.get(observation_image_uid=uid).delete()
-    except ObservationImage.DoesNotExist:
-        raise ValidationError('Could not find image')
+def remove_expired_task_records_task():
+    num_removed = remove_expired_task_records()
+    return {DETAIL: '{} expired tasks removed'.format(num_removed)}
+
+
+def enqueue_observation_image_thumbnails(observation_image_ids):
+    return create_observation_image_thumbnails_task.apply_async(
+        args=[list(observation_image_ids)], queue=THUMBNAIL_QUEUE)
 
 
 @shared_task
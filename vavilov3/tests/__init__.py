@@ -17,7 +17,9 @@
 #-------------------------------------------------------------------------------
 from os.path import join, dirname, abspath
 
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 
 from rest_framework.test import APIClient as Client
@@ -70,3 +72,17 @@ class BaseTest(TestCase):
 
     def remove_credentials(self):
         self.client.credentials()
+
+    def assert_list_queries_do_not_grow(self, list_url, data=None):
+        # the number of queries needed to serialize a page must not depend
+        # on the number of items in it
+        data = {} if data is None else dict(data)
+        num_queries = []
+        for limit in (1, 100):
+            data['limit'] = limit
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(list_url, data=data)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            num_queries.append(len(context.captured_queries))
+        self.assertGreater(len(response.json()), 1)
+        self.assertEqual(num_queries[0], num_queries[1])
@@ -16,11 +16,20 @@
 #
 #
 
+import gzip
+import json
+import os
 from copy import deepcopy
+from tempfile import TemporaryDirectory
+from unittest.mock import patch, Mock
 
 from os.path import join, abspath, dirname
 
+from celery.exceptions import Retry, SoftTimeLimitExceeded
+
 from django.db import transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 from rest_framework.reverse import reverse
 from rest_framework import status
@@ -35,6 +44,26 @@ from vavilov3.tests.data_io import (load_accessions_from_file,
                                     load_observation_variables_from_file,
                                     load_observations_from_file)
 from vavilov3.data_io import initialize_db
+from vavilov3.views.accession import AccessionViewSet
+from vavilov3.export import (export_items, get_export_storage,
+                             remove_expired_exports, EXCEL_EXPORT)
+from vavilov3.conf.settings import ACCESSION_CSV_FIELDS, BULK_TASK_MAX_RETRIES
+from vavilov3.models import (Accession, Passport, BulkTaskProgress,
+                             AccessionSummary, ObservationVariable,
+                             ACCESSION_DATA, OBSERVATION_VARIABLE_DATA,
+                             _bump_data_versions)
+from vavilov3.tasks import (_create_items_in_chunks, _create_items_task,
+                            merge_partition_results_task,
+                            create_items_in_partitions,
+                            create_accessions_task, export_items_task,
+                            add_task_to_user)
+from vavilov3.staging import (partition_staged_items, iter_staged_items,
+                              count_staged_items, remove_staged_items,
+                              stage_items)
+from vavilov3.serializers.shared import BULK_PARTITION_KEYS
+from vavilov3.entities.observation_variable import observation_variable_registry
+from vavilov3.entities.accession import (create_accessions_in_db,
+                                         copy_accessions_in_db)
 
 from vavilov3.entities.tags import (DATA_SOURCE, GERMPLASM_NUMBER, CONSTATUS,
                                     IS_AVAILABLE, PASSPORTS,
@@ -82,6 +111,52 @@ class AccessionViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 4)
 
+    def test_list_query_count(self):
+        self.add_admin_credentials()
+        list_url = reverse('accession-list')
+        self.assert_list_queries_do_not_grow(list_url)
+        fields = 'instituteCode,germplasmNumber,genera,species,countries'
+        self.assert_list_queries_do_not_grow(list_url, {'fields': fields})
+        self.assert_list_queries_do_not_grow(
+            list_url, {'fields': 'passports,latitude,longitude'})
+
+    def test_cursor_pagination(self):
+        self.add_admin_credentials()
+        list_url = reverse('accession-list')
+        response = self.client.get(list_url, data={'count': 'exact'})
+        num_accessions = int(response['X-Total-Count'])
+        self.assertGreater(num_accessions, 1)
+        self.assertNotIn('X-Total-Count-Estimated', response)
+        germplasm_numbers = sorted(accession['data']['germplasmNumber']
+                                   for accession in response.json())
+
+        def get_link(response, rel):
+            for link in response.get('Link', '').split(', '):
+                if link.endswith('rel="{}"'.format(rel)):
+                    return link.split(';')[0][1:-1]
+
+        response = self.client.get(list_url, data={'cursor': '', 'limit': 1})
+        cursor_numbers = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(int(response['X-Total-Count']), num_accessions)
+            cursor_numbers.extend(accession['data']['germplasmNumber']
+                                  for accession in response.json())
+            next_link = get_link(response, 'next')
+            if next_link is None:
+                break
+            response = self.client.get(next_link)
+        self.assertEqual(cursor_numbers, germplasm_numbers)
+
+        previous_link = get_link(response, 'prev')
+        response = self.client.get(previous_link)
+        self.assertEqual([accession['data']['germplasmNumber']
+                          for accession in response.json()],
+                         germplasm_numbers[-2:-1])
+
+        response = self.client.get(list_url, data={'cursor': 'wrong'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_view_readonly_with_fields(self):
         self.add_admin_credentials()
         detail_url = reverse('accession-detail',
@@ -458,6 +533,18 @@ class AccessionViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 1)
 
+        response = self.client.get(list_url, data={'term': "bge000"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 4)
+
+        response = self.client.get(list_url, data={'site': "cochabamba"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 4)
+
+        response = self.client.get(list_url, data={'site': "valencia"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 0)
+
         response = self.client.get(list_url,
                                    data={'rank': 'genus', 'taxon': 'Zea'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -468,6 +555,40 @@ class AccessionViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 4)
 
+    def test_summary(self):
+        summary = AccessionSummary.objects.get(
+            accession__institute__code='ESP004',
+            accession__germplasm_number='BGE0001')
+        self.assertEqual(summary.genera, ['Solanum'])
+        self.assertEqual(summary.species, ['lycopersicum'])
+        self.assertEqual(summary.countries, ['PER'])
+        self.assertIn('ayacucho', summary.sites_text.lower())
+        self.assertTrue(summary.is_public)
+
+        # updates and deletions keep it in sync
+        self.add_admin_credentials()
+        detail_url = reverse('accession-detail',
+                             kwargs={'institute_code': 'ESP004',
+                                     'germplasm_number': 'BGE0001'})
+        api_data = self.client.get(detail_url).json()
+        api_data['metadata']['is_public'] = False
+        passport = api_data['data'][PASSPORTS][0]
+        passport[COLLECTION_SITE][COUNTRY] = 'ESP'
+        response = self.client.put(detail_url, data=api_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary.refresh_from_db()
+        self.assertEqual(summary.countries, ['ESP'])
+        self.assertFalse(summary.is_public)
+
+        response = self.client.get(reverse('accession-list'),
+                                   data={'fields': 'countries,genera'})
+        countries = [item['data'].get('countries') for item in response.json()]
+        self.assertIn(['ESP'], countries)
+
+        self.client.delete(detail_url)
+        self.assertFalse(AccessionSummary.objects.filter(
+            accession__germplasm_number='BGE0001').exists())
+
 
 class AccessionPermissionsViewTest(BaseTest):
 
@@ -693,7 +814,7 @@ class AccessionCsvTests(BaseTest):
         list_url = reverse('accession-list')
         response = self.client.get(list_url, data={'format': 'csv'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        content = response.content
+        content = b''.join(response.streaming_content)
         aaa = b'PUID,INSTCODE,ACCENUMB,CONSTATUS,IS_AVAILABLE,IN_NUCLEAR_COLLECTION,COLLNUMB'
         bbb = b'ESP004,BGE0001,is_active,True,,,,Solanum,lycopersicum,,var. cera'
         ccc = b'YACUCHO;province:HUAMANGA;municipality:Socos;site:Santa Rosa '
@@ -701,6 +822,292 @@ class AccessionCsvTests(BaseTest):
         for piece in (aaa, bbb, ccc):
             self.assertIn(piece, content)
 
+    def test_csv_by_chunks(self):
+        list_url = reverse('accession-list')
+        response = self.client.get(list_url, data={'format': 'csv'})
+        header, content = b''.join(response.streaming_content).split(b'\r\n', 1)
+        self.assertEqual(header.decode(), ','.join(ACCESSION_CSV_FIELDS))
+
+        with patch.object(AccessionViewSet, 'csv_chunk_size', 1):
+            response = self.client.get(list_url,
+                                       data={'format': 'csv_no_header'})
+            self.assertEqual(b''.join(response.streaming_content), content)
+
+        # the paginated lists are not streamed
+        response = self.client.get(list_url, data={'format': 'csv',
+                                                   'limit': 1})
+        self.assertEqual(len(response.content.splitlines()), 2)
+
+    def test_export(self):
+        view_path = 'vavilov3.views.accession.AccessionViewSet'
+        with TemporaryDirectory() as export_dir, \
+                patch('vavilov3.export.EXPORT_ROOT', export_dir):
+            storage = get_export_storage()
+            artifact = export_items(view_path, {'institute_code': 'ESP004'},
+                                    self.crf_user)
+            with gzip.open(storage.path(artifact), 'rt') as fhand:
+                lines = fhand.read().splitlines()
+            self.assertTrue(lines[0].startswith('PUID,INSTCODE,ACCENUMB'))
+            self.assertTrue(lines[1:])
+            self.assertTrue(all(',ESP004,' in line for line in lines[1:]))
+
+            # the export is reused until the accessions change
+            self.assertEqual(export_items(view_path, {'institute_code': 'ESP004'},
+                                          self.crf_user), artifact)
+            _bump_data_versions([ACCESSION_DATA])
+            new_artifact = export_items(view_path, {'institute_code': 'ESP004'},
+                                        self.crf_user)
+            self.assertNotEqual(new_artifact, artifact)
+            self.assertFalse(storage.exists(artifact))
+
+            artifact = export_items(view_path, {}, self.crf_user,
+                                    EXCEL_EXPORT)
+            self.assertTrue(artifact.endswith('.xlsx'))
+
+            # the exports not used in the retention time are removed
+            os.utime(storage.path(artifact), (0, 0))
+            self.assertEqual(remove_expired_exports(retention=60), 1)
+            self.assertFalse(storage.exists(artifact))
+            self.assertTrue(storage.exists(new_artifact))
+
+            # the artifact is only served to the owner of the task
+            result = export_items_task.apply(
+                args=[view_path, {'institute_code': 'ESP004'}, 'user', 'csv'])
+            add_task_to_user(self.user, result)
+            artifact_url = reverse('task-artifact',
+                                   kwargs={'task_id': result.id})
+            response = self.client.get(artifact_url)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+            self.add_user_credentials()
+            response = self.client.get(reverse('task-detail',
+                                               kwargs={'task_id': result.id}))
+            self.assertTrue(response.json()['artifact'].endswith(artifact_url))
+            response = self.client.get(artifact_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            content = gzip.decompress(b''.join(response.streaming_content))
+            self.assertTrue(content.startswith(b'PUID,INSTCODE,ACCENUMB'))
+            self.remove_credentials()
+
+        response = self.client.post(reverse('accession-export'), data={},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class AccessionBulkCreateTest(BaseTest):
+
+    def setUp(self):
+        self.initialize()
+        initialize_db()
+        institutes_fpath = join(TEST_DATA_DIR, 'institutes.json')
+        load_institutes_from_file(institutes_fpath)
+        accessions_fpath = join(TEST_DATA_DIR, 'accessions.json')
+        with open(accessions_fpath) as fhand:
+            self.accessions = json.load(fhand)
+        for accession in self.accessions:
+            accession['metadata'] = {}
+
+    def test_bulk_create(self):
+        errors = create_accessions_in_db(self.accessions, self.crf_user)
+        self.assertFalse(errors)
+        self.assertEqual(Accession.objects.count(), 4)
+        self.assertEqual(Passport.objects.count(), 4)
+        accession = Accession.objects.get(institute__code='ESP004',
+                                          germplasm_number='BGE0001')
+        self.assertEqual(accession.group.name, 'admin')
+        self.assertFalse(accession.is_public)
+        self.assertEqual(list(accession.genera), ['Solanum'])
+
+        errors = create_accessions_in_db(self.accessions, self.crf_user)
+        self.assertEqual(len(errors), 4)
+        self.assertEqual(errors[0],
+                         'This accession already exists in db: ESP004 BGE0001')
+        self.assertEqual(Accession.objects.count(), 4)
+
+    def test_bulk_create_with_errors(self):
+        accessions = self.accessions + [deepcopy(self.accessions[0])]
+        accessions[1]['data'][INSTITUTE_CODE] = 'FAKE'
+        errors = create_accessions_in_db(accessions, self.crf_user)
+        self.assertEqual(errors,
+                         ['FAKE does not exist in database',
+                          'This accession already exists in db: ESP004 BGE0001'])
+        self.assertEqual(Accession.objects.count(), 0)
+
+    def test_bulk_create_from_unreadable_file(self):
+        self.add_admin_credentials()
+        fhand = SimpleUploadedFile('accessions.csv', b'\xff\xfe\x00not a csv')
+        response = self.client.post(reverse('accession-bulk'),
+                                    data={'file': fhand,
+                                          'data_source_code': 'CRF',
+                                          'data_source_kind': 'genebank'},
+                                    format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Could not read file', str(response.json()))
+
+    def test_chunked_load(self):
+        accessions = self.accessions + [deepcopy(self.accessions[0])]
+        with patch('vavilov3.tasks.BULK_CHUNK_SIZE', 2):
+            num_items, errors = _create_items_in_chunks('task1', accessions,
+                                                        self.crf_user,
+                                                        create_accessions_in_db)
+        # only the last chunk has errors
+        self.assertEqual(num_items, 4)
+        self.assertEqual(errors,
+                         ['This accession already exists in db: ESP004 BGE0001'])
+        self.assertEqual(Accession.objects.count(), 4)
+        self.assertFalse(BulkTaskProgress.objects.filter(task_id='task1').exists())
+
+    def test_chunked_load_with_wrong_item(self):
+        wrong_accession = deepcopy(self.accessions[0])
+        wrong_accession['data'][INSTITUTE_CODE] = 'XXX'
+        accessions = self.accessions[:2] + [wrong_accession] + self.accessions[2:]
+        # the valid items of the chunk with the wrong item are added
+        with patch('vavilov3.tasks.BULK_CHUNK_SIZE', 5):
+            num_items, errors = _create_items_in_chunks('task1', accessions,
+                                                        self.crf_user,
+                                                        create_accessions_in_db)
+        self.assertEqual(num_items, 4)
+        self.assertEqual(errors, ['XXX does not exist in database'])
+        self.assertEqual(Accession.objects.count(), 4)
+
+        # and the failed task tells how many items were added
+        task = Mock()
+        task.request.id = 'task2'
+        task.request.retries = 0
+        wrong_accession['data'][GERMPLASM_NUMBER] = 'BGE0002'
+        staged_items = stage_items([wrong_accession])
+        with self.assertRaises(DjangoValidationError) as context:
+            _create_items_task(task, staged_items, 'admin',
+                               create_accessions_in_db, 'accessions')
+        self.assertEqual(context.exception.message_dict,
+                         {'detail': ['XXX does not exist in database'],
+                          'num_items': ['0']})
+        self.assertFalse(os.path.exists(staged_items))
+
+    def test_resume_chunked_load(self):
+        BulkTaskProgress.objects.create(task_id='task1', committed_chunks=1,
+                                        num_items=2)
+        with patch('vavilov3.tasks.BULK_CHUNK_SIZE', 2):
+            num_items, errors = _create_items_in_chunks('task1',
+                                                        self.accessions,
+                                                        self.crf_user,
+                                                        create_accessions_in_db)
+        self.assertEqual(num_items, 4)
+        self.assertFalse(errors)
+        self.assertEqual(Accession.objects.count(), 2)
+
+    def test_interrupted_load(self):
+        staged_items = stage_items(self.accessions)
+        task = Mock()
+        task.request.id = 'task1'
+        task.request.retries = 0
+        task.retry.side_effect = Retry()
+        created_chunks = []
+
+        def create_items_until_time_limit(items, user):
+            if created_chunks:
+                raise SoftTimeLimitExceeded()
+            created_chunks.append(items)
+            return create_accessions_in_db(items, user)
+
+        # the staged items and the progress are kept for the retry
+        with patch('vavilov3.tasks.BULK_CHUNK_SIZE', 2):
+            with self.assertRaises(Retry):
+                _create_items_task(task, staged_items, 'admin',
+                                   create_items_until_time_limit, 'accessions')
+            self.assertTrue(os.path.exists(staged_items))
+            progress = BulkTaskProgress.objects.get(task_id='task1')
+            self.assertEqual(progress.committed_chunks, 1)
+
+            # that continues after the committed chunk
+            task.request.retries = 1
+            result = _create_items_task(task, staged_items, 'admin',
+                                        create_accessions_in_db, 'accessions')
+        self.assertEqual(result['detail'], '4 accessions added')
+        self.assertEqual(Accession.objects.count(), 4)
+        self.assertFalse(os.path.exists(staged_items))
+        self.assertFalse(BulkTaskProgress.objects.exists())
+
+        # the last retry removes them
+        def create_items_over_time_limit(items, user):
+            raise SoftTimeLimitExceeded()
+        staged_items = stage_items(self.accessions)
+        task.request.retries = BULK_TASK_MAX_RETRIES
+        with self.assertRaises(SoftTimeLimitExceeded):
+            _create_items_task(task, staged_items, 'admin',
+                               create_items_over_time_limit, 'accessions')
+        self.assertFalse(os.path.exists(staged_items))
+        self.assertFalse(BulkTaskProgress.objects.exists())
+
+    def test_partitioned_load(self):
+        partition_key = BULK_PARTITION_KEYS['accession']
+        partitions = partition_staged_items(self.accessions, partition_key, 2)
+        try:
+            institutes_by_partition = []
+            for partition in partitions:
+                institutes = {item['data'][INSTITUTE_CODE]
+                              for item in iter_staged_items(partition)}
+                institutes_by_partition.append(institutes)
+            self.assertEqual(sum(count_staged_items(partition)
+                                 for partition in partitions), 4)
+            self.assertEqual(set.union(*institutes_by_partition),
+                             {'ESP004', 'ESP026', 'ESP058'})
+            self.assertEqual(sum(len(institutes)
+                                 for institutes in institutes_by_partition), 3)
+        finally:
+            for partition in partitions:
+                remove_staged_items(partition)
+
+        results = [{'num_items': 3, 'errors': [], 'item_type': 'accessions'},
+                   {'num_items': 1, 'errors': ['error'], 'item_type': 'accessions'}]
+        with self.assertRaises(DjangoValidationError) as context:
+            merge_partition_results_task(results)
+        self.assertEqual(context.exception.message_dict,
+                         {'detail': ['error'], 'num_items': ['4']})
+        result = merge_partition_results_task(results[:1])
+        self.assertEqual(result, {'detail': '3 accessions added'})
+
+    def test_create_items_in_partitions(self):
+        staged_items = stage_items(self.accessions)
+        partition_key = BULK_PARTITION_KEYS['accession']
+        with patch('vavilov3.tasks.BULK_PARTITIONS', 2), \
+                patch('vavilov3.tasks.chord') as chord:
+            create_items_in_partitions(create_accessions_task, staged_items,
+                                       'admin', (), partition_key)
+        header = chord.call_args[0][0]
+        partitions = [signature.args[0] for signature in header.tasks]
+        try:
+            self.assertTrue(1 <= len(partitions) <= 2)
+            for signature in header.tasks:
+                self.assertEqual(signature.args[1], 'admin')
+                self.assertTrue(signature.kwargs['return_errors'])
+            self.assertEqual(sum(count_staged_items(partition)
+                                 for partition in partitions), 4)
+        finally:
+            for partition in partitions:
+                remove_staged_items(partition)
+        chord.return_value.assert_called_once_with(
+            merge_partition_results_task.s())
+
+    def test_copy_bulk_create(self):
+        errors = copy_accessions_in_db(self.accessions, self.crf_user)
+        self.assertFalse(errors)
+        self.assertEqual(Accession.objects.count(), 4)
+        self.assertEqual(Passport.objects.count(), 4)
+        accession = Accession.objects.get(institute__code='ESP004',
+                                          germplasm_number='BGE0001')
+        self.assertEqual(accession.group.name, 'admin')
+        self.assertEqual(list(accession.genera), ['Solanum'])
+        self.assertEqual(list(accession.countries), ['PER'])
+
+        accessions = self.accessions[:1] + [deepcopy(self.accessions[0])]
+        accessions[1]['data'][INSTITUTE_CODE] = 'FAKE'
+        errors = copy_accessions_in_db(accessions, self.crf_user)
+        self.assertEqual(errors,
+                         ['This accession already exists in db: ESP004 BGE0001',
+                          'FAKE does not exist in database'])
+        self.assertEqual(Accession.objects.count(), 4)
+
 
 class AccessionFilterByObservationsViewTest(BaseTest):
 
@@ -771,6 +1178,30 @@ class AccessionFilterByObservationsViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 1)
 
+    def test_observation_variable_registry(self):
+        variables = observation_variable_registry.variables
+        self.assertIn('Plant size:cm', variables)
+        self.assertEqual(variables['Plant size:cm'][1], 'Numerical')
+        with self.assertNumQueries(0):
+            observation_variable_registry.get('Plant size:cm')
+
+        # the changes of other processes are seen when the version changes
+        ObservationVariable.objects.filter(name='Plant size:cm').update(
+            name='Plant height:cm')
+        with patch.object(observation_variable_registry, '_check_interval', 0):
+            self.assertIsNotNone(observation_variable_registry.get('Plant size:cm'))
+            _bump_data_versions([OBSERVATION_VARIABLE_DATA])
+            self.assertIsNone(observation_variable_registry.get('Plant size:cm'))
+            self.assertIsNotNone(observation_variable_registry.get('Plant height:cm'))
+
+        ObservationVariable.objects.filter(name='Plant height:cm').delete()
+        self.assertIsNone(observation_variable_registry.get('Plant height:cm'))
+        self.add_admin_credentials()
+        response = self.client.get(reverse('accession-list'),
+                                   data={'Plant height:cm__gt': '4'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.json()), 4)
+
 
 class AccessionBulkTooglePublic(BaseTest):
 
@@ -16,7 +16,9 @@
 #
 #
 
+import json
 from os.path import join, abspath, dirname
+from unittest.mock import patch
 
 from django.db import transaction
 
@@ -32,6 +34,8 @@ from vavilov3.tests.data_io import (load_institutes_from_file,
 
 from vavilov3.entities.tags import (INSTITUTE_CODE, GERMPLASM_NUMBER,
                                     ACCESSIONS)
+from vavilov3.entities.accessionset import create_accessionsets_in_db
+from vavilov3.models import AccessionSet
 
 TEST_DATA_DIR = abspath(join(dirname(__file__), 'data', 'jsons'))
 
@@ -64,6 +68,37 @@ class AccessionSetViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 2)
 
+    def test_create_accessionsets_in_db(self):
+        with open(join(TEST_DATA_DIR, 'accessionsets.json')) as fhand:
+            items = json.load(fhand)
+        for index, item in enumerate(items):
+            item['data']['accessionsetNumber'] = 'NEW{}'.format(index)
+            item['metadata'] = {}
+        items.append({'data': {'instituteCode': 'ESP004',
+                               'accessionsetNumber': 'NEW_WRONG',
+                               'accessions': [{'instituteCode': 'ESP004',
+                                               'germplasmNumber': 'FAKE'}]},
+                      'metadata': {}})
+
+        # the stats are refreshed once for all the accessionsets
+        with patch('vavilov3.entities.accessionset.refresh_entity_stats') as refresh:
+            errors = create_accessionsets_in_db(items, self.crf_user)
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(refresh.call_count, 1)
+        institute_ids = set(AccessionSet.objects.filter(
+            accessionset_number__startswith='NEW').values_list('institute_id',
+                                                               flat=True))
+        self.assertEqual(refresh.call_args[0][0], institute_ids)
+        self.assertFalse(AccessionSet.objects.filter(
+            accessionset_number='NEW_WRONG').exists())
+
+    def test_list_query_count(self):
+        self.add_admin_credentials()
+        list_url = reverse('accessionset-list')
+        self.assert_list_queries_do_not_grow(list_url)
+        fields = 'instituteCode,accessions,genera,species,countries,latitudes'
+        self.assert_list_queries_do_not_grow(list_url, {'fields': fields})
+
     def test_view_readonly_with_fields(self):
         self.add_admin_credentials()
         detail_url = reverse('accessionset-detail',
@@ -336,7 +371,7 @@ class AccessionsetCsvTests(BaseTest):
         list_url = reverse('accessionset-list')
         response = self.client.get(list_url, data={'format': 'csv'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        content = response.content
+        content = b''.join(response.streaming_content)
         a = b'INSTCODE,ACCESETNUMB,ACCESSIONS\r\n'
         b = b'ESP004,NC001,ESP004:BGE0001;ESP026:BGE0002\r\n'
 
@@ -105,6 +105,7 @@ class CountryStatsTest(BaseTest):
         load_accessionsets_from_file(accessionsets_fpath)
 
     def test_stats(self):
+        self.add_admin_credentials()
         detail_url = reverse('country-detail', kwargs={'code': 'PER'})
         response = self.client.get(detail_url, data={'fields': 'stats_by_taxa,stats_by_institute'})
         result = response.json()
@@ -17,11 +17,15 @@
 #
 
 from django.test import TestCase
-from os.path import join, abspath, dirname
+from os.path import join, abspath, dirname, exists
 
 from vavilov3.entities.accession import (serialize_accessions_from_excel)
+from vavilov3.excel import tabular_dict_reader
+from vavilov3.staging import (chunks, stage_items, iter_staged_items,
+                              count_staged_items, remove_staged_items)
 
 TEST_DATA_DIR = abspath(join(dirname(__file__), 'data', 'excels'))
+CSV_DATA_DIR = abspath(join(dirname(__file__), 'data', 'csvs'))
 
 
 class DataSourceViewTest(TestCase):
@@ -30,3 +34,36 @@ class DataSourceViewTest(TestCase):
         fpath = join(TEST_DATA_DIR, 'accessions_2019_09_04.xlsx')
         _ = serialize_accessions_from_excel(fpath, 'CRF', 'genebank')
 #         print(accessions)
+
+
+class TabularReaderTest(TestCase):
+
+    def test_excel_and_csv_rows(self):
+        excel_fpath = join(TEST_DATA_DIR, 'accessions.xlsx')
+        csv_fpath = join(CSV_DATA_DIR, 'accessions.csv')
+        for fpath in (excel_fpath, csv_fpath):
+            with open(fpath, 'rb') as fhand:
+                rows = tabular_dict_reader(fhand)
+                first_row = next(rows)
+                self.assertEqual(first_row['INSTCODE'], 'ESP004')
+                self.assertTrue(all(isinstance(value, str)
+                                    for value in first_row.values()))
+                self.assertTrue(list(rows))
+
+
+class StagingTest(TestCase):
+
+    def test_chunks(self):
+        items = (number for number in range(5))
+        self.assertEqual(list(chunks(items, 2)), [[0, 1], [2, 3], [4]])
+
+    def test_stage_items(self):
+        items = [{'data': {'number': number}} for number in range(3)]
+        fpath = stage_items(items)
+        try:
+            self.assertTrue(fpath.endswith('.gz'))
+            self.assertEqual(list(iter_staged_items(fpath)), items)
+            self.assertEqual(count_staged_items(fpath), 3)
+        finally:
+            remove_staged_items(fpath)
+        self.assertFalse(exists(fpath))
@@ -31,6 +31,10 @@ from vavilov3.tests.data_io import (load_institutes_from_file,
                                     assert_error_is_equal)
 
 from vavilov3.data_io import initialize_db
+from vavilov3.models import (Institute, Passport, EntityStats, get_taxa_stats,
+                             invalidate_institute_pdcis, ENTITY_STATS_DATA,
+                             _get_pdcis_data_version_name, _bump_data_versions)
+from vavilov3.entities.stats import refresh_entity_stats
 from vavilov3.conf import settings
 
 TEST_DATA_DIR = abspath(join(dirname(__file__), 'data', 'jsons'))
@@ -270,6 +274,7 @@ class InstituteStatsTest(BaseTest):
         load_accessionsets_from_file(accessionsets_fpath)
 
     def tests_stats(self):
+        self.add_admin_credentials()
         detail_url = reverse('institute-detail', kwargs={'code': 'ESP004'})
         fields = 'instituteCode,name,num_accessions,num_accessionsets,'
         fields += 'stats_by_country,stats_by_taxa,pdcis'
@@ -303,3 +308,82 @@ class InstituteStatsTest(BaseTest):
             self.assertIn(stat_by_country, result_stats_by_country)
 
         self.assertEqual(response_json, result)
+
+    def test_stats_visibility(self):
+        detail_url = reverse('institute-detail', kwargs={'code': 'ESP004'})
+        response = self.client.get(detail_url, data={'fields': 'stats_by_taxa'})
+        self.assertEqual(response.json()['stats_by_taxa']['genus'],
+                         {'Solanum': {'num_accessions': 1,
+                                      'num_accessionsets': 1}})
+
+        # the private accessions of its group are added to the public ones
+        self.add_user_credentials()
+        response = self.client.get(detail_url, data={'fields': 'stats_by_taxa'})
+        self.assertEqual(response.json()['stats_by_taxa']['genus'],
+                         {'Solanum': {'num_accessions': 2,
+                                      'num_accessionsets': 1}})
+
+        self.add_admin_credentials()
+        response = self.client.get(detail_url, data={'fields': 'stats_by_taxa'})
+        self.assertEqual(response.json()['stats_by_taxa']['genus'],
+                         {'Solanum': {'num_accessions': 2,
+                                      'num_accessionsets': 2}})
+
+    def test_pdcis(self):
+        institute = Institute.objects.get(code='ESP004')
+        passports = Passport.objects.filter(institute=institute)
+        pdcis = list(passports.filter(pdci__isnull=False).values_list(
+            'pdci', flat=True))
+        expected = [0] * 20
+        for pdci in pdcis:
+            expected[min(int(pdci * 2), 19)] += 1
+        histogram = institute.pdcis
+        self.assertEqual([edge for edge, _ in histogram],
+                         [index / 2 for index in range(20)])
+        self.assertEqual([count for _, count in histogram], expected)
+
+        list_url = reverse('institute-pdcis')
+        response = self.client.get(list_url,
+                                   data={'code__in': 'ESP004,ESP026'})
+        self.assertEqual(set(response.json().keys()), {'ESP004', 'ESP026'})
+        self.assertEqual(response.json()['ESP004'],
+                         [list(bin_) for bin_ in histogram])
+
+        # it is cached until the passports of the institute change
+        passports.update(pdci=10)
+        self.assertEqual(institute.pdcis, histogram)
+        invalidate_institute_pdcis([institute.institute_id])
+        self.assertEqual(institute.pdcis[-1][1], passports.count())
+
+        # the changes of other processes are seen once they bump the version
+        passports.update(pdci=0)
+        self.assertEqual(institute.pdcis[-1][1], passports.count())
+        _bump_data_versions([_get_pdcis_data_version_name(institute.institute_id)])
+        self.assertEqual(institute.pdcis[0][1], passports.count())
+
+    def test_incremental_stats_refresh(self):
+        institute = Institute.objects.get(code='ESP004')
+        stats_by_country = institute.stats_by_country()
+        stats_by_taxa = institute.stats_by_taxa()
+        taxa_stats = get_taxa_stats()
+        self.assertTrue(stats_by_country)
+
+        # the stats refreshed with every load are the same that a full rebuild
+        refresh_entity_stats()
+        self.assertEqual(institute.stats_by_country(), stats_by_country)
+        self.assertEqual(institute.stats_by_taxa(), stats_by_taxa)
+        self.assertEqual(get_taxa_stats(), taxa_stats)
+
+        Passport.objects.filter(accession__institute=institute).delete()
+        refresh_entity_stats([institute.institute_id])
+        self.assertFalse([stat for stat in institute.stats_by_country()
+                          if stat['num_accessions']])
+        self.assertFalse([stat for taxa in institute.stats_by_taxa().values()
+                          for stat in taxa.values() if stat['num_accessions']])
+
+        # the refreshes of other processes are seen once they bump the version
+        self.assertTrue(get_taxa_stats())
+        EntityStats.objects.all().delete()
+        self.assertTrue(get_taxa_stats())
+        _bump_data_versions([ENTITY_STATS_DATA])
+        self.assertFalse(get_taxa_stats())
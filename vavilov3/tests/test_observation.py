@@ -16,8 +16,11 @@
 #
 #
 
+import io
+import json
 from os.path import join, abspath, dirname
 from copy import deepcopy
+from unittest import skipUnless
 
 from django.db import transaction
 
@@ -35,7 +38,10 @@ from vavilov3.tests.data_io import (assert_error_is_equal,
                                     load_scales_from_file, load_traits_from_file)
 from vavilov3.data_io import initialize_db
 from vavilov3.entities.observation import TRAITS_IN_COLUMNS, \
-    CREATE_OBSERVATION_UNITS
+    CREATE_OBSERVATION_UNITS, create_observations_in_db
+from vavilov3.models import Observation
+from vavilov3.observation_matrix import (is_columnar_export_available,
+                                         get_matrix_column_names)
 
 TEST_DATA_DIR = abspath(join(dirname(__file__), 'data', 'jsons'))
 
@@ -66,6 +72,39 @@ class ObservationViewTest(BaseTest):
         fpath = join(TEST_DATA_DIR, 'observations.json')
         load_observations_from_file(fpath, obs_group='OBS1', user=self.crf_user)
 
+    @skipUnless(is_columnar_export_available(), 'pyarrow is not installed')
+    def test_observation_matrix(self):
+        from pyarrow import ipc, parquet
+        self.add_admin_credentials()
+        matrix_url = reverse('observation-matrix')
+        response = self.client.get(matrix_url, data={'matrix_format': 'arrow'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table = ipc.open_stream(b''.join(response.streaming_content)).read_all()
+
+        num_units = Observation.objects.values('observation_unit').distinct().count()
+        self.assertEqual(table.num_rows, num_units)
+        variables = Observation.objects.values_list('observation_variable__name',
+                                                    flat=True).distinct()
+        self.assertEqual(set(table.column_names[4:]), set(variables))
+        if 'Plant size:cm' in variables:
+            self.assertEqual(str(table.schema.field('Plant size:cm').type),
+                             'double')
+
+        response = self.client.get(matrix_url)
+        content = io.BytesIO(b''.join(response.streaming_content))
+        self.assertEqual(parquet.read_table(content).num_rows, num_units)
+
+        response = self.client.get(matrix_url, data={'matrix_format': 'xls'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_matrix_column_names(self):
+        variables = [(1, 'study', 'Text'), (2, 'variable_study', 'Text'),
+                     (3, 'Plant size:cm', 'Numerical')]
+        self.assertEqual(get_matrix_column_names(variables),
+                         ['observation_unit', 'study', 'institute_code',
+                          'germplasm_number', 'variable_variable_study',
+                          'variable_study', 'Plant size:cm'])
+
     def test_read_only(self):
         list_url = reverse('observation-list')
         response = self.client.get(list_url)
@@ -76,6 +115,13 @@ class ObservationViewTest(BaseTest):
                         'study', 'accession'])
         self.assertSetEqual(set(result[0].keys()), expected)
 
+    def test_list_query_count(self):
+        self.add_admin_credentials()
+        list_url = reverse('observation-list')
+        self.assert_list_queries_do_not_grow(list_url)
+        fields = 'observation_variable,value,value_beauty,study,accession'
+        self.assert_list_queries_do_not_grow(list_url, {'fields': fields})
+
     def test_readonly_with_fields(self):
         edit_url = reverse('observation-list')
         response = self.client.get(edit_url, data={'fields': 'observation_variable'})
@@ -167,6 +213,16 @@ class ObservationViewTest(BaseTest):
             response.json(),
             ['Observation unit non existant does not exist in db'])
 
+        # the numeric values are validated before they are cast
+        api_data['observation_unit'] = 'Plant 2'
+        api_data['observation_variable'] = 'Plant size:cm'
+        api_data['value'] = 'tall'
+        response = self.client.put(detail_url, data=api_data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        assert_error_is_equal(
+            response.json(),
+            ["Not valid value tall for Plant size:cm: could not convert string to float: 'tall'"])
+
     def test_filter(self):
         self.add_admin_credentials()
         list_url = reverse('observation-list')
@@ -186,6 +242,12 @@ class ObservationViewTest(BaseTest):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.json()), 1)
 
+        response = self.client.get(list_url, data={'value_range_min': 'a',
+                                                   'observation_variable': 'Plant size:cm'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        assert_error_is_equal(response.json(),
+                              ['value_range_min filter must be numeric: a'])
+
         response = self.client.get(list_url, data={'value_range_max': '13'})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         assert_error_is_equal(
@@ -472,3 +534,33 @@ class ObservationBulkViewTest(BaseTest):
                                           TRAITS_IN_COLUMNS: True,
                                           CREATE_OBSERVATION_UNITS: 'foreach_observation'})
         print(response.json())
+
+    def test_create_observations_in_db(self):
+        admin = self.crf_user
+        fpath = join(TEST_DATA_DIR, 'observations.json')
+        observations = json.load(open(fpath))['OBS1']
+        errors = create_observations_in_db(observations, admin)
+        self.assertEqual(errors, [])
+        self.assertEqual(Observation.objects.count(), 3)
+        self.assertEqual(
+            sorted(Observation.objects.values_list('value_numeric', flat=True),
+                   key=str),
+            [1.2, 12.0, None])
+
+        # the duplicated rows are reported one by one
+        observation = deepcopy(observations[0])
+        observation['value'] = '13'
+        errors = create_observations_in_db(observations + [observation,
+                                                           observation],
+                                           admin)
+        self.assertEqual(errors, ['This observation already exists in db'] * 4)
+
+        observation['value'] = 'no_numeric'
+        errors = create_observations_in_db([observation], admin)
+        self.assertEqual(errors, ["could not convert string to float: 'no_numeric'"])
+
+        observation['value'] = '14'
+        observation['observation_unit'] = 'fake'
+        errors = create_observations_in_db([observation], admin)
+        self.assertEqual(errors, ['This observation Unit fake does not exist in db'])
+        self.assertEqual(Observation.objects.count(), 3)
@@ -20,6 +20,8 @@ import os
 import tempfile
 import hashlib
 from os.path import join, abspath, dirname
+from zipfile import ZipFile
+from unittest.mock import patch
 
 from django.core.files.base import File
 
@@ -32,9 +34,12 @@ from vavilov3.tests.data_io import (load_accessions_from_file,
                                     load_institutes_from_file,
                                     load_studies_from_file,
                                     load_observation_unit_from_file)
-from vavilov3.models import ObservationUnit, ObservationImage
-from vavilov3.conf.settings import PHENO_IMAGE_DIR
+from vavilov3.models import ObservationUnit, ObservationImage, ImageBlob
+from vavilov3.conf.settings import PHENO_IMAGE_DIR, IMAGE_BLOB_DIR
 from vavilov3.entities.tags import INSTITUTE_CODE, GERMPLASM_NUMBER
+from vavilov3.entities.observation import CREATE_OBSERVATION_UNITS
+from vavilov3.tasks import create_observation_images_from_zip
+from vavilov3.utils import observation_image_cleanup, remove_unreferenced_files
 
 TEST_DATA_DIR = abspath(join(dirname(__file__), 'data'))
 JSONS_DATA_DIR = join(TEST_DATA_DIR, 'jsons')
@@ -68,9 +73,10 @@ class ObservationImageViewTest(BaseTest):
             if index > 5:
                 obs_unit = obs_units[3]
 
-            ObservationImage.objects.create(observation_image_uid=sha256,
-                                            observation_unit=obs_unit,
-                                            image=File(image_fhand))
+            obs_image = ObservationImage.objects.create(observation_image_uid=sha256,
+                                                        observation_unit=obs_unit,
+                                                        image=File(image_fhand))
+            obs_image.create_thumbnails()
 
     def test_model(self):
         with tempfile.TemporaryDirectory() as tmp_dir:
@@ -87,6 +93,25 @@ class ObservationImageViewTest(BaseTest):
                                                  obs_unit.accession.germplasm_number),
                                   obs_unit.study.name)
 
+                # the thumbnails are not created when the image is stored
+                self.assertEqual(len(os.listdir(images_dir)), 1)
+                self.assertFalse(obs_image.image_small)
+
+                self.assertEqual(obs_image.create_thumbnails(),
+                                 ['image_medium', 'image_small'])
+                self.assertEqual(len(os.listdir(images_dir)), 3)
+                obs_image = ObservationImage.objects.get(pk=obs_image.pk)
+                self.assertTrue(os.path.basename(
+                    obs_image.image_small.name).startswith('small_'))
+                self.assertLessEqual(max(obs_image.image_medium.width,
+                                         obs_image.image_medium.height), 600)
+
+                # a retry only creates the missing thumbnails
+                self.assertEqual(obs_image.create_thumbnails(), [])
+                os.remove(obs_image.image_small.path)
+                obs_image.image_small = None
+                obs_image.save()
+                self.assertEqual(obs_image.create_thumbnails(), ['image_small'])
                 self.assertEqual(len(os.listdir(images_dir)), 3)
 
                 obs_image.delete()
@@ -136,6 +161,14 @@ class ObservationImageViewTest(BaseTest):
                 self.assertSetEqual(set(response.json()[0].keys()),
                                     set(['accession', 'study', 'image']))
 
+    def test_list_query_count(self):
+        list_url = reverse('observationimage-list')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.settings(MEDIA_ROOT=tmp_dir):
+                self._upload_photos()
+                self.add_admin_credentials()
+                self.assert_list_queries_do_not_grow(list_url)
+
     def test_create_delete(self):
         list_url = reverse('observationimage-list')
         self.maxDiff = None
@@ -160,11 +193,15 @@ class ObservationImageViewTest(BaseTest):
                             'image_medium': 'tmp/tmp841j5omn/phenotype_images/ESP004-BGE0001/study1/medium_study1_ESP004-BGE0001_4790dde29556601a330df6b17784da5aab389cc8fb590739f466263ef797b9d0.jpg',
                             'image_small': 'tmp/tmp841j5omn/phenotype_images/ESP004-BGE0001/study1/small_study1_ESP004-BGE0001_4790dde29556601a330df6b17784da5aab389cc8fb590739f466263ef797b9d0.jpg',
                             'study': 'study1', 'accession': {'instituteCode': 'ESP004', 'germplasmNumber': 'BGE0001'}}
+                # the thumbnails are created by other task
+                expected.pop('image_medium')
+                expected.pop('image_small')
                 self.assertSetEqual(set(response.json().keys()), set(expected.keys()))
 
-                images_dir = join(tmp_dir, PHENO_IMAGE_DIR,
-                                  '{}-{}'.format('ESP004', 'BGE0001'), 'study1')
-                self.assertEqual(len(os.listdir(images_dir)), 3)
+                # the image is stored by its content
+                images_dir = join(tmp_dir, PHENO_IMAGE_DIR, IMAGE_BLOB_DIR,
+                                  '47')
+                self.assertEqual(len(os.listdir(images_dir)), 1)
                 return
                 detail_url = reverse('observationimage-detail',
                                      kwargs={'observation_image_uid': '4790dde29556601a330df6b17784da5aab389cc8fb590739f466263ef797b9d0'})
@@ -173,3 +210,123 @@ class ObservationImageViewTest(BaseTest):
                 self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
                 self.assertEqual(len(os.listdir(images_dir)), 0)
+
+    def test_zip_ingestion(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.settings(MEDIA_ROOT=tmp_dir):
+                zip_path = join(tmp_dir, 'images.zip')
+                with ZipFile(zip_path, 'w') as zip_file:
+                    for photo in ('photo1.JPG', 'photo2.JPG', 'photo1.JPG'):
+                        zip_file.write(join(TEST_DATA_DIR, 'images', photo),
+                                       'ESP004#BGE0001/study1/{}'.format(photo))
+                progress = []
+                conf = {CREATE_OBSERVATION_UNITS: 'foreach_observation'}
+                num_items, errors = create_observation_images_from_zip(
+                    zip_path, self.crf_user, conf,
+                    report_progress=lambda *args: progress.append(args))
+                self.assertEqual(num_items, 2)
+                self.assertEqual(len(errors), 1)
+                self.assertIn('already exists', errors[0])
+                self.assertEqual(progress, [(1, 3), (2, 3), (3, 3)])
+                self.assertEqual(ImageBlob.objects.count(), 2)
+                for blob in ImageBlob.objects.all():
+                    self.assertTrue(os.path.exists(blob.image.path))
+
+                with ZipFile(zip_path, 'w') as zip_file:
+                    zip_file.write(join(TEST_DATA_DIR, 'images', 'photo3.JPG'),
+                                   'photo3.JPG')
+                with self.assertRaises(ValueError):
+                    create_observation_images_from_zip(zip_path, self.crf_user,
+                                                       conf)
+
+    def test_image_deduplication(self):
+        list_url = reverse('observationimage-list')
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.settings(MEDIA_ROOT=tmp_dir):
+                self.add_admin_credentials()
+                uids = []
+                for study in ('study1', 'study2'):
+                    with open(join(TEST_DATA_DIR, 'images', 'photo1.JPG'),
+                              mode='rb') as photo1_fhand:
+                        response = self.client.post(
+                            list_url, data={'image': photo1_fhand,
+                                            'study': study,
+                                            INSTITUTE_CODE: 'ESP004',
+                                            GERMPLASM_NUMBER: 'BGE0001'},
+                            format='multipart')
+                    self.assertEqual(response.status_code,
+                                     status.HTTP_201_CREATED)
+                    uids.append(response.json()['observation_image_uid'])
+
+                # both images share the stored content
+                self.assertNotEqual(uids[0], uids[1])
+                blob = ImageBlob.objects.get()
+                self.assertEqual(blob.num_references, 2)
+                images = ObservationImage.objects.filter(
+                    observation_image_uid__in=uids)
+                self.assertEqual({image.image.name for image in images},
+                                 {blob.image.name})
+
+                # the thumbnails of the blob are reused
+                ObservationImage.objects.get(
+                    observation_image_uid=uids[0]).create_thumbnails()
+                self.assertTrue(ImageBlob.objects.get().image_small)
+                image = ObservationImage.objects.get(observation_image_uid=uids[1])
+                self.assertEqual(image.create_thumbnails(),
+                                 ['image_medium', 'image_small'])
+
+                # the images created with the digest as uid are also found
+                ObservationImage.objects.filter(
+                    observation_image_uid=uids[0]).update(
+                        observation_image_uid=blob.digest)
+                uids[0] = blob.digest
+                zip_path = join(tmp_dir, 'images.zip')
+                with ZipFile(zip_path, 'w') as zip_file:
+                    zip_file.write(join(TEST_DATA_DIR, 'images', 'photo1.JPG'),
+                                   'ESP004#BGE0001/study1/photo1.JPG')
+                conf = {CREATE_OBSERVATION_UNITS: 'foreach_observation'}
+                num_items, errors = create_observation_images_from_zip(
+                    zip_path, self.crf_user, conf)
+                self.assertEqual(num_items, 0)
+                self.assertIn('already exists', errors[0])
+
+                # the blob is removed with its last reference
+                ObservationImage.objects.get(observation_image_uid=uids[0]).delete()
+                self.assertEqual(ImageBlob.objects.get().num_references, 1)
+                ObservationImage.objects.get(observation_image_uid=uids[1]).delete()
+                self.assertFalse(ImageBlob.objects.exists())
+
+    def test_orphan_media_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.settings(MEDIA_ROOT=tmp_dir):
+                self._upload_photos()
+                images_dir = join(tmp_dir, PHENO_IMAGE_DIR, 'orphans')
+                os.mkdir(images_dir)
+                for fname in ('old.jpg', 'new.jpg'):
+                    with open(join(images_dir, fname), 'w') as fhand:
+                        fhand.write('orphan')
+                os.utime(join(images_dir, 'old.jpg'), (0, 0))
+
+                # the recent files could be of an upload not committed yet
+                with patch('builtins.print'):
+                    self.assertEqual(observation_image_cleanup(chunk_size=3), 1)
+                self.assertEqual(observation_image_cleanup(delete=True,
+                                                           chunk_size=3), 1)
+                self.assertEqual(os.listdir(images_dir), ['new.jpg'])
+                self.assertEqual(observation_image_cleanup(delete=True,
+                                                           grace_period=-60), 1)
+                self.assertFalse(os.path.exists(images_dir))
+                for image in ObservationImage.objects.all():
+                    self.assertTrue(os.path.exists(image.image.path))
+                    self.assertTrue(os.path.exists(image.image_small.path))
+
+                # a failed writer only removes its unreferenced files
+                image = ObservationImage.objects.first()
+                orphan = join(PHENO_IMAGE_DIR, 'orphan.jpg')
+                with open(join(tmp_dir, orphan), 'w') as fhand:
+                    fhand.write('orphan')
+                self.assertEqual(remove_unreferenced_files([image.image.name,
+                                                            orphan]),
+                                 [orphan])
+                self.assertTrue(os.path.exists(image.image.path))
+                self.assertFalse(os.path.exists(join(tmp_dir, orphan)))
@@ -70,6 +70,13 @@ class ObservationUnitViewTest(BaseTest):
         if fail:
             raise AssertionError()
 
+    def test_list_query_count(self):
+        self.add_admin_credentials()
+        list_url = reverse('observationunit-list')
+        self.assert_list_queries_do_not_grow(list_url)
+        self.assert_list_queries_do_not_grow(list_url,
+                                             {'fields': 'name,accession,plants'})
+
     def test_readonly_with_fields(self):
         edit_url = reverse('observationunit-detail', kwargs={'name': 'Plant 1'})
         response = self.client.get(edit_url, data={'fields': 'name'})
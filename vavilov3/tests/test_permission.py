@@ -22,7 +22,9 @@ from unittest.mock import MagicMock
 
 from django.contrib.auth.models import AnonymousUser
 
-from vavilov3.permissions import UserGroupObjectPublicPermission
+from vavilov3.permissions import (UserGroupObjectPublicPermission,
+                                  get_permission_context,
+                                  clear_permission_context, is_user_admin)
 
 
 class PermissionsTest(unittest.TestCase):
@@ -35,8 +37,15 @@ class PermissionsTest(unittest.TestCase):
                      user_groups=[], anonUser=False,
                      request_data_is_public=False):
         obj = MagicMock(owner=obj_owner, is_public=obj_is_public)
-        request = MagicMock(user=MagicMock(is_staff=user_is_staff,
-                                           token={'groups': user_groups}),
+        obj.group.name = obj_owner
+        groups = []
+        for index, group_name in enumerate(user_groups):
+            group = MagicMock(id=index)
+            group.name = group_name
+            groups.append(group)
+        user = MagicMock(is_staff=user_is_staff, token={'groups': user_groups})
+        user.groups.order_by.return_value = groups
+        request = MagicMock(user=user,
                             data={'metadata': {'is_public': request_data_is_public}})
         if anonUser:
             request.user = AnonymousUser()
@@ -114,6 +123,26 @@ class PermissionsTest(unittest.TestCase):
             self.assertFalse(self.permisions.has_object_permission(*mocks),
                              mocks)
 
+    def test_permission_context_is_cached(self):
+        request, _, obj = self.set_up_mocks(obj_owner='COMAV',
+                                            obj_is_public=False,
+                                            action='retrieve',
+                                            user_is_staff=False,
+                                            user_groups=['COMAV'])
+        context = get_permission_context(request.user)
+        self.assertFalse(context.is_admin)
+        self.assertTrue(context.belongs_to(obj.group))
+        self.assertTrue(context.belongs_to('COMAV'))
+        self.assertFalse(context.belongs_to('CRF'))
+        self.assertFalse(is_user_admin(request.user))
+        self.assertIs(get_permission_context(request.user), context)
+        self.assertEqual(request.user.groups.order_by.call_count, 1)
+
+        clear_permission_context(request.user)
+        self.assertIsNot(get_permission_context(request.user), context)
+
+        self.assertFalse(get_permission_context(AnonymousUser()).groups)
+
 
 if __name__ == "__main__":
     # import sys;sys.argv = ['', 'Test.testName']
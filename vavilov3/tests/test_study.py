@@ -470,7 +470,7 @@ class StudyCsvViewTest(BaseTest):
         list_url = reverse('study-list')
         response = self.client.get(list_url, data={'format': 'csv'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        content = response.content
+        content = b''.join(response.streaming_content)
         a = b'NAME,DESCRIPTION,START_DATE,END_DATE,LOCATION,CONTACT,PROJECT_NAME\r\n'
         b = b'study1,description1,2017-01-17,2018-12-01,Valencia,Alguien,\r\n'
         c = b'study3,description3,2019-01-17,2019-12-01,Valencia,Alguien,\r\n'
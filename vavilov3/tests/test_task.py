@@ -0,0 +1,97 @@
+#
+# Copyright (C) 2019 P.Ziarsolo
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#
+
+from datetime import timedelta
+from unittest.mock import Mock
+
+from django.utils import timezone
+
+from rest_framework.reverse import reverse
+from rest_framework import status
+
+from vavilov3.tests import BaseTest
+from vavilov3.models import TaskRecord, UserTasks
+from vavilov3.tasks import add_task_to_user, merge_partition_results_task
+from vavilov3.entities.task_record import (register_task_published,
+                                           register_task_progress,
+                                           remove_expired_task_records)
+
+
+class TaskViewTest(BaseTest):
+
+    def setUp(self):
+        self.initialize()
+
+    def test_task_registry(self):
+        # the registry is filled by the celery signals
+        result = merge_partition_results_task.apply(
+            args=[[{'num_items': 2, 'errors': [], 'item_type': 'accessions'}]])
+        add_task_to_user(self.user, result)
+        record = TaskRecord.objects.get(task_id=result.id)
+        self.assertEqual(record.status, 'SUCCESS')
+        self.assertEqual(record.user, self.user)
+        self.assertIsNotNone(record.date_done)
+
+        result = merge_partition_results_task.apply(
+            args=[[{'num_items': 2, 'errors': ['wrong'], 'item_type': 'accessions'}]])
+        add_task_to_user(self.crf_user, result)
+        self.assertEqual(TaskRecord.objects.get(task_id=result.id).status,
+                         'FAILURE')
+
+        register_task_published('task3', 'vavilov3.tasks.create_observation_images_from_zip_task')
+        add_task_to_user(self.user, Mock(task_id='task3'))
+        register_task_progress('task3', {'current': 1, 'total': 3})
+        # the internal tasks have no owner
+        register_task_published('task4', 'vavilov3.tasks.create_observation_image_thumbnails_task')
+
+        list_url = reverse('task-list')
+        response = self.client.get(list_url)
+        self.assertEqual(response.json(), [])
+
+        self.add_user_credentials()
+        response = self.client.get(list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tasks = response.json()
+        self.assertEqual([task['status'] for task in tasks],
+                         ['PROGRESS', 'SUCCESS'])
+        self.assertEqual(tasks[0]['progress'], {'current': 1, 'total': 3})
+        self.assertEqual(tasks[1]['result'], '2 accessions added')
+        self.assertEqual(tasks[1]['owner'], 'user')
+
+        response = self.client.get(list_url, data={'limit': 1})
+        self.assertEqual(len(response.json()), 1)
+        self.assertEqual(response['X-Total-Count'], '2')
+
+        detail_url = reverse('task-detail', kwargs={'task_id': 'task3'})
+        response = self.client.get(detail_url)
+        self.assertEqual(response.json()['name'],
+                         'Create Observation Images From Zip Task')
+
+        self.add_admin_credentials()
+        response = self.client.get(list_url)
+        self.assertEqual(len(response.json()), 3)
+
+        # the tasks without owner are removed before the ones of the users
+        remove_expired_task_records()
+        self.assertEqual(TaskRecord.objects.count(), 4)
+        TaskRecord.objects.update(date_created=timezone.now() - timedelta(days=2))
+        self.assertEqual(remove_expired_task_records(), 1)
+        self.assertFalse(TaskRecord.objects.filter(task_id='task4').exists())
+        self.assertEqual(remove_expired_task_records(retention=24 * 60 * 60), 3)
+        self.assertFalse(TaskRecord.objects.exists())
+        self.assertFalse(UserTasks.objects.exists())
@@ -41,11 +41,18 @@ class TaxaStatsTest(BaseTest):
         load_accessionsets_from_file(accessionsets_fpath)
 
     def tests_stats(self):
+        self.add_admin_credentials()
         stats_url = reverse('taxon-stats-by-rank')
         response = self.client.get(stats_url)
         result = {'species': {'Solanum lycopersicum': {'num_accessions': 4, 'num_accessionsets': 2}}, 'variety': {'Solanum lycopersicum var. cerasiforme': {'num_accessions': 4, 'num_accessionsets': 2}}, 'genus': {'Solanum': {'num_accessions': 4, 'num_accessionsets': 2}}}
         assert result == response.json()
 
+        # anonymous users only count the public ones
+        self.remove_credentials()
+        response = self.client.get(stats_url)
+        self.assertEqual(response.json()['genus'],
+                         {'Solanum': {'num_accessions': 2, 'num_accessionsets': 1}})
+
     def test_view_readonly(self):
         list_url = reverse('taxon-list')
         response = self.client.get(list_url)
@@ -18,49 +18,117 @@
 
 import os
 import socket
+import time
 
 from django.conf import settings
+from django.db import connection
+from django.core.files.storage import default_storage
 
-from vavilov3.models import ObservationImage
+from vavilov3.models import ImageBlob
+from vavilov3.staging import chunks
+from vavilov3.raw_media_sql_commands import (SORTED_MEDIA_FILE_NAMES,
+                                             REFERENCED_MEDIA_FILE_NAMES)
+from vavilov3.conf.settings import (PHENO_IMAGE_DIR, MEDIA_SWEEP_CHUNK_SIZE,
+                                    MEDIA_SWEEP_GRACE_PERIOD)
 
 
-def observation_image_cleanup(delete=False):
-    physical_files = set()
-    db_files = set()
+def remove_unreferenced_files(names):
+    '''It removes the given media files that no row references, it is used
+    with the journal of the written files when the writer fails'''
+    if not names:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(REFERENCED_MEDIA_FILE_NAMES, {'names': list(names)})
+        referenced = {row[0] for row in cursor.fetchall()}
+    removed = []
+    for name in names:
+        if name not in referenced:
+            default_storage.delete(name)
+            removed.append(name)
+    return removed
 
-    # Get all files from the database
-    for field in ['image', 'image_medium', 'image_small']:
-        files = ObservationImage.objects.all().values_list(field, flat=True)
-        db_files.update(files)
 
-    # Get all files from the MEDIA_ROOT, recursively
+def _get_media_entry_sort_key(entry):
+    # the directory content goes after the files with the same prefix, as
+    # it does in the sorted paths
+    return entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name
+
+
+def iter_sorted_media_files(dir_path, media_root):
+    '''It yields the files of the dir, and their modification times, sorted
+    by their path relative to the media root. Only a dir listing is in
+    memory at a time'''
+    entries = sorted(os.scandir(dir_path), key=_get_media_entry_sort_key)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from iter_sorted_media_files(entry.path, media_root)
+        else:
+            name = os.path.relpath(entry.path, media_root).replace(os.sep, '/')
+            yield name, entry.stat(follow_symlinks=False).st_mtime
+
+
+def iter_sorted_db_media_files(chunk_size=MEDIA_SWEEP_CHUNK_SIZE):
+    # a server side cursor, the database sorts and we read it by chunks
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(SORTED_MEDIA_FILE_NAMES)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row[0]
+
+
+def iter_orphan_media_files(media_root, grace_period=MEDIA_SWEEP_GRACE_PERIOD,
+                            chunk_size=MEDIA_SWEEP_CHUNK_SIZE):
+    '''It merges the sorted storage and database listings and yields the
+    stored files that are not in the database.
+
+    The recent files are skipped, their rows could not be committed yet'''
+    images_dir = os.path.join(media_root, PHENO_IMAGE_DIR)
+    if not os.path.isdir(images_dir):
+        return
+    max_mtime = time.time() - grace_period
+    db_names = iter_sorted_db_media_files(chunk_size)
+    db_name = next(db_names, None)
+    for name, mtime in iter_sorted_media_files(images_dir, media_root):
+        while db_name is not None and db_name < name:
+            db_name = next(db_names, None)
+        if name != db_name and mtime < max_mtime:
+            yield name
+
+
+def observation_image_cleanup(delete=False, grace_period=MEDIA_SWEEP_GRACE_PERIOD,
+                              chunk_size=MEDIA_SWEEP_CHUNK_SIZE):
     media_root = getattr(settings, 'MEDIA_ROOT', None)
-    if media_root is not None:
-        for relative_root, dirs, files in os.walk(media_root):
-            for file_ in files:
-                # Compute the relative file path to the media directory, so it can be compared to the values from the db
-                relative_file = os.path.join(os.path.relpath(relative_root, media_root), file_)
-                physical_files.add(relative_file)
-
-    # Compute the difference and delete those files
-    deletables = physical_files - db_files
-    if deletables:
-        for file_ in deletables:
+    if media_root is None:
+        return 0
+
+    # the blobs without images are from interrupted uploads
+    if delete:
+        for blob in ImageBlob.objects.filter(num_references__lte=0):
+            blob.delete()
+
+    num_orphans = 0
+    orphans = iter_orphan_media_files(media_root, grace_period=grace_period,
+                                      chunk_size=chunk_size)
+    for names in chunks(orphans, chunk_size):
+        num_orphans += len(names)
+        for name in names:
             if delete:
-                os.remove(os.path.join(media_root, file_))
+                os.remove(os.path.join(media_root, name))
             else:
-                print(os.path.join(media_root, file_))
-            #
+                print(os.path.join(media_root, name))
 
-        # Bottom-up - delete all empty folders
-        for relative_root, dirs, files in os.walk(media_root, topdown=False):
+    # Bottom-up - delete all empty folders
+    if delete and num_orphans:
+        for relative_root, dirs, files in os.walk(os.path.join(media_root,
+                                                               PHENO_IMAGE_DIR),
+                                                  topdown=False):
             for dir_ in dirs:
                 if not os.listdir(os.path.join(relative_root, dir_)):
-                    if delete:
-                        os.rmdir(os.path.join(relative_root, dir_))
-                    else:
-                        print(os.path.join(relative_root, dir_))
-                    # os.rmdir(os.path.join(relative_root, dir_))
+                    os.rmdir(os.path.join(relative_root, dir_))
+    return num_orphans
 
 
 def get_host_ip():
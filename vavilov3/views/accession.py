@@ -25,7 +25,9 @@ from rest_framework.exceptions import ValidationError
 
 from django_filters.rest_framework.backends import DjangoFilterBackend
 
-from vavilov3.models import Accession, Observation
+from vavilov3.models import (Accession, AccessionSet, Observation,
+                             invalidate_institute_pdcis, bump_data_versions,
+                             ACCESSION_DATA, ACCESSIONSET_DATA)
 from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    StandardResultsSetPagination,
                                    MultipleFieldLookupMixin,
@@ -33,15 +35,25 @@ from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    TooglePublicMixim,
                                    OptionalStreamedListCsvMixin,
                                    ListModelMixinWithErrorCheck,
-                                   CheckBeforeRemoveMixim)
+                                   CheckBeforeRemoveMixim,
+                                   ExportMixin,
+                                   validate_and_stage_items,
+                                   create_from_staged_items)
 from vavilov3.serializers.accession import AccessionSerializer
 from vavilov3.filters.accession import AccessionFilter
 from vavilov3.permissions import UserGroupObjectPublicPermission
 from vavilov3.entities.accession import (AccessionStruct,
                                          AccessionValidationError,
-                                         serialize_accessions_from_excel)
+                                         iter_accessions_from_rows,
+                                         INGESTION_MODE, INGESTION_MODES,
+                                         ORM_INGESTION_MODE,
+                                         plan_accession_queryset,
+                                         sync_accession_summary_permissions)
+from vavilov3.entities.stats import refresh_entity_stats
+from vavilov3.raw_stat_sql_commands import ACCESSION_STATS
 from vavilov3.conf.settings import ACCESSION_CSV_FIELDS
 from vavilov3.views import format_error_message
+from vavilov3.excel import tabular_dict_reader
 from vavilov3.filters.accession_observation_filter_backend import AccessionByObservationFilterBackend
 
 
@@ -62,21 +74,26 @@ class AccessionCSVRendererNoHeader(AccessionCSVRenderer):
 
 class AccessionViewSet(MultipleFieldLookupMixin, GroupObjectPublicPermMixin,
                        DynamicFieldsViewMixin, TooglePublicMixim,
+                       ExportMixin, OptionalStreamedListCsvMixin,
                        ListModelMixinWithErrorCheck,
-                       CheckBeforeRemoveMixim, viewsets.ModelViewSet,
-                       OptionalStreamedListCsvMixin):
+                       CheckBeforeRemoveMixim, viewsets.ModelViewSet):
     lookup_fields = ('institute_code', 'germplasm_number')
     lookup_url_kwarg = 'institute_code>[^/]+):(?P<germplasm_number'
     lookup_value_regex = '[^/]+'
     filter_foreignkey_mapping = {'institute_code': 'institute__code'}
     queryset = Accession.objects.all().order_by('germplasm_number')
+    queryset_planner = staticmethod(plan_accession_queryset)
     serializer_class = AccessionSerializer
     filter_class = AccessionFilter
     filter_backends = (AccessionByObservationFilterBackend, DjangoFilterBackend)
     permission_classes = (UserGroupObjectPublicPermission,)
     pagination_class = StandardResultsSetPagination
+    cursor_ordering = ('germplasm_number', 'accession_id')
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
         [AccessionCSVRenderer, AccessionCSVRendererNoHeader]
+    Struct = AccessionStruct
+    csv_fields = ACCESSION_CSV_FIELDS
+    export_data_versions = (ACCESSION_DATA,)
     ordering_fields = ('code', 'institute_code')
     ordering = ('-germplasm_number',)
 
@@ -93,11 +110,31 @@ class AccessionViewSet(MultipleFieldLookupMixin, GroupObjectPublicPermMixin,
             except KeyError:
                 msg = 'Could not found excel file or data_store info'
                 raise ValidationError(msg)
+            ingestion_mode = request.data.get(INGESTION_MODE,
+                                              ORM_INGESTION_MODE)
+            if ingestion_mode not in INGESTION_MODES:
+                msg = 'ingestion mode must be one of: {}'
+                msg = msg.format(', '.join(INGESTION_MODES))
+                raise ValidationError(format_error_message(msg))
+            self.conf = {INGESTION_MODE: ingestion_mode}
             try:
-                data = serialize_accessions_from_excel(fhand, data_source_code,
-                                                       data_source_kind)
+                rows = tabular_dict_reader(fhand)
+                documents = iter_accessions_from_rows(rows, data_source_code,
+                                                      data_source_kind)
+                staged_items = validate_and_stage_items(self, documents)
             except AccessionValidationError as error:
                 raise ValidationError(format_error_message(error))
+            except ValidationError as errors:
+                errors = [error for error in errors.detail if error]
+                raise ValidationError(errors)
+            except ValueError as error:
+                msg = 'Could not read file: {}'.format(error)
+                raise ValidationError(format_error_message(msg))
+
+            if action == 'POST':
+                async_result = create_from_staged_items(self, staged_items)
+                return Response({'task_id': async_result.id},
+                                status=status.HTTP_200_OK, headers={})
         else:
             data = request.data
         # prev_time = calc_duration('csv to json', prev_time)
@@ -116,6 +153,35 @@ class AccessionViewSet(MultipleFieldLookupMixin, GroupObjectPublicPermMixin,
             return Response({'task_id': serializer.instance.id},
                             status=status.HTTP_200_OK, headers={})
 
+    def toggle_public_items(self, queryset, is_public):
+        institute_ids = list(queryset.values_list('institute_id',
+                                                  flat=True).distinct())
+        super().toggle_public_items(queryset, is_public)
+        sync_accession_summary_permissions()
+        refresh_entity_stats(institute_ids, entity_types=(ACCESSION_STATS,))
+        bump_data_versions(ACCESSION_DATA)
+
+    def perform_destroy(self, instance):
+        institute_ids = [instance.institute_id]
+        institute_ids.extend(AccessionSet.objects.filter(
+            accessions=instance).values_list('institute_id', flat=True))
+        passport_institute_ids = list(instance.passports.values_list(
+            'institute_id', flat=True))
+        super().perform_destroy(instance)
+        refresh_entity_stats(institute_ids)
+        invalidate_institute_pdcis(passport_institute_ids)
+        bump_data_versions(ACCESSION_DATA, ACCESSIONSET_DATA)
+
+    _conf = None
+
+    @property
+    def conf(self):
+        return self._conf
+
+    @conf.setter
+    def conf(self, conf):
+        self._conf = conf
+
     def check_before_remove(self, instance):
         if Observation.objects.filter(observation_unit__accession=instance).count():
             msg = 'Can not delete this accession because there are observations'
@@ -26,13 +26,17 @@ from vavilov3.views.shared import (GroupObjectPublicPermMixin,
                                    MultipleFieldLookupMixin,
                                    BulkOperationsMixin, TooglePublicMixim,
                                    OptionalStreamedListCsvMixin,
-                                   ListModelMixinWithErrorCheck)
-from vavilov3.models import AccessionSet
+                                   ListModelMixinWithErrorCheck,
+                                   ExportMixin)
+from vavilov3.models import AccessionSet, bump_data_versions, ACCESSIONSET_DATA
 from vavilov3.permissions import UserGroupObjectPublicPermission
 from vavilov3.serializers.accessionset import AccessionSetSerializer
 from vavilov3.filters.accessionset import AccessionSetFilter
 from vavilov3.conf.settings import ACCESSIONSET_CSV_FIELDS
-from vavilov3.entities.accessionset import AccessionSetStruct
+from vavilov3.entities.stats import refresh_entity_stats
+from vavilov3.raw_stat_sql_commands import ACCESSIONSET_STATS
+from vavilov3.entities.accessionset import (AccessionSetStruct,
+                                            plan_accessionset_queryset)
 
 
 class AccessionSetCSVRenderer(renderers.CSVStreamingRenderer):
@@ -51,14 +55,15 @@ class AccessionSetCSVRendererNoHeader(AccessionSetCSVRenderer):
 
 class AccessionSetViewSet(MultipleFieldLookupMixin, GroupObjectPublicPermMixin,
                           BulkOperationsMixin, DynamicFieldsViewMixin,
+                          ExportMixin, OptionalStreamedListCsvMixin,
                           ListModelMixinWithErrorCheck,
-                          TooglePublicMixim, viewsets.ModelViewSet,
-                          OptionalStreamedListCsvMixin):
+                          TooglePublicMixim, viewsets.ModelViewSet):
     lookup_fields = ('institute_code', 'accessionset_number')
     lookup_url_kwarg = 'institute_code>[^/]+):(?P<accessionset_number'
     lookup_value_regex = '[^/]+'
     filter_foreignkey_mapping = {'institute_code': 'institute__code'}
     queryset = AccessionSet.objects.all().order_by('accessionset_number')
+    queryset_planner = staticmethod(plan_accessionset_queryset)
     serializer_class = AccessionSetSerializer
     filter_class = AccessionSetFilter
     permission_classes = (UserGroupObjectPublicPermission,)
@@ -66,3 +71,19 @@ class AccessionSetViewSet(MultipleFieldLookupMixin, GroupObjectPublicPermMixin,
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
         [AccessionSetCSVRenderer, AccessionSetCSVRendererNoHeader]
     Struct = AccessionSetStruct
+    csv_fields = ACCESSIONSET_CSV_FIELDS
+    export_data_versions = (ACCESSIONSET_DATA,)
+
+    def toggle_public_items(self, queryset, is_public):
+        institute_ids = list(queryset.values_list('institute_id',
+                                                  flat=True).distinct())
+        super().toggle_public_items(queryset, is_public)
+        refresh_entity_stats(institute_ids,
+                             entity_types=(ACCESSIONSET_STATS,))
+        bump_data_versions(ACCESSIONSET_DATA)
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        refresh_entity_stats([instance.institute_id],
+                             entity_types=(ACCESSIONSET_STATS,))
+        bump_data_versions(ACCESSIONSET_DATA)
@@ -19,8 +19,9 @@
 from django.db.models.aggregates import Count
 
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 
-from vavilov3.models import Institute, Accession
+from vavilov3.models import Institute, Accession, get_institutes_pdcis
 from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    StandardResultsSetPagination,
                                    BulkOperationsMixin,
@@ -53,6 +54,14 @@ class InstituteViewSet(DynamicFieldsViewMixin,
         return self.queryset.annotate(by_num_accessions=Count('accession', distinct=True),
                                       by_num_accessionsets=Count('accession__accessionset', distinct=True))
 
+    @action(methods=['GET'], detail=False)
+    def pdcis(self, request):
+        queryset = self.filter_queryset(self.queryset.all())
+        codes = dict(queryset.values_list('institute_id', 'code'))
+        pdcis = get_institutes_pdcis(codes)
+        return Response({codes[institute_id]: pdci
+                         for institute_id, pdci in pdcis.items()})
+
     def check_before_remove(self, instance):
         if Accession.objects.filter(institute=instance).count():
             error = 'Can not remove institute, it has accessions associates to it'
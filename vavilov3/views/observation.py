@@ -18,6 +18,7 @@
 
 from django.db.models import Q
 from django.contrib.auth.models import AnonymousUser
+from django.http.response import StreamingHttpResponse
 
 from rest_framework import viewsets, status
 from rest_framework.settings import api_settings
@@ -29,18 +30,28 @@ from rest_framework.exceptions import ValidationError
 from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    StandardResultsSetPagination,
                                    BulkOperationsMixin,
-                                   OptionalStreamedListCsvMixin)
-from vavilov3.models import Observation
-from vavilov3.permissions import ObservationByStudyPermission, is_user_admin
+                                   OptionalStreamedListCsvMixin,
+                                   ExportMixin,
+                                   validate_and_stage_items,
+                                   create_from_staged_items)
+from vavilov3.models import (Observation, bump_data_versions, OBSERVATION_DATA,
+                             OBSERVATION_VARIABLE_DATA)
+from vavilov3.permissions import (ObservationByStudyPermission, is_user_admin,
+                                  get_permission_context)
 from vavilov3.serializers.observation import ObservationSerializer
 from vavilov3.entities.observation import (ObservationStruct, TRAITS_IN_COLUMNS,
-                                           CREATE_OBSERVATION_UNITS)
+                                           CREATE_OBSERVATION_UNITS,
+                                           plan_observation_queryset)
 from vavilov3.filters.observation import ObservationFilter
 from vavilov3.conf.settings import OBSERVATION_CSV_FIELDS
 from vavilov3.views import format_error_message
-from vavilov3.serializers.shared import serialize_entity_from_excel
-from vavilov3.excel import excel_dict_reader
+from vavilov3.serializers.shared import iter_entities_from_rows
+from vavilov3.excel import excel_dict_reader, tabular_dict_reader
 from vavilov3.entities.tags import GERMPLASM_NUMBER, INSTITUTE_CODE
+from vavilov3.observation_matrix import (PARQUET_FORMAT, MATRIX_FORMATS,
+                                         MATRIX_CONTENT_TYPES, MATRIX_SUFFIXES,
+                                         is_columnar_export_available,
+                                         iter_observation_matrix)
 
 
 class PaginatedObservationCSVRenderer(renderers.CSVStreamingRenderer):
@@ -57,15 +68,20 @@ class PaginatedObservationCSVRendererNoHeader(PaginatedObservationCSVRenderer):
     format = 'csv_no_header'
 
 
-class ObservationViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet,
-                         BulkOperationsMixin, OptionalStreamedListCsvMixin):
+class ObservationViewSet(DynamicFieldsViewMixin, ExportMixin,
+                         OptionalStreamedListCsvMixin,
+                         viewsets.ModelViewSet, BulkOperationsMixin):
     lookup_field = 'observation_id'
     serializer_class = ObservationSerializer
     queryset = Observation.objects.all().order_by('observation_id')
+    queryset_planner = staticmethod(plan_observation_queryset)
     filter_class = ObservationFilter
     permission_classes = (ObservationByStudyPermission,)
     pagination_class = StandardResultsSetPagination
+    cursor_ordering = ('observation_id',)
     Struct = ObservationStruct
+    csv_fields = OBSERVATION_CSV_FIELDS
+    export_data_versions = (OBSERVATION_DATA, OBSERVATION_VARIABLE_DATA)
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
         [PaginatedObservationCSVRenderer, PaginatedObservationCSVRendererNoHeader]
     ordering_fields = ('value', 'observation_variable__name',
@@ -83,27 +99,55 @@ class ObservationViewSet(DynamicFieldsViewMixin, viewsets.ModelViewSet,
         elif is_user_admin(user):
             return queryset
         else:
-            try:
-                user_groups = user.groups.all()
-            except (IndexError, AttributeError):
-                user_groups = None
-            if user_groups:
+            user_group_ids = get_permission_context(user).group_ids
+            if user_group_ids:
                 return queryset.filter(Q(observation_unit__study__is_public=True) |
-                                       Q(observation_unit__study__group__in=user_groups))
+                                       Q(observation_unit__study__group__in=user_group_ids))
             else:
                 return queryset.filter(study__is_public=True)
 
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_data_versions(OBSERVATION_DATA)
+
+    @action(methods=['get'], detail=False)
+    def matrix(self, request):
+        matrix_format = request.query_params.get('matrix_format',
+                                                 PARQUET_FORMAT)
+        if matrix_format not in MATRIX_FORMATS:
+            msg = 'matrix format must be one of: {}'
+            msg = msg.format(', '.join(MATRIX_FORMATS))
+            raise ValidationError(format_error_message(msg))
+        if not is_columnar_export_available():
+            msg = 'pyarrow must be installed to export the observation matrix'
+            return Response(format_error_message(msg),
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        response = StreamingHttpResponse(
+            streaming_content=iter_observation_matrix(queryset, matrix_format),
+            content_type=MATRIX_CONTENT_TYPES[matrix_format])
+        filename = 'observations{}'.format(MATRIX_SUFFIXES[matrix_format])
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(filename)
+        return response
+
     @action(methods=['post'], detail=False)
     def bulk(self, request):
         action = request.method
 #         prev_time = time()
         try:
             data, conf = serialize_observations_from_request(request)
+            self.conf = conf
+            if 'multipart/form-data' in request.content_type:
+                staged_items = validate_and_stage_items(self, data)
         except ValueError as error:
             msg = 'Could not read file: {}'.format(error)
             raise ValidationError(format_error_message(msg))
 
-        self.conf = conf
+        if 'multipart/form-data' in request.content_type and action == 'POST':
+            async_result = create_from_staged_items(self, staged_items)
+            return Response({'task_id': async_result.id},
+                            status=status.HTTP_200_OK, headers={})
         if action == 'POST':
             serializer = self.get_serializer(data=data, many=True)
             serializer.is_valid(raise_exception=True)
@@ -160,7 +204,7 @@ def serialize_observations_from_request(request):
         create_observation_units = request.data.get(CREATE_OBSERVATION_UNITS, None)
         if traits_in_columns:
             fhand = request.FILES['file'].file
-            data = list(parse_traits_in_columns_excel(fhand))
+            data = parse_traits_in_columns_excel(fhand)
 
             conf = {TRAITS_IN_COLUMNS: traits_in_columns,
                     CREATE_OBSERVATION_UNITS: create_observation_units}
@@ -172,7 +216,8 @@ def serialize_observations_from_request(request):
                 msg = 'could not found the file'
                 raise ValueError(msg)
 
-            data = serialize_entity_from_excel(fhand, ObservationStruct)
+            data = iter_entities_from_rows(tabular_dict_reader(fhand),
+                                           ObservationStruct)
 
     else:
         data = request.data
@@ -16,9 +16,12 @@
 #
 #
 
+import os
 import logging
 import tempfile
 import subprocess
+from zipfile import is_zipfile
+
 from django.db.models import Q
 from django.contrib.auth.models import AnonymousUser
 
@@ -31,12 +34,14 @@ from rest_framework.exceptions import ValidationError
 from vavilov3.views.shared import (StandardResultsSetPagination,
                                    DynamicFieldsViewMixin)
 from vavilov3.models import ObservationImage
-from vavilov3.permissions import ObservationByStudyPermission, is_user_admin
+from vavilov3.permissions import (ObservationByStudyPermission, is_user_admin,
+                                  get_permission_context)
 from vavilov3.serializers.observation_image import ObservationImageSerializer
 from vavilov3.filters.observation_image import ObservationImageFilter
 from vavilov3.entities.observation import CREATE_OBSERVATION_UNITS
-from vavilov3.tasks import (extract_files_from_zip, delete_image,
-                            add_task_to_user)
+from vavilov3.entities.observation_image import plan_observation_image_queryset
+from vavilov3.tasks import (create_observation_images_from_zip_task,
+                            delete_image, add_task_to_user)
 from vavilov3.views import format_error_message
 from vavilov3.conf.settings import TMP_DIR
 
@@ -47,6 +52,7 @@ class ObservationImageViewSet(DynamicFieldsViewMixin, ModelViewSet):
     lookup_field = 'observation_image_uid'
     serializer_class = ObservationImageSerializer
     queryset = ObservationImage.objects.all()
+    queryset_planner = staticmethod(plan_observation_image_queryset)
     filter_class = ObservationImageFilter
     permission_classes = (ObservationByStudyPermission,)
     pagination_class = StandardResultsSetPagination
@@ -61,58 +67,45 @@ class ObservationImageViewSet(DynamicFieldsViewMixin, ModelViewSet):
         elif is_user_admin(user):
             return queryset
         else:
-            try:
-                user_groups = user.groups.all()
-            except (IndexError, AttributeError):
-                user_groups = None
-            if user_groups:
+            user_group_ids = get_permission_context(user).group_ids
+            if user_group_ids:
                 return queryset.filter(Q(observation_unit__study__is_public=True) |
-                                       Q(observation_unit__study__group__in=user_groups))
+                                       Q(observation_unit__study__group__in=user_group_ids))
             else:
                 return queryset.filter(study__is_public=True)
 
     @action(methods=['post'], detail=False)
     def bulk(self, request):
-        action = request.method
-#         prev_time = time()
-        with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp_dir:
-            extract_dir = tmp_dir
-
-        if 'multipart/form-data' in request.content_type:
-            create_observation_units = request.data.get(CREATE_OBSERVATION_UNITS, None)
-            fhand = request.FILES['file']
-            logger.debug('1')
-            with tempfile.NamedTemporaryFile(mode='wb', suffix='.zip',
-                                             dir=TMP_DIR) as destination:
-                for chunk in fhand.chunks():
-                    destination.write(chunk)
-                destination.flush()
-
-                subprocess.run(['chmod', '777', destination.name])
-                task = extract_files_from_zip.apply_async(args=[destination.name,
-                                                                extract_dir])
-                try:
-                    data = task.wait()
-                    add_task_to_user(self.request.user, task)
-                except ValueError as error:
-                    raise ValidationError(format_error_message(str(error)))
-
-        else:
+        if ('multipart/form-data' not in request.content_type or
+                'file' not in request.FILES):
             msg = 'Request must be a multipart/form-data request '
             msg += 'with at least a zip file'
             raise ValidationError(format_error_message(msg))
+        create_observation_units = request.data.get(CREATE_OBSERVATION_UNITS, None)
+        fhand = request.FILES['file']
+
+        # the workers read the zip from the shared tmp dir, the task removes it
+        with tempfile.NamedTemporaryFile(mode='wb', suffix='.zip',
+                                         dir=TMP_DIR,
+                                         delete=False) as destination:
+            for chunk in fhand.chunks():
+                destination.write(chunk)
+        subprocess.run(['chmod', '777', destination.name])
+        if not is_zipfile(destination.name):
+            os.remove(destination.name)
+            raise ValidationError(format_error_message('File must be a zip file'))
+
+        self.conf = {CREATE_OBSERVATION_UNITS: create_observation_units}
+        try:
+            async_result = create_observation_images_from_zip_task.delay(
+                destination.name, request.user.username, self.conf)
+        except BaseException:
+            os.remove(destination.name)
+            raise
+        add_task_to_user(request.user, async_result)
+        return Response({'task_id': async_result.id},
+                        status=status.HTTP_200_OK, headers={})
 
-        self.conf = {CREATE_OBSERVATION_UNITS: create_observation_units,
-                     'extraction_dir': extract_dir}
-
-        if action == 'POST':
-            serializer = self.get_serializer(data=data, many=True)
-            serializer.is_valid(raise_exception=True)
-            self.perform_create(serializer)
-            return Response({'task_id': serializer.instance.id},
-                            status=status.HTTP_200_OK, headers={})
-
-#
     _conf = None
 
     def perform_destroy(self, instance):
@@ -130,26 +123,3 @@ class ObservationImageViewSet(DynamicFieldsViewMixin, ModelViewSet):
     def conf(self, conf):
         self._conf = conf
 
-
-def serialize_observation_images_from_request(request, tmp_extract_dir):
-    conf = None
-    if 'multipart/form-data' in request.content_type:
-        create_observation_units = request.data.get(CREATE_OBSERVATION_UNITS, None)
-        zip_file = request.FILES['file'].file
-        logger.debug(type(request.FILES['file']))
-        logger.debug(request.FILES['file'].name)
-        logger.debug(dir(request.FILES['file']))
-        logger.debug(type(zip_file))
-        logger.debug(dir(zip_file))
-        try:
-            data = list(extract_files_from_zip(zip_file, extract_dir=tmp_extract_dir,
-                                               make_group_writable=True))
-        except ValueError as error:
-            raise ValidationError(format_error_message(error))
-
-        conf = {CREATE_OBSERVATION_UNITS: create_observation_units,
-                'extraction_dir': tmp_extract_dir}
-    else:
-        msg = 'Request must be a multipart/form-data request with at least a zip file'
-        raise ValidationError(format_error_message(msg))
-    return data, conf
@@ -22,10 +22,11 @@ from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    StandardResultsSetPagination,
                                    ByObjectStudyPermMixin, BulkOperationsMixin,
                                    CheckBeforeRemoveMixim)
-from vavilov3.models import ObservationUnit
+from vavilov3.models import ObservationUnit, bump_data_versions, OBSERVATION_DATA
 from vavilov3.permissions import ObservationUnitByStudyPermission
 from vavilov3.serializers.observation_unit import ObservationUnitSerializer
-from vavilov3.entities.observation_unit import ObservationUnitStruct
+from vavilov3.entities.observation_unit import (ObservationUnitStruct,
+                                                plan_observation_unit_queryset)
 from vavilov3.filters.observation_unit import ObservationUnitFilter
 
 
@@ -35,7 +36,12 @@ class ObservationUnitViewSet(ByObjectStudyPermMixin, DynamicFieldsViewMixin,
     lookup_field = "name"
     serializer_class = ObservationUnitSerializer
     queryset = ObservationUnit.objects.all()
+    queryset_planner = staticmethod(plan_observation_unit_queryset)
     filter_class = ObservationUnitFilter
     permission_classes = (ObservationUnitByStudyPermission,)
     pagination_class = StandardResultsSetPagination
     Struct = ObservationUnitStruct
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        bump_data_versions(OBSERVATION_DATA)
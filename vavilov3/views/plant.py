@@ -24,7 +24,8 @@ from vavilov3.views.shared import (DynamicFieldsViewMixin,
                                    StandardResultsSetPagination,
                                    BulkOperationsMixin, CheckBeforeRemoveMixim)
 from vavilov3.models import Plant
-from vavilov3.permissions import UserGroupObjectPermission, is_user_admin
+from vavilov3.permissions import (UserGroupObjectPermission, is_user_admin,
+                                  get_permission_context)
 from vavilov3.serializers.plant import PlantSerializer
 from vavilov3.entities.plant import PlantStruct
 from vavilov3.filters.plant import PlantFilter
@@ -51,12 +52,9 @@ class PlantViewSet(DynamicFieldsViewMixin, CheckBeforeRemoveMixim,
         elif is_user_admin(user):
             return queryset
         else:
-            try:
-                user_groups = user.groups.all()
-            except (IndexError, AttributeError):
-                user_groups = None
-            if user_groups:
+            user_group_ids = get_permission_context(user).group_ids
+            if user_group_ids:
                 return queryset.filter(Q(observation_units__study__is_public=True) |
-                                       Q(group__in=user_groups)).distinct()
+                                       Q(group__in=user_group_ids)).distinct()
             else:
                 return queryset.filter(observation_units__study__is_public=True).distinct()
@@ -16,22 +16,37 @@
 #
 #
 
+import csv
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as B64DecodeError
 from time import time
 
+from django.core.cache import cache
+from django.db import connections
 from django.http.response import StreamingHttpResponse
 
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import ValidationError, NotFound
 from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 from vavilov3.permissions import (filter_queryset_by_user_group_public_permissions,
                                   filter_queryset_by_study_permissions,
                                   filter_queryset_by_obs_unit_in_study_permissions)
 from vavilov3.views import format_error_message
-from vavilov3.serializers.shared import serialize_entity_from_excel
+from vavilov3.serializers.shared import iter_entities_from_rows
+from vavilov3.excel import tabular_dict_reader
+from vavilov3.staging import ItemStager, chunks
+from vavilov3.export import CSV_EXPORT, EXPORT_FORMATS
+from vavilov3.tasks import export_items_task, add_task_to_user
+from vavilov3.conf.settings import (BULK_CHUNK_SIZE, CSV_EXPORT_CHUNK_SIZE,
+                                    APPROXIMATE_COUNT_THRESHOLD,
+                                    EXACT_COUNT_CACHE_TIMEOUT)
 
 
 def calc_duration(action, prev_time):
@@ -41,13 +56,40 @@ def calc_duration(action, prev_time):
     return now
 
 
+def validate_and_stage_items(view, documents):
+    """It validates the documents in chunks and writes the validated ones to
+    a staging file, the whole upload is never kept in memory"""
+    errors = []
+    stager = ItemStager()
+    try:
+        for chunk in chunks(documents, BULK_CHUNK_SIZE):
+            serializer = view.get_serializer(data=chunk, many=True)
+            if serializer.is_valid():
+                stager.write(serializer.validated_data)
+                errors.extend([{}] * len(chunk))
+            else:
+                errors.extend(serializer.errors)
+    except BaseException:
+        stager.remove()
+        raise
+    stager.close()
+    if any(errors):
+        stager.remove()
+        raise ValidationError(errors)
+    return stager.fpath
+
+
+def create_from_staged_items(view, staged_items):
+    serializer = view.get_serializer(many=True)
+    return serializer.create(staged_items)
+
+
 class BulkOperationsMixin(object):
 
     @action(methods=['post'], detail=False)
     def bulk(self, request):
         action = request.method
 #         prev_time = time()
-        data = request.data
         if 'multipart/form-data' in request.content_type:
             try:
                 fhand = request.FILES['file'].file
@@ -55,10 +97,18 @@ class BulkOperationsMixin(object):
                 msg = 'could not found the file'
                 raise ValidationError(format_error_message(msg))
             try:
-                data = serialize_entity_from_excel(fhand, self.Struct)
+                documents = iter_entities_from_rows(tabular_dict_reader(fhand),
+                                                    self.Struct)
+                staged_items = validate_and_stage_items(self, documents)
             except ValueError as error:
                 msg = 'Could not read file: {}'.format(error)
                 raise ValidationError(format_error_message(msg))
+
+            if action == 'POST':
+                async_result = create_from_staged_items(self, staged_items)
+                return Response({'task_id': async_result.id},
+                                status=status.HTTP_200_OK,
+                                headers={})
         else:
             data = request.data
 
@@ -92,13 +142,16 @@ class TooglePublicMixim:
         queryset = self.filter_queryset(self.get_queryset())
         filterset = self.filter_class(search_params, queryset)
 
-        filterset.qs.update(is_public=is_public)
+        self.toggle_public_items(filterset.qs, is_public)
 
         msg = "{} {} made {}".format(filterset.qs.count(),
                                      self.serializer_class.data_type,
                                      'public' if is_public else 'private')
         return Response(format_error_message(msg), status=status.HTTP_200_OK)
 
+    def toggle_public_items(self, queryset, is_public):
+        queryset.update(is_public=is_public)
+
 
 class ByObjectStudyPermMixin(object):
 
@@ -115,27 +168,205 @@ class ByObservationUnitInStudyPermMixin(object):
 
 
 class DynamicFieldsViewMixin(object):
+    # function(queryset, fields) that adds to the queryset the joins and
+    # prefetches needed to serialize the requested fields
+    queryset_planner = None
 
-    def get_serializer(self, *args, **kwargs):
-        serializer_class = self.get_serializer_class()
-
+    def get_requested_fields(self):
         fields = None
-
         if self.request.method == 'GET':
             query_fields = self.request.query_params.get("fields", None)
             if query_fields:
                 fields = tuple(query_fields.split(','))
+        return fields
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.queryset_planner is not None and self.request.method == 'GET':
+            queryset = self.queryset_planner(queryset,
+                                             self.get_requested_fields())
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer_class = self.get_serializer_class()
         kwargs['context'] = self.get_serializer_context()
-        kwargs['fields'] = fields
+        kwargs['fields'] = self.get_requested_fields()
 
         return serializer_class(*args, **kwargs)
 
 
+def estimate_queryset_count(queryset):
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def _get_count_cache_key(queryset):
+    sql, params = queryset.query.sql_with_params()
+    key = hashlib.md5(repr((sql, params)).encode()).hexdigest()
+    return 'vavilov3_count_{}'.format(key)
+
+
+def count_queryset(queryset, exact=False):
+    '''It returns the number of items in the queryset and whether the
+    number is an estimation.
+
+    The big querysets are not counted unless the exact count is asked,
+    the planner estimation is used instead. The exact counts of the
+    big querysets are cached by their query'''
+    key = _get_count_cache_key(queryset)
+    count = cache.get(key)
+    if count is not None:
+        return count, False
+    if exact:
+        count = queryset.count()
+        if count > APPROXIMATE_COUNT_THRESHOLD:
+            cache.set(key, count, EXACT_COUNT_CACHE_TIMEOUT)
+        return count, False
+    estimation = estimate_queryset_count(queryset)
+    if estimation > APPROXIMATE_COUNT_THRESHOLD:
+        return estimation, True
+    return queryset.count(), False
+
+
+def _filter_by_keyset(queryset, ordering, position, reverse):
+    # the orderings with several fields are compared as a row value, so the
+    # database can do a range scan in the index of the ordering
+    lookup = 'lt' if reverse else 'gt'
+    if len(ordering) == 1:
+        filter_ = {'{}__{}'.format(ordering[0], lookup): position[0]}
+        return queryset.filter(**filter_)
+    quote_name = connections[queryset.db].ops.quote_name
+    opts = queryset.model._meta
+    table = quote_name(opts.db_table)
+    columns = ', '.join('{}.{}'.format(table,
+                                       quote_name(opts.get_field(field).column))
+                        for field in ordering)
+    placeholders = ', '.join(['%s'] * len(ordering))
+    where = '({}) {} ({})'.format(columns, '<' if reverse else '>',
+                                  placeholders)
+    return queryset.extra(where=[where], params=position)
+
+
 class LinkHeaderPagination(LimitOffsetPagination):
     """ Inform the user of pagination links via response headers, similar to
     what's described in
     https://developer.github.com/guides/traversing-with-pagination/.
+
+    The views with a cursor_ordering, unique and ascending, can also be
+    paginated by a cursor (keyset), the first page is asked with an empty
+    cursor and the rest with the cursors given in the links.
     """
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    exact_count = 'exact'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        exact = request.query_params.get(self.count_query_param) == self.exact_count
+        self.count, self.count_is_estimation = count_queryset(queryset,
+                                                              exact=exact)
+
+        self.cursor_ordering = getattr(view, 'cursor_ordering', None)
+        if (self.cursor_ordering is not None and
+                self.cursor_query_param in request.query_params):
+            return self._paginate_queryset_by_cursor(queryset, request)
+        self.cursor_ordering = None
+
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        has_next = len(results) > self.limit
+        results = results[:self.limit]
+        # the estimation is corrected with what we have seen, so the links
+        # are right
+        if self.count_is_estimation:
+            num_seen = self.offset + len(results)
+            if not has_next and results:
+                self.count, self.count_is_estimation = num_seen, False
+            elif has_next and self.count <= num_seen:
+                self.count = num_seen + 1
+        return results
+
+    def _decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (B64DecodeError, UnicodeDecodeError, ValueError, KeyError,
+                TypeError):
+            raise NotFound(self.invalid_cursor_message)
+        if (not isinstance(position, list) or
+                len(position) != len(self.cursor_ordering)):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def _encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': int(reverse)})
+        return urlsafe_b64encode(cursor.encode()).decode()
+
+    def _get_position(self, item):
+        return [getattr(item, field) for field in self.cursor_ordering]
+
+    def _paginate_queryset_by_cursor(self, queryset, request):
+        position, reverse = self._decode_cursor(request)
+        if reverse:
+            queryset = queryset.order_by(*['-' + field
+                                           for field in self.cursor_ordering])
+        else:
+            queryset = queryset.order_by(*self.cursor_ordering)
+        if position is not None:
+            queryset = _filter_by_keyset(queryset, self.cursor_ordering,
+                                         position, reverse)
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        if results:
+            self.first_position = self._get_position(results[0])
+            self.last_position = self._get_position(results[-1])
+        else:
+            self.has_next = self.has_previous = False
+        return results
+
+    def _get_cursor_link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   self._encode_cursor(position, reverse))
+
+    def get_next_link(self):
+        if self.cursor_ordering is None:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return self._get_cursor_link(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.cursor_ordering is None:
+            return super().get_previous_link()
+        if not self.has_previous:
+            return None
+        return self._get_cursor_link(self.first_position, reverse=True)
 
     def get_paginated_response(self, data):
         links = []
@@ -146,6 +377,8 @@ class LinkHeaderPagination(LimitOffsetPagination):
 
         headers = {'Link': ', '.join(links)} if links else {}
         headers['X-Total-Count'] = self.count
+        if self.count_is_estimation:
+            headers['X-Total-Count-Estimated'] = 'true'
 
         return Response(data, headers=headers)
 
@@ -182,19 +415,99 @@ class MultipleFieldLookupMixin(object):
         return obj
 
 
+def iter_queryset_by_keyset(queryset, ordering, chunk_size):
+    '''It yields the queryset items querying them by chunks ordered by the
+    given unique ordering.
+
+    Every chunk is a new query, so the prefetches are done by chunk and the
+    whole queryset is never in memory'''
+    queryset = queryset.order_by(*ordering)
+    position = None
+    while True:
+        chunk = queryset
+        if position is not None:
+            chunk = _filter_by_keyset(chunk, ordering, position,
+                                      reverse=False)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        position = [getattr(chunk[-1], field) for field in ordering]
+
+
+class _CsvLineBuffer:
+    # csv.writer writes each line here and we get it back
+    def write(self, line):
+        return line
+
+
 class OptionalStreamedListCsvMixin():
+    '''The csv lists are streamed from the database unless they are
+    paginated. The views give the csv_fields and the Struct used to convert
+    the instances into csv rows'''
+    csv_fields = None
+    csv_chunk_size = CSV_EXPORT_CHUNK_SIZE
 
     def list(self, request, *args, **kwargs):
-        if request.accepted_media_type == 'text/csv':
+        limit_query_param = getattr(self.paginator, 'limit_query_param', None)
+        if (request.accepted_media_type == 'text/csv' and
+                limit_query_param not in request.query_params):
             queryset = self.filter_queryset(self.get_queryset())
-            if queryset.count() > 10000:
-                serializer = self.get_serializer(queryset, many=True)
+            with_header = request.accepted_renderer.format != 'csv_no_header'
+            return StreamingHttpResponse(
+                streaming_content=self.iter_csv_lines(queryset, with_header),
+                content_type="text/csv")
+
+        return super().list(request, *args, **kwargs)
+
+    def iter_csv_row_chunks(self, queryset):
+        ordering = getattr(self, 'cursor_ordering', None)
+        if ordering is None:
+            ordering = (queryset.model._meta.pk.name,)
+        fields = self.get_requested_fields()
+        for chunk in iter_queryset_by_keyset(queryset, ordering,
+                                             self.csv_chunk_size):
+            yield [self.get_csv_row(instance, fields) for instance in chunk]
+
+    def iter_csv_lines(self, queryset, with_header=True):
+        writer = csv.writer(_CsvLineBuffer())
+        if with_header:
+            yield writer.writerow(self.csv_fields)
+        for rows in self.iter_csv_row_chunks(queryset):
+            yield ''.join(writer.writerow(row) for row in rows)
+
+    def get_csv_row(self, instance, fields=None):
+        struct = self.Struct(instance=instance, fields=fields)
+        return struct.to_list_representation(self.csv_fields)
+
+
+class ExportMixin:
+    # the data versions that invalidate the cached exports of the view
+    export_data_versions = ()
 
-                return StreamingHttpResponse(
-                    streaming_content=request.accepted_renderer.render(serializer.data),
-                    content_type="text/csv")
+    @action(methods=['post'], detail=False)
+    def export(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            msg = 'You must be logged in to export'
+            return Response(format_error_message(msg),
+                            status=status.HTTP_401_UNAUTHORIZED)
+        export_format = request.data.get('export_format', CSV_EXPORT)
+        if export_format not in EXPORT_FORMATS:
+            msg = 'export format must be one of: {}'
+            msg = msg.format(', '.join(EXPORT_FORMATS))
+            raise ValidationError(format_error_message(msg))
+        search_params = request.data.get('search_params', {})
+        if not isinstance(search_params, dict):
+            msg = 'search_params must be a dictionary'
+            raise ValidationError(format_error_message(msg))
 
-        return super().list(self, request, *args, **kwargs)
+        view_path = '{}.{}'.format(type(self).__module__, type(self).__name__)
+        async_result = export_items_task.delay(view_path, search_params,
+                                               user.username, export_format)
+        add_task_to_user(user, async_result)
+        return Response({'task_id': async_result.id},
+                        status=status.HTTP_200_OK)
 
 
 class ListModelMixinWithErrorCheck():
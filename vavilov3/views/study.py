@@ -49,9 +49,8 @@ class PaginatedStudyCSVRenderernoHeader(PaginatedStudyCSVRenderer):
 
 
 class StudyViewSet(GroupObjectPublicPermMixin, DynamicFieldsViewMixin,
-                   CheckBeforeRemoveMixim,
-                   viewsets.ModelViewSet, BulkOperationsMixin,
-                   OptionalStreamedListCsvMixin):
+                   CheckBeforeRemoveMixim, OptionalStreamedListCsvMixin,
+                   viewsets.ModelViewSet, BulkOperationsMixin):
     lookup_field = 'name'
     queryset = Study.objects.all().order_by('name')
     serializer_class = StudySerializer
@@ -61,4 +60,5 @@ class StudyViewSet(GroupObjectPublicPermMixin, DynamicFieldsViewMixin,
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + \
         [PaginatedStudyCSVRenderer, PaginatedStudyCSVRenderernoHeader]
     Struct = StudyStruct
+    csv_fields = STUDY_CSV_FIELDS
     ordering = ('name',)
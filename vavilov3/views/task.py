@@ -16,23 +16,30 @@
 #
 #
 
+from os.path import basename
+
 from django.contrib.auth.models import AnonymousUser
+from django.http.response import FileResponse
 
 from rest_framework import viewsets, status
+from rest_framework.decorators import action
 from rest_framework.response import Response
 
-from django_celery_results.models import TaskResult
-
 from vavilov3.views import format_error_message
-from vavilov3.models import UserTasks
+from vavilov3.models import UserTasks, TaskRecord
 from vavilov3.permissions import is_user_admin
+from vavilov3.views.shared import StandardResultsSetPagination
 from vavilov3.entities.task_result_getter import (TaskResultGetter,
-                                                  TaskDoesNotExistError,
-                                                  get_active_tasks)
+                                                  TaskDoesNotExistError)
+from vavilov3.entities.task_record import (get_task_record_data,
+                                           get_task_record_artifact_path,
+                                           delete_task_record)
+from vavilov3.export import get_export_storage
 
 
 class TaskViewSet(viewsets.ViewSet):
     lookup_field = 'task_id'
+    pagination_class = StandardResultsSetPagination
 
     @staticmethod
     def filter_by_permission(task_ids, user):
@@ -52,13 +59,48 @@ class TaskViewSet(viewsets.ViewSet):
             return Response(format_error_message('Task does not exists'),
                             status=status.HTTP_404_NOT_FOUND)
         try:
-            task = TaskResultGetter(task_id)
+            record = TaskRecord.objects.select_related('user').get(task_id=task_id)
+        except TaskRecord.DoesNotExist:
+            record = None
+        if record is not None:
+            return Response(get_task_record_data(record),
+                            status=status.HTTP_200_OK)
+
+        # the tasks sent before the task registry existed
+        try:
+            task = TaskResultGetter(task_id, inspect_active=False)
         except TaskDoesNotExistError:
             return Response(format_error_message('Task does not exists'),
                             status=status.HTTP_404_NOT_FOUND)
 
         return Response(task.data, status=status.HTTP_200_OK)
 
+    @action(detail=True, methods=['get'])
+    def artifact(self, request, task_id):
+        try:
+            task_id = self.filter_by_permission([task_id], user=request.user)[0]
+        except IndexError:
+            return Response(format_error_message('Task does not exists'),
+                            status=status.HTTP_404_NOT_FOUND)
+        try:
+            record = TaskRecord.objects.get(task_id=task_id)
+            artifact_path = get_task_record_artifact_path(record)
+        except TaskRecord.DoesNotExist:
+            try:
+                task = TaskResultGetter(task_id, inspect_active=False)
+            except TaskDoesNotExistError:
+                return Response(format_error_message('Task does not exists'),
+                                status=status.HTTP_404_NOT_FOUND)
+            artifact_path = task.artifact_path
+
+        storage = get_export_storage()
+        if artifact_path is None or not storage.exists(artifact_path):
+            return Response(format_error_message('Task has no artifact'),
+                            status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(storage.open(artifact_path, 'rb'),
+                            as_attachment=True,
+                            filename=basename(artifact_path))
+
     def delete(self, request, task_id):
         try:
             task_id = self.filter_by_permission([task_id], user=request.user)[0]
@@ -66,30 +108,36 @@ class TaskViewSet(viewsets.ViewSet):
             return Response(format_error_message('You dont have permissions'),
                             status=status.HTTP_403_FORBIDDEN)
 
-        task = TaskResultGetter(task_id)
+        try:
+            record = TaskRecord.objects.get(task_id=task_id)
+        except TaskRecord.DoesNotExist:
+            record = None
+        if record is not None:
+            delete_task_record(record)
+            return Response({}, status=status.HTTP_204_NO_CONTENT)
+
+        try:
+            task = TaskResultGetter(task_id, inspect_active=False)
+        except TaskDoesNotExistError:
+            return Response(format_error_message('Task does not exists'),
+                            status=status.HTTP_404_NOT_FOUND)
         task.delete()
         return Response({}, status=status.HTTP_204_NO_CONTENT)
 
     def list(self, request):
-        try:
-            active_tasks_by_ids = get_active_tasks()
-        except ValueError:
-            active_tasks_by_ids = {}
-        task_ids = []
-
-        task_ids.extend(active_tasks_by_ids.keys())
-        for task_result in TaskResult.objects.all():
-            task_ids.append(task_result.task_id)
-
-        task_ids = self.filter_by_permission(task_ids, user=request.user)
-        tasks = []
-        for task_id in task_ids:
-            try:
-                task = TaskResultGetter(task_id)
-            except TaskDoesNotExistError:
-                task = None
-            if task:
-                tasks.append(task)
-
-        return Response([task.data for task in tasks],
-                        status=status.HTTP_200_OK)
+        user = request.user
+        if isinstance(user, AnonymousUser):
+            return Response([], status=status.HTTP_200_OK)
+        # the internal tasks without owner are not listed
+        queryset = TaskRecord.objects.filter(user__isnull=False)
+        queryset = queryset.select_related('user').order_by('-date_created')
+        if not is_user_admin(user):
+            queryset = queryset.filter(user=user)
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if page is None:
+            return Response([get_task_record_data(record) for record in queryset],
+                            status=status.HTTP_200_OK)
+        return paginator.get_paginated_response([get_task_record_data(record)
+                                                 for record in page])
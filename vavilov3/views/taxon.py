@@ -16,19 +16,16 @@
 #
 #
 
-from django.db import connection
-
 from rest_framework import viewsets
 from rest_framework.response import Response
 from rest_framework.decorators import action
 
-from vavilov3.models import Taxon
+from vavilov3.models import Taxon, get_taxa_stats
 from vavilov3.views.shared import (MultipleFieldLookupMixin,
                                    StandardResultsSetPagination,
                                    DynamicFieldsViewMixin)
 from vavilov3.serializers.taxon import TaxonSerializer
 from vavilov3.filters.taxon import TaxonFilter
-from vavilov3.raw_stat_sql_commands import get_taxa_stas_raw_sql
 
 
 class TaxonViewSet(MultipleFieldLookupMixin, DynamicFieldsViewMixin,
@@ -43,37 +40,7 @@ class TaxonViewSet(MultipleFieldLookupMixin, DynamicFieldsViewMixin,
 
     @action(methods=['GET'], detail=False)
     def stats_by_rank(self, request):
-        stats = {}
-#         for accession_stat in Taxon.objects.raw(get_taxa_stas_raw_sql('accession')):
-#             print(accession_stat)
-        with connection.cursor() as cursor:
-            cursor.execute(get_taxa_stas_raw_sql('accession', request.user))
-            for taxon_stat in cursor.fetchall():
-                name = taxon_stat[1]
-                rank = taxon_stat[2]
-                num_accessions = taxon_stat[3]
-                if num_accessions != 0:
-                    if rank not in stats:
-                        stats[rank] = {}
-                    stats[rank][name] = {
-                        'num_accessions': num_accessions,
-                        'num_accessionsets': 0}
-        with connection.cursor() as cursor:
-            cursor.execute(get_taxa_stas_raw_sql('accessionset', request.user))
-            for taxon_stat in cursor.fetchall():
-                name = taxon_stat[1]
-                rank = taxon_stat[2]
-                num_accessionsets = taxon_stat[3]
-                if num_accessions != 0:
-                    if rank not in stats:
-                        stats[rank] = {}
-                    if name in stats[rank]:
-                        stats[rank][name]['num_accessionsets'] = num_accessionsets
-                    else:
-                        stats[rank][name] = {
-                            'num_accessions': 0,
-                            'num_accessionsets': num_accessionsets}
-        return Response(stats)
+        return Response(get_taxa_stats(request.user))
 #                 num_accessionsets = taxon_stat[4]
 #                 if (num_accessions != 0 or num_accessionsets != 0):
 #                     if rank not in stats:
@@ -30,6 +30,7 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 from datetime import timedelta
+from celery.schedules import crontab
 from .secret_keys import DJANGO_SECRET_KEY
 try:
     from .secret_keys import RECAPTCHA_SECRET
@@ -85,7 +86,8 @@ if cors_present:
     CORS_ORIGIN_WHITELIST = ('https://localhost:4200', 'http://localhost:4200')
     CORS_ALLOW_HEADERS = default_headers + ('authentication', 'Authorization',
                                             'recaptchatoken')
-    CORS_EXPOSE_HEADERS = ['Link', 'X-Total-Count', 'recaptchatoken']
+    CORS_EXPOSE_HEADERS = ['Link', 'X-Total-Count', 'X-Total-Count-Estimated',
+                           'recaptchatoken']
     CORS_ALLOW_METHODS = ('DELETE', 'GET', 'OPTIONS', 'PATCH', 'POST', 'PUT')
 
 ROOT_URLCONF = 'vavilov3_web.urls'
@@ -194,6 +196,16 @@ CELERY_BROKER_URL = 'amqp:///'
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'refresh-entity-stats': {'task': 'vavilov3.tasks.refresh_entity_stats_task',
+                             'schedule': crontab(hour=3, minute=0)},
+    'sweep-orphan-media-files': {'task': 'vavilov3.tasks.sweep_orphan_media_files_task',
+                                 'schedule': crontab(hour=4, minute=0)},
+    'remove-expired-exports': {'task': 'vavilov3.tasks.remove_expired_exports_task',
+                               'schedule': crontab(hour=4, minute=30)},
+    'remove-expired-task-records': {'task': 'vavilov3.tasks.remove_expired_task_records_task',
+                                    'schedule': crontab(hour=5, minute=0)},
+}
 
 # CELERY_BIN = "celery"
 # CELERY_APP = "vavilov3_web.celery:app"